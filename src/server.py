@@ -26,7 +26,7 @@ l = setup_logging()
 f = Flask(__name__)
 s = service()
 
-f.errorhandler(Exception)
+@f.errorhandler(Exception)
 def handle_invalid_usage(error):
     resp = json.dumps({
         "Err": str.format(
@@ -128,6 +128,17 @@ def ReleaseAddress():
         response = resp,
         headers  = dict(headers) ) )
 
+@f.route(
+    '/IpamDriver.ReserveAddresses',
+    methods = ['POST'] )
+def ReserveAddresses():
+    status, resp, headers = s.reserve_addresses(r)
+
+    return(R(
+        status   = status,
+        response = resp,
+        headers  = dict(headers) ) )
+
 if __name__ == '__main__':
     raise Exception(str.format(
         "Are you starting this web server with uWSGI?") )
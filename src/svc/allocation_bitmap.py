@@ -0,0 +1,322 @@
+import contextlib, fcntl, itertools, mmap, os, struct, threading
+from .handle_pool import handle_pool
+
+'''
+Persistent allocation bitmap for a single pool, one bit per host address. A set bit indicates
+that the address at that offset (relative to the pool's network address) cannot be leased, either
+because it is owned or because it is reserved (ex: network and broadcast addresses.)
+
+The file holds a header followed by the bits, it's memory-mapped and shared by every process. The header
+keeps a low-water mark: the index of a byte below which every byte is full, so that free addresses are
+searched from the mark rather than from the start of the pool. The mark is advanced by find_first_free and
+lowered when a bit below it is cleared, both under an exclusive lock of the file.
+
+Simple usage:
+
+b = allocation_bitmap.open('/data/30/410623/1681915904.30.bitmap', 4)
+
+b.create(reserved = [0, 3])
+
+offset = b.find_first_free()
+
+b.set(offset)
+
+'''
+class allocation_bitmap():
+    '''
+    pools larger than this many host addresses (ex: an IPv6 /64) are not indexed by a bitmap
+    '''
+    max_size = 2 ** 24
+
+    header = struct.Struct('<Q')
+
+    '''
+    number of bytes searched at once for a byte that isn't full
+    '''
+    chunk_size = 4096
+
+    bitmaps = handle_pool(256)
+
+    '''
+    Gets the bitmap for the specified file, mapped bitmaps are kept in a bounded pool shared within a
+    process. A mapped bitmap whose file was deleted or replaced (ex: re-created by another process) is
+    unmapped and the file is opened again, see is_stale.
+    '''
+    @staticmethod
+    def open(filename, size):
+        bitmap = allocation_bitmap.bitmaps.peek(filename)
+
+        if bitmap != None and ( bitmap.pid != os.getpid() or bitmap.is_stale() ):
+            allocation_bitmap.bitmaps.discard(filename)
+
+        return(allocation_bitmap.bitmaps.get(
+            filename,
+            lambda: allocation_bitmap(filename, size) ) )
+
+    '''
+    Creates a new (unmapped) bitmap instance
+
+    Parameters:
+
+    filename (str): path to the bitmap file
+    size (int): number of host addresses in the pool
+
+    '''
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size     = size
+        self.handle   = None
+        self.map      = None
+        self.pid      = os.getpid()
+        self.guard    = threading.Lock()
+
+    '''
+    Indicates whether a pool of the specified number of host addresses can be indexed by a bitmap
+    '''
+    @staticmethod
+    def supports_size(size):
+        return( size <= allocation_bitmap.max_size )
+
+    '''
+    Indicates whether the bitmap file has been created
+    '''
+    def exists(self):
+        return( os.path.exists(self.filename )
+                and os.stat(self.filename).st_size
+                == self.header.size + self.get_byte_length() )
+
+    '''
+    Indicates whether this bitmap is mapped from a file that is no longer the one at it's path
+    '''
+    def is_stale(self):
+        if self.map == None:
+            return(False)
+
+        try:
+            current = os.stat(self.filename)
+
+        except FileNotFoundError:
+            return(True)
+
+        mapped = os.fstat(self.handle.fileno() )
+
+        return( ( current.st_dev, current.st_ino ) != ( mapped.st_dev, mapped.st_ino ) )
+
+    '''
+    Gets the number of bytes holding the bits
+    '''
+    def get_byte_length(self):
+        return( ( self.size + 7 ) // 8 )
+
+    '''
+    Creates (or re-creates) the bitmap file, every offset in reserved and every padding bit past
+    the end of the pool is set. The file is written under a temporary name and renamed into place so
+    that no process maps a partially written bitmap.
+    '''
+    def create(self, reserved = []):
+        data = bytearray(self.get_byte_length() )
+
+        for offset in itertools.chain(
+                reserved,
+                range(self.size, len(data) * 8 ) ):
+
+            data[ offset // 8 ] |= 0x80 >> ( offset % 8 )
+
+        temporary = str.format(
+            "{}.{}.tmp",
+            self.filename,
+            os.getpid() )
+
+        os.makedirs(os.path.dirname(self.filename), exist_ok = True)
+
+        with open(temporary, 'wb') as handle:
+            handle.write(self.header.pack(0) )
+            handle.write(data)
+
+        os.replace(temporary, self.filename)
+
+        self.close()
+
+        return(self)
+
+    '''
+    Maps the bitmap file
+    '''
+    def get_map(self):
+        if self.map == None:
+            if not self.exists():
+                raise Exception(str.format(
+                    "allocation bitmap {} does not exist",
+                    self.filename ) )
+
+            self.handle = open(self.filename, 'r+b')
+            self.map    = mmap.mmap(self.handle.fileno(), 0)
+
+        return(self.map)
+
+    '''
+    Holds the bitmap file locked (LOCK_SH or LOCK_EX) for the duration of a with block, threads of this
+    process sharing the mapped bitmap are serialized as well
+    '''
+    @contextlib.contextmanager
+    def locked(self, mode):
+        with self.guard:
+            self.get_map()
+
+            fcntl.flock(self.handle, mode)
+
+            try:
+                yield(self.map)
+
+            finally:
+                fcntl.flock(self.handle, fcntl.LOCK_UN)
+
+    '''
+    Sets or clears the bit at the specified offset in place, the low-water mark is lowered when a bit below
+    it is cleared
+    '''
+    def update(self, offset, value):
+        if offset < 0 or offset >= self.size:
+            raise Exception(str.format(
+                "offset {} out of range for bitmap of size {}",
+                offset,
+                self.size ) )
+
+        with self.locked(fcntl.LOCK_EX) as data:
+            position = self.header.size + offset // 8
+
+            data[ position ] = ( value
+                                 and data[ position ] | ( 0x80 >> ( offset % 8 ) )
+                                 or data[ position ] & ~ ( 0x80 >> ( offset % 8 ) ) & 0xff )
+
+            if not value and offset // 8 < self.header.unpack_from(data, 0)[ 0 ]:
+                self.header.pack_into(data, 0, offset // 8)
+
+        return(self)
+
+    '''
+    Marks the address at the specified offset as unavailable
+    '''
+    def set(self, offset):
+        return(self.update(offset, True) )
+
+    '''
+    Marks the address at the specified offset as available
+    '''
+    def clear(self, offset):
+        return(self.update(offset, False) )
+
+    '''
+    Reads the bits of the bitmap file
+    '''
+    def read(self):
+        with self.locked(fcntl.LOCK_SH) as data:
+            return(data[ self.header.size: ] )
+
+    '''
+    Indicates whether the bit at the specified offset is set
+    '''
+    def is_set(self, offset):
+        with self.locked(fcntl.LOCK_SH) as data:
+            return( ( data[ self.header.size + offset // 8 ] & ( 0x80 >> ( offset % 8 ) ) ) != 0 )
+
+    '''
+    Gets the index of the first byte that isn't full from the specified byte, or the number of bytes if
+    every byte is full. Bytes are searched a chunk at a time with lstrip() rather than one by one.
+    '''
+    def find_non_full(self, data, index):
+        length = self.get_byte_length()
+
+        while index < length:
+            chunk    = data[ self.header.size + index:self.header.size + min(index + self.chunk_size, length) ]
+            stripped = chunk.lstrip(b'\xff')
+
+            if len(stripped) > 0:
+                return(index + len(chunk) - len(stripped) )
+
+            index = index + len(chunk)
+
+        return(length)
+
+    '''
+    Finds the offset of the first clear bit from start, or None if every address from start is unavailable.
+    The search starts at the low-water mark, which is advanced to the first byte that isn't full.
+    '''
+    def find_first_free(self, start = 0):
+        with self.locked(fcntl.LOCK_EX) as data:
+            mark  = self.header.unpack_from(data, 0)[ 0 ]
+            index = self.find_non_full(data, max(mark, start // 8) )
+
+            if start // 8 <= mark and index > mark:
+                self.header.pack_into(data, 0, index)
+
+            while index < self.get_byte_length():
+                offset = next( (
+                    index * 8 + bit for bit in range(8)
+                    if not data[ self.header.size + index ] & ( 0x80 >> bit )
+                    and index * 8 + bit >= start ), None )
+
+                if offset != None:
+                    if offset >= self.size:
+                        return(None)
+
+                    return(offset)
+
+                index = self.find_non_full(data, index + 1)
+
+            return(None)
+
+    '''
+    Finds the offsets of count clear bits, the first run of count consecutive clear bits if there is one,
+    otherwise the first count clear bits. Returns None if fewer than count addresses are available. The
+    bits from the low-water mark are read as a single integer so that runs are found with shifts rather
+    than a per-bit scan.
+    '''
+    def find_free_offsets(self, count):
+        with self.locked(fcntl.LOCK_SH) as data:
+            mark  = self.header.unpack_from(data, 0)[ 0 ]
+            bits  = data[ self.header.size + mark: ]
+
+        first = mark * 8
+        total = len(bits) * 8
+        free  = ~ int.from_bytes(bits, 'big') & ( ( 1 << total ) - 1 )
+
+        if count <= 0:
+            return( [] )
+
+        run    = free
+        length = 1
+
+        while length < count and run != 0:
+            shift = min(length, count - length)
+
+            run    &= run << shift
+            length += shift
+
+        if run != 0:
+            offset = first + total - run.bit_length()
+
+            return(list(range(offset, offset + count) ) )
+
+        offsets = []
+
+        while free != 0 and len(offsets) < count:
+            offsets.append(first + total - free.bit_length() )
+
+            free ^= 1 << ( free.bit_length() - 1 )
+
+        if len(offsets) < count:
+            return(None)
+
+        return(offsets)
+
+    '''
+    Unmaps the bitmap file
+    '''
+    def close(self):
+        if self.map != None:
+            self.map.close()
+            self.handle.close()
+
+        self.map    = None
+        self.handle = None
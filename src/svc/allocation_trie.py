@@ -0,0 +1,166 @@
+import threading
+
+'''
+In-memory binary trie (buddy allocator) of the blocks allocated within a scope. A block at level l is
+one of the scope's 2 ** l subnets with prefixlen scope prefixlen + l, identified by it's index among
+them. Each node stores the size of the largest free block beneath it, so that the first free block of
+a level is found by descending from the root (one step per level), and blocks of any level can be
+allocated side by side: allocating a block splits the free blocks above it, freeing a block merges it
+with it's buddy (the other half of it's parent) when the buddy is free as well. Nodes that are
+entirely free are not stored.
+
+Simple usage:
+
+from svc.allocation_trie import allocation_trie
+
+t = allocation_trie(32 - 20)
+
+t.set(10, 0)
+
+t.find_first_free(8)
+
+'''
+class allocation_trie():
+    '''
+    Creates a new allocation trie without allocated blocks
+
+    Parameters:
+
+    depth (int): number of bits between the scope's prefixlen and the smallest block's prefixlen
+
+    '''
+    def __init__(self, depth):
+        self.depth   = depth
+        self.largest = {}
+        self.blocks  = set()
+        self.levels  = set()
+        self.guard   = threading.Lock()
+
+    '''
+    Gets the state of the trie to store (ex: in a scope snapshot), without the guard
+    '''
+    def __getstate__(self):
+        return( { key: value for key, value in self.__dict__.items() if key != 'guard' } )
+
+    '''
+    Restores the state of a stored trie, with a new guard
+    '''
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        self.guard = threading.Lock()
+
+    '''
+    Gets the number of smallest blocks in a block of the specified level, the root is level 0
+    '''
+    def get_capacity(self, level):
+        return( 2 ** ( self.depth - level ) )
+
+    '''
+    Gets the size of the largest free block beneath a node
+    '''
+    def get_largest(self, level, index):
+        return( self.largest.get(
+            ( level, index ),
+            self.get_capacity(level) ) )
+
+    '''
+    Indicates whether a block and every block containing it are free
+    '''
+    def is_free(self, level, index):
+        return( all(
+            self.get_largest(parent, index >> ( level - parent ) ) > 0
+            for parent in range(level) )
+            and self.get_largest(level, index) == self.get_capacity(level) )
+
+    '''
+    Indicates whether the specified block is allocated
+    '''
+    def is_set(self, level, index):
+        return( ( level, index ) in self.blocks )
+
+    '''
+    Recomputes the largest free block of each node above the specified node, a node whose halves are
+    both entirely free is entirely free
+    '''
+    def update(self, level, index):
+        for parent in range(level - 1, -1, -1):
+            index = index >> 1
+
+            left  = self.get_largest(parent + 1, index * 2)
+            right = self.get_largest(parent + 1, index * 2 + 1)
+
+            if left == right == self.get_capacity(parent + 1):
+                self.largest.pop( ( parent, index ), None)
+
+            else:
+                self.largest[ ( parent, index ) ] = max(left, right)
+
+    '''
+    Allocates a free block, returns False if the block or part of it is already allocated
+    '''
+    def set(self, level, index):
+        with self.guard:
+            if not self.is_free(level, index):
+                return(False)
+
+            self.blocks.add( ( level, index ) )
+
+            self.levels.add(level)
+
+            self.largest[ ( level, index ) ] = 0
+
+            self.update(level, index)
+
+        return(True)
+
+    '''
+    Frees an allocated block, merging it with it's free buddies
+    '''
+    def clear(self, level, index):
+        with self.guard:
+            if not self.is_set(level, index):
+                return(False)
+
+            self.blocks.discard( ( level, index ) )
+
+            self.largest.pop( ( level, index ), None)
+
+            self.update(level, index)
+
+        return(True)
+
+    '''
+    Records that blocks of the specified level exist without allocating one, ex: released blocks whose
+    records are kept until they are collected
+    '''
+    def add_level(self, level):
+        with self.guard:
+            self.levels.add(level)
+
+    '''
+    Gets the levels that blocks were allocated at, levels are kept when their blocks are freed
+    '''
+    def get_levels(self):
+        with self.guard:
+            return(set(self.levels) )
+
+    '''
+    Gets the index of the first free block of the specified level, or None if there is none
+    '''
+    def find_first_free(self, level):
+        with self.guard:
+            size = self.get_capacity(level)
+
+            if self.get_largest(0, 0) < size:
+                return(None)
+
+            index = 0
+
+            for child in range(1, level + 1):
+                index = index * 2
+
+                if self.get_largest(child, index) < size:
+                    index += 1
+
+            return(index)
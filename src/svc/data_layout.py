@@ -0,0 +1,144 @@
+import logging, os, re
+
+'''
+Sharded directory layout of the per-scope files in the data directory. A scope's files are kept in
+<root>/<prefixlen>/<shard>/<network>.<prefixlen>.<extension>, where the shard is the scope's index among
+the networks of it's prefixlen divided by 2 ** shard_bits, so no directory holds more than
+2 ** shard_bits scopes of a prefixlen.
+
+Simple usage:
+
+from svc.data_layout import data_layout
+
+d = data_layout('/data')
+
+d.get_path(4, 32, 1681915905, 'json')
+
+'''
+class data_layout():
+    flat_file  = re.compile(r'^(\d+)\.(\d+)\.([a-z.]+)$')
+    shard_file = re.compile(r'^(\d+)\.(\d+)\.([a-z.]+?)((?:\.\d+)?\.tmp)?$')
+
+    '''
+    Creates a new data layout instance
+
+    Parameters:
+
+    root (str): the data directory
+    shard_bits (int): log2 of the number of scopes of a prefixlen in each shard directory
+
+    '''
+    def __init__(
+            self,
+            root       = '/data',
+            shard_bits = 12 ):
+
+        self.l          = logging.getLogger(__name__)
+        self.root       = root
+        self.shard_bits = shard_bits
+
+    '''
+    Gets the shard of a network of the specified TCP/IP version and prefixlen
+    '''
+    def get_shard(self, tcp_ip_ver, prefix, network):
+        return( network >> (
+            ( tcp_ip_ver == 4 and 32 or 128 )
+            - prefix
+            + self.shard_bits ) )
+
+    '''
+    Gets the directory holding the files of the specified shard
+    '''
+    def get_directory(self, prefix, shard):
+        return(os.path.join(
+            self.root,
+            str(prefix),
+            str(shard) ) )
+
+    '''
+    Gets the path of a scope's file with the specified extension
+    '''
+    def get_path(self, tcp_ip_ver, prefix, network, extension):
+        return(os.path.join(
+            self.get_directory(
+                prefix,
+                self.get_shard(tcp_ip_ver, prefix, network) ),
+            str.format(
+                "{}.{}.{}",
+                network,
+                prefix,
+                extension ) ) )
+
+    '''
+    Gets the directories that may hold files of the specified prefixlen for networks within [first, last]
+    '''
+    def get_directories(self, tcp_ip_ver, prefix, first, last):
+        if not os.path.isdir(os.path.join(self.root, str(prefix) ) ):
+            return
+
+        for shard in sorted(
+                int(index) for index in os.listdir(os.path.join(self.root, str(prefix) ) )
+                if index.isdigit() ):
+
+            if ( self.get_shard(tcp_ip_ver, prefix, first)
+                 <= shard
+                 <= self.get_shard(tcp_ip_ver, prefix, last) ):
+
+                yield(self.get_directory(prefix, shard) )
+
+    '''
+    Enumerates (directory, name) for every file in the shard directories, temporary files left by an
+    interrupted write (<network>.<prefix>.<extension>[.<pid>].tmp) included
+    '''
+    def get_files(self):
+        if not os.path.isdir(self.root):
+            return
+
+        for prefix in sorted(os.listdir(self.root) ):
+            if not prefix.isdigit() or not os.path.isdir(os.path.join(self.root, prefix) ):
+                continue
+
+            for shard in sorted(os.listdir(os.path.join(self.root, prefix) ) ):
+                directory = os.path.join(self.root, prefix, shard)
+
+                if not shard.isdigit() or not os.path.isdir(directory):
+                    continue
+
+                for name in sorted(os.listdir(directory) ):
+                    if self.shard_file.match(name) != None:
+                        yield( ( directory, name ) )
+
+    '''
+    Moves files of the flat layout (every scope's files directly in the data directory) into their shard
+    directories. Flat file names don't include the TCP/IP version, networks that don't fit in 32 bits or
+    have a prefixlen over 32 are taken to be IPv6.
+    '''
+    def migrate(self):
+        moved = 0
+
+        for name in os.listdir(self.root):
+            match = self.flat_file.match(name)
+
+            if match == None or not os.path.isfile(os.path.join(self.root, name) ):
+                continue
+
+            network, prefix, extension = int(match.group(1) ), int(match.group(2) ), match.group(3)
+
+            path = self.get_path(
+                ( network >= 2 ** 32 or prefix > 32 ) and 6 or 4,
+                prefix,
+                network,
+                extension )
+
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+
+            os.rename(os.path.join(self.root, name), path)
+
+            moved += 1
+
+        if moved > 0:
+            self.l.info(str.format(
+                "moved {} files from the flat data directory layout into shard directories",
+                moved ) )
+
+        return(moved)
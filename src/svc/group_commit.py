@@ -0,0 +1,304 @@
+import contextlib, fcntl, itertools, json, os, threading, time
+
+'''
+Group commit for TinyDB files shared by every process (ex: uWSGI workers) and thread using the same data
+directory. A writer appends the changes it made to each file's document (one record per TinyDB document,
+see diff) to a shared queue file and then waits for the commit lock. A writer that finds other batches
+already queued first waits window seconds, without the lock, for more writers to queue their changes; a
+writer that is alone commits at once. The first writer to get the lock becomes the leader: for each file it
+applies the records of every batch in queue order to the file's current contents, so that writers that
+changed different documents of a shared file don't overwrite each other. Each file is written to a
+temporary file that is fsync'd and renamed over the original, each directory is fsync'd once and the queue
+is emptied. Writers whose changes were committed by another leader find them gone from the queue once they
+get the lock and return without writing anything.
+
+The records of a file may also be appended to a log file instead (see write_ahead_log_storage), the
+leader appends the records of every batch queued for the log in queue order and fsyncs the log once.
+
+Writes made between begin() and commit() on the same thread are queued together as one batch, and are
+returned by get_pending() so that reads within the batch see them.
+
+Simple usage:
+
+from svc.group_commit import group_commit
+
+c = group_commit('/data')
+
+c.write(
+    '/data/30/410623/1681915904.30.json',
+    { '_default': { '1': { } } },
+    group_commit.diff({ }, { '_default': { '1': { } } } ) )
+
+'''
+class group_commit():
+    '''
+    Creates a new group commit instance
+
+    Parameters:
+
+    directory (str): directory holding the queue and lock files, shared by every process
+    window (float): seconds a writer that finds other batches queued waits for more before committing
+
+    '''
+    def __init__(
+            self,
+            directory = '/data',
+            window    = 0.002 ):
+
+        self.queue_filename = os.path.join(directory, '.group_commit.queue')
+        self.lock_filename  = os.path.join(directory, '.group_commit.lock')
+        self.window         = window
+        self.local          = threading.local()
+        self.sequence       = itertools.count()
+
+    '''
+    Starts a batch on the current thread, batches started while one is open are part of the open batch
+    '''
+    def begin(self):
+        if getattr(self.local, 'depth', 0) == 0:
+            self.local.pending = {}
+            self.local.changes = {}
+
+        self.local.depth = getattr(self.local, 'depth', 0) + 1
+
+    '''
+    Commits the batch started by begin
+    '''
+    def commit(self):
+        self.local.depth -= 1
+
+        if self.local.depth == 0 and len(self.local.changes) > 0:
+            self.submit(self.local.changes)
+
+    '''
+    Discards the batch started by begin
+    '''
+    def rollback(self):
+        self.local.depth -= 1
+
+        if self.local.depth == 0:
+            self.local.pending = {}
+            self.local.changes = {}
+
+    '''
+    Gets the document written to filename in the current thread's open batch, or None
+    '''
+    def get_pending(self, filename):
+        if getattr(self.local, 'depth', 0) == 0:
+            return(None)
+
+        return(self.local.pending.get(filename) )
+
+    '''
+    Discards the document written to filename in the current thread's open batch, ex: when the file is
+    deleted before the batch is committed
+    '''
+    def discard(self, filename):
+        if getattr(self.local, 'depth', 0) > 0:
+            self.local.pending.pop(filename, None)
+            self.local.changes.pop(filename, None)
+
+    '''
+    Writes a document, either to the current thread's open batch or as a batch of it's own. records are
+    the changes made to the document since it was read (see diff), they are committed to filename or, if
+    log is specified, appended to the log file.
+    '''
+    def write(self, filename, data, records, log = None):
+        if getattr(self.local, 'depth', 0) > 0:
+            self.local.pending[ filename ] = data
+
+            self.local.changes.setdefault(
+                filename,
+                { 'log': log, 'records': [] } ).get('records').extend(records)
+
+        else:
+            self.submit({ filename: { 'log': log, 'records': records } } )
+
+    '''
+    Queues changes and returns once they have been committed, by this or another writer. The window is only
+    waited when other batches were already queued, and before taking the commit lock, so that the leader
+    never holds the lock while it waits.
+    '''
+    def submit(self, changes):
+        ticket = str.format(
+            "{}.{}.{}",
+            os.getpid(),
+            threading.get_ident(),
+            next(self.sequence) )
+
+        with open(self.queue_filename, 'a') as queue:
+            fcntl.flock(queue, fcntl.LOCK_EX)
+
+            others = os.fstat(queue.fileno() ).st_size > 0
+
+            queue.write(json.dumps({
+                'ticket':  ticket,
+                'changes': changes } ) + '\n')
+
+        if others:
+            time.sleep(self.window)
+
+        with self.locked():
+            if not self.is_queued(ticket):
+                return
+
+            self.drain()
+
+    '''
+    Holds the commit lock for the duration of a with block, ex: to rewrite a file that is otherwise only
+    written by the leader
+    '''
+    @contextlib.contextmanager
+    def locked(self):
+        with open(self.lock_filename, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            yield(self)
+
+    '''
+    Indicates whether the batch with the specified ticket is still waiting to be committed
+    '''
+    def is_queued(self, ticket):
+        with open(self.queue_filename, 'a+') as queue:
+            fcntl.flock(queue, fcntl.LOCK_SH)
+
+            queue.seek(0)
+
+            return(any(
+                json.loads(line).get('ticket') == ticket
+                for line in queue
+                if line.endswith('\n') ) )
+
+    '''
+    Commits every queued change, called by the leader while holding the commit lock
+    '''
+    def drain(self):
+        with open(self.queue_filename, 'a+') as queue:
+            fcntl.flock(queue, fcntl.LOCK_EX)
+
+            queue.seek(0)
+
+            documents = {}
+            logs      = {}
+
+            for line in queue:
+                if not line.endswith('\n'):
+                    continue
+
+                for filename, change in json.loads(line).get('changes', {}).items():
+                    ( change.get('log') != None
+                      and logs.setdefault(change.get('log'), [])
+                      or documents.setdefault(filename, []) ).extend(change.get('records') )
+
+            for filename, records in documents.items():
+                self.replace(filename, self.merge(filename, records) )
+
+            for filename, records in logs.items():
+                self.append(filename, records)
+
+            for directory in { os.path.dirname(index) for index in itertools.chain(documents, logs) }:
+                handle = os.open(directory, os.O_RDONLY)
+
+                try:
+                    os.fsync(handle)
+
+                finally:
+                    os.close(handle)
+
+            queue.truncate(0)
+
+    '''
+    Applies records to the current contents of a file, the leader holds the commit lock so that no other
+    process replaces the file meanwhile
+    '''
+    @staticmethod
+    def merge(filename, records):
+        data = {}
+
+        if os.path.exists(filename) and os.stat(filename).st_size > 0:
+            with open(filename) as handle:
+                data = json.load(handle)
+
+        for record in records:
+            group_commit.apply(data, record)
+
+        return(data)
+
+    '''
+    Applies a single record to a document
+    '''
+    @staticmethod
+    def apply(data, record):
+        if record.get('dropped'):
+            data.pop(record.get('table'), None)
+
+        elif record.get('document') == None:
+            data.get(record.get('table'), {}).pop(record.get('id'), None)
+
+        else:
+            data.setdefault(record.get('table'), {})[ record.get('id') ] = record.get('document')
+
+    '''
+    Gets the records that transform the old document into the new document: one record per TinyDB document
+    that was inserted, changed or removed and one per table that was dropped
+    '''
+    @staticmethod
+    def diff(old, new):
+        records = [ { 'table': table, 'dropped': True }
+                    for table in old
+                    if table not in new ]
+
+        for table, documents in new.items():
+            old_documents = old.get(table, {})
+
+            records.extend(
+                { 'table': table, 'id': id, 'document': document }
+                for id, document in documents.items()
+                if old_documents.get(id) != document )
+
+            records.extend(
+                { 'table': table, 'id': id, 'document': None }
+                for id in old_documents
+                if id not in documents )
+
+        return(records)
+
+    '''
+    Appends records to a log file, one JSON record per line, under an exclusive lock of the log and fsync'd
+    once
+    '''
+    @staticmethod
+    def append(filename, records):
+        os.makedirs(os.path.dirname(filename), exist_ok = True)
+
+        with open(filename, 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+
+            handle.write(''.join(
+                json.dumps(index) + '\n'
+                for index in records ) )
+
+            handle.flush()
+
+            os.fsync(handle.fileno() )
+
+    '''
+    Atomically replaces a file's contents
+    '''
+    @staticmethod
+    def replace(filename, data):
+        temporary = str.format(
+            "{}.{}.tmp",
+            filename,
+            os.getpid() )
+
+        os.makedirs(os.path.dirname(filename), exist_ok = True)
+
+        with open(temporary, 'w') as handle:
+            json.dump(data, handle)
+
+            handle.flush()
+
+            os.fsync(handle.fileno() )
+
+        os.rename(temporary, filename)
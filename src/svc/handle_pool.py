@@ -0,0 +1,73 @@
+import collections, threading
+
+'''
+Bounded pool of open storage handles (ex: TinyDB instances, memory-mapped lease tables) shared by every
+scope in a process. Handles are keyed by file name, once the pool holds capacity handles the least
+recently used handle is closed.
+
+Simple usage:
+
+from svc.handle_pool import handle_pool
+
+p = handle_pool(256)
+
+db = p.get('/data/32/410624/1681915905.32.json', lambda: TinyDB('/data/32/410624/1681915905.32.json') )
+
+'''
+class handle_pool():
+    '''
+    Creates a new handle pool
+
+    Parameters:
+
+    capacity (int): maximum number of open handles
+
+    '''
+    def __init__(self, capacity = 1024):
+        self.capacity = capacity
+        self.handles  = collections.OrderedDict()
+        self.guard    = threading.RLock()
+
+    '''
+    Gets the open handle for key, opening it with opener if it isn't in the pool
+    '''
+    def get(self, key, opener):
+        with self.guard:
+            if key in self.handles:
+                self.handles.move_to_end(key)
+
+                return(self.handles.get(key) )
+
+            handle = opener()
+
+            self.handles[ key ] = handle
+
+            while len(self.handles) > self.capacity:
+                self.handles.popitem(last = False)[ 1 ].close()
+
+            return(handle)
+
+    '''
+    Gets the open handle for key without opening it, or None
+    '''
+    def peek(self, key):
+        with self.guard:
+            return(self.handles.get(key) )
+
+    '''
+    Removes a handle from the pool and closes it
+    '''
+    def discard(self, key):
+        with self.guard:
+            handle = self.handles.pop(key, None)
+
+        if handle != None:
+            handle.close()
+
+    '''
+    Closes every handle, ex: after a process forks
+    '''
+    def clear(self):
+        with self.guard:
+            while len(self.handles) > 0:
+                self.handles.popitem()[ 1 ].close()
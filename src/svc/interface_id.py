@@ -0,0 +1,64 @@
+import hashlib, os
+
+'''
+Interface identifiers (the host part of an address) for pools too large to be indexed by an allocation
+bitmap, ex: an IPv6 /64. Rather than searching the pool for a free address, candidates are derived
+directly: the modified EUI-64 interface identifier of the endpoint's MAC address, followed by keyed
+hashes of the MAC address (or of a random seed when there is none) and a probe counter. Each candidate
+is free with a probability close to 1 in a sparsely leased pool, so a lease costs O(1) expected lookups.
+
+Simple usage:
+
+from svc.interface_id import interface_id
+
+interface_id.from_mac_address('02:42:ac:11:00:02')
+
+next(interface_id.get_candidates(b'pool', 64, '02:42:ac:11:00:02') )
+
+'''
+class interface_id():
+    '''
+    Gets the modified EUI-64 interface identifier of a 48 bit MAC address (ex: 02:42:ac:11:00:02), the
+    universal/local bit is inverted and ff:fe is inserted between the OUI and the rest of the address
+    '''
+    @staticmethod
+    def from_mac_address(mac_address):
+        octets = bytes.fromhex(mac_address.replace(':', '').replace('-', '') )
+
+        if len(octets) != 6:
+            raise Exception(str.format(
+                "invalid MAC address: {}",
+                mac_address ) )
+
+        return( int.from_bytes(
+            bytes([ octets[ 0 ] ^ 0x02 ]) + octets[ 1:3 ] + b'\xff\xfe' + octets[ 3: ],
+            'big' ) )
+
+    '''
+    Gets the hashed interface identifier of the specified bit length for a seed and probe counter, keyed
+    by the pool so that the same seed gets different identifiers in different pools
+    '''
+    @staticmethod
+    def get_hashed(key, bits, seed, counter):
+        digest = hashlib.blake2b(
+            seed + counter.to_bytes(4, 'big'),
+            key         = key,
+            digest_size = 16 ).digest()
+
+        return( int.from_bytes(digest, 'big') & ( ( 1 << bits ) - 1 ) )
+
+    '''
+    Enumerates candidate interface identifiers of the specified bit length: the EUI-64 identifier of the
+    MAC address when the host part is at least 64 bits long, then max_probes hashed identifiers
+    '''
+    @staticmethod
+    def get_candidates(key, bits, mac_address = None, max_probes = 16):
+        if mac_address != None and bits >= 64:
+            yield(interface_id.from_mac_address(mac_address) )
+
+        seed = ( mac_address != None
+                 and mac_address.lower().encode('utf-8')
+                 or os.urandom(16) )
+
+        for counter in range(max_probes):
+            yield(interface_id.get_hashed(key, bits, seed, counter) )
@@ -0,0 +1,380 @@
+import fcntl, mmap, os, struct, threading
+from .handle_pool import handle_pool
+
+'''
+Memory-mapped lease table for the single address (/32 or /128) leases of a pool. The file holds a
+header followed by one fixed-width slot per host address, indexed by the address' offset from the
+pool's network address. Each slot holds the owner id, state flags, a generation counter that is
+incremented on every change and the times the lease was created and released. Slots are read and updated
+in place, under a byte-range lock of the slot. Byte-range locks are held by the process, writes of the
+threads of a process sharing the mapped table are serialized by the table's guard.
+
+The header counts the allocated slots and keeps the highest allocated offset, so that allocated slots
+are enumerated without reading the slots past it. The file is created with room for the first slots
+and grown (doubling) as higher offsets are written, a large pool's table is only as long as it's
+highest lease.
+
+Simple usage:
+
+t = lease_table.open('/data/30/410623/1681915904.30.leases', 4)
+
+t.write(1, 'container', lease_table.allocated | lease_table.owned | lease_table.locked)
+
+owner, flags, generation = t.read(1)
+
+owner, flags, generation, created, released = t.read_slot(1)
+
+'''
+class lease_table():
+    allocated   = 0x1
+    owned       = 0x2
+    locked      = 0x4
+
+    magic        = b'PYLT'
+    version      = 2
+    header       = struct.Struct('<4sIIII4x')
+    slot         = struct.Struct('<64sB3xIdd')
+    max_size     = 2 ** 20
+    initial_size = 256
+
+    allocated_flags = bytes([ 0, 1 ] * 128) # maps a flags byte to 1 if the allocated flag is set
+
+    tables      = handle_pool(256)
+
+    '''
+    Gets the lease table for the specified file, mapped tables are kept in a bounded pool shared within
+    a process. A mapped table whose file was deleted or replaced (ex: by the collector in another process)
+    is unmapped and the file is opened again, see is_stale.
+    '''
+    @staticmethod
+    def open(filename, size):
+        table = lease_table.tables.peek(filename)
+
+        if ( table != None
+             and ( table.pid != os.getpid()
+                   or ( table.map == None and not table.exists() )
+                   or table.is_stale() ) ):
+            lease_table.tables.discard(filename)
+
+        return(lease_table.tables.get(
+            filename,
+            lambda: lease_table(filename, size) ) )
+
+    '''
+    Indicates whether a pool of the specified number of host addresses can be kept in a lease table
+    '''
+    @staticmethod
+    def supports_size(size):
+        return( size <= lease_table.max_size )
+
+    '''
+    Creates a new (unmapped) lease table instance
+
+    Parameters:
+
+    filename (str): path to the lease table file
+    size (int): number of host addresses in the pool
+
+    '''
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size     = size
+        self.handle   = None
+        self.map      = None
+        self.pid      = os.getpid()
+        self.guard    = threading.Lock()
+
+    '''
+    Indicates whether the lease table file has been created
+    '''
+    def exists(self):
+        return( os.path.exists(self.filename)
+                and ( os.stat(self.filename).st_size
+                      >= self.get_byte_length(min(self.size, self.initial_size) ) ) )
+
+    '''
+    Indicates whether this table is mapped from a file that is no longer the one at it's path, ex: a file
+    that was deleted, or deleted and created again
+    '''
+    def is_stale(self):
+        if self.map == None:
+            return(False)
+
+        try:
+            current = os.stat(self.filename)
+
+        except FileNotFoundError:
+            return(True)
+
+        mapped = os.fstat(self.handle.fileno() )
+
+        return( ( current.st_dev, current.st_ino ) != ( mapped.st_dev, mapped.st_ino ) )
+
+    '''
+    Gets the size in bytes of a lease table file holding the specified number of slots, by default every
+    slot of the pool
+    '''
+    def get_byte_length(self, slots = None):
+        return( self.header.size + self.slot.size * ( slots == None and self.size or slots ) )
+
+    '''
+    Creates the lease table file, every slot is empty. The file is written under a temporary name
+    and linked into place so that other processes never map a partially created table, nor a table
+    that replaced the one another process created (and wrote leases to) meanwhile.
+    '''
+    def create(self):
+        temporary = str.format(
+            "{}.{}.tmp",
+            self.filename,
+            os.getpid() )
+
+        os.makedirs(os.path.dirname(self.filename), exist_ok = True)
+
+        with open(temporary, 'wb') as handle:
+            handle.write(self.header.pack(self.magic, self.size, self.version, 0, 0) )
+            handle.truncate(self.get_byte_length(min(self.size, self.initial_size) ) )
+
+        try:
+            os.link(temporary, self.filename)
+
+        except FileExistsError:
+            pass
+
+        finally:
+            os.remove(temporary)
+
+        self.close()
+
+        return(self)
+
+    '''
+    Maps the lease table file
+    '''
+    def get_map(self):
+        if self.map == None:
+            if not self.exists():
+                raise Exception(str.format(
+                    "lease table {} does not exist",
+                    self.filename ) )
+
+            self.handle = open(self.filename, 'r+b')
+            self.map    = mmap.mmap(self.handle.fileno(), 0)
+
+            magic, size, version, count, high = self.header.unpack_from(self.map, 0)
+
+            if magic != self.magic or size != self.size or version != self.version:
+                raise Exception(str.format(
+                    "lease table {} is invalid",
+                    self.filename ) )
+
+        return(self.map)
+
+    '''
+    Gets the position of the slot at the specified offset in the file
+    '''
+    def get_position(self, offset):
+        if offset < 0 or offset >= self.size:
+            raise Exception(str.format(
+                "offset {} out of range for lease table of size {}",
+                offset,
+                self.size ) )
+
+        return( self.header.size + self.slot.size * offset )
+
+    '''
+    Maps the lease table file again if another process grew it past the mapped length. The previous map
+    is not closed, a thread may still be reading it; it's unmapped once it's no longer referenced.
+    '''
+    def remap(self):
+        self.get_map()
+
+        if os.fstat(self.handle.fileno() ).st_size > len(self.map):
+            self.map = mmap.mmap(self.handle.fileno(), 0)
+
+        return(self.map)
+
+    '''
+    Grows the lease table file so that it holds the slot at the specified offset, to twice it's slots or
+    at least up to the offset, under a lock of the header. Called by write with the table's guard held.
+    '''
+    def grow(self, offset):
+        position = self.get_position(offset)
+
+        if position + self.slot.size <= len(self.remap() ):
+            return(self.map)
+
+        fcntl.lockf(self.handle, fcntl.LOCK_EX, self.header.size, 0)
+
+        try:
+            length = os.fstat(self.handle.fileno() ).st_size
+
+            if position + self.slot.size > length:
+                os.ftruncate(
+                    self.handle.fileno(),
+                    min(
+                        self.get_byte_length(),
+                        max(
+                            position + self.slot.size,
+                            self.header.size + 2 * ( length - self.header.size ) ) ) )
+
+        finally:
+            fcntl.lockf(self.handle, fcntl.LOCK_UN, self.header.size, 0)
+
+        return(self.remap() )
+
+    '''
+    Reads the slot at the specified offset, returns (owner, flags, generation)
+    '''
+    def read(self, offset):
+        return(self.read_slot(offset)[ 0:3 ] )
+
+    '''
+    Reads the slot at the specified offset, returns (owner, flags, generation, created, released), times
+    are seconds since the epoch or None. Slots past the end of the file are empty.
+    '''
+    def read_slot(self, offset):
+        position = self.get_position(offset)
+
+        if position + self.slot.size > len(self.get_map() ):
+            self.remap()
+
+        if position + self.slot.size > len(self.map):
+            return( ( None, 0, 0, None, None ) )
+
+        owner, flags, generation, created, released = self.slot.unpack_from(self.map, position)
+
+        return( (
+            owner.rstrip(b'\0').decode('utf-8') or None,
+            flags,
+            generation,
+            created or None,
+            released or None ) )
+
+    '''
+    Writes the slot at the specified offset and increments it's generation, returns the new generation. If
+    expected is specified the slot is only written when expected(owner, flags, generation) of the slot's
+    current state is true, checked under the slot's lock; None is returned otherwise. created and released
+    are seconds since the epoch.
+
+    The header's count is incremented before a slot is allocated and decremented after it's freed, so that
+    it's never lower than the number of allocated slots, even if a process dies in between. The slot and
+    header locks are taken with the table's guard held, so that threads of this process are excluded as
+    well as other processes.
+    '''
+    def write(self, offset, owner, flags, expected = None, created = None, released = None):
+        encoded = ( owner or '' ).encode('utf-8')
+
+        if len(encoded) > 64:
+            raise Exception(str.format(
+                "owner {} is too long for a lease table slot",
+                owner ) )
+
+        position = self.get_position(offset)
+
+        with self.guard:
+            self.grow(offset)
+
+            fcntl.lockf(self.handle, fcntl.LOCK_EX, self.slot.size, position)
+
+            try:
+                current = self.read(offset)
+
+                if expected != None and not expected(*current):
+                    return(None)
+
+                generation = current[ 2 ] + 1
+
+                if flags & self.allocated and not current[ 1 ] & self.allocated:
+                    self.update_header(1, offset + 1)
+
+                self.slot.pack_into(
+                    self.map,
+                    position,
+                    encoded,
+                    flags,
+                    generation & 0xffffffff,
+                    created or 0.0,
+                    released or 0.0 )
+
+                if current[ 1 ] & self.allocated and not flags & self.allocated:
+                    self.update_header(-1, 0)
+
+            finally:
+                fcntl.lockf(self.handle, fcntl.LOCK_UN, self.slot.size, position)
+
+            return(generation)
+
+    '''
+    Adds to the header's count of allocated slots and raises it's highest allocated offset (exclusive),
+    under a lock of the header. Called by write with the table's guard held.
+    '''
+    def update_header(self, count, high):
+        fcntl.lockf(self.handle, fcntl.LOCK_EX, self.header.size, 0)
+
+        try:
+            magic, size, version, current_count, current_high = self.header.unpack_from(self.map, 0)
+
+            self.header.pack_into(
+                self.map,
+                0,
+                magic,
+                size,
+                version,
+                max(current_count + count, 0),
+                max(current_high, high) )
+
+        finally:
+            fcntl.lockf(self.handle, fcntl.LOCK_UN, self.header.size, 0)
+
+    '''
+    Gets the number of allocated slots, as counted in the header
+    '''
+    def get_allocated_count(self):
+        return(self.header.unpack_from(self.get_map(), 0)[ 3 ] )
+
+    '''
+    Enumerates (offset, owner, flags, generation) for every slot with the allocated flag set. The flags of
+    the slots up to the highest allocated offset are sliced out of the map at once and searched for the
+    allocated flag, slots are only read until as many as the header counts were found.
+    '''
+    def allocated_slots(self):
+        magic, size, version, count, high = self.header.unpack_from(self.get_map(), 0)
+
+        high = min(high, self.size)
+
+        if count == 0 or high == 0:
+            return
+
+        self.remap()
+
+        flags = self.map[
+            self.get_position(0) + 64:self.get_position(high - 1) + 65:self.slot.size
+        ].translate(self.allocated_flags)
+
+        found  = 0
+        offset = flags.find(b'\x01')
+
+        while offset >= 0 and found < count:
+            owner, current, generation = self.read(offset)
+
+            if current & self.allocated:
+                found = found + 1
+
+                yield( (
+                    offset,
+                    owner,
+                    current,
+                    generation ) )
+
+            offset = flags.find(b'\x01', offset + 1)
+
+    '''
+    Unmaps the lease table file
+    '''
+    def close(self):
+        if self.map != None:
+            self.map.close()
+            self.handle.close()
+
+        self.map    = None
+        self.handle = None
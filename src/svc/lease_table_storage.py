@@ -0,0 +1,172 @@
+import datetime
+from .lease_table import lease_table
+from .scope_storage import scope_storage, version_conflict
+
+'''
+Storage backend for single address scopes whose parent scope (the pool) has a lease table, see
+scope.get_lease_table. Only the owner, lock state and created / released times of a lease are stored,
+the rest of the record is derived from the scope and it's parent when read. The version of a lease's record is it's slot's
+generation.
+'''
+class lease_table_storage(scope_storage):
+    '''
+    '''
+    def get(self, s):
+        owner, flags, generation, created, released = s.get_parent_scope(
+        ).get_lease_table(
+        ).read_slot(s.get_host_offset() )
+
+        if not flags & lease_table.allocated:
+            return(None)
+
+        return(self.get_record(s, owner, flags, generation, created, released) )
+
+    '''
+    Builds a record for a lease
+    '''
+    @staticmethod
+    def get_record(s, owner, flags, generation, created = None, released = None):
+        return({
+            'scope': {
+                'network':      s.network_address_to_big_number(),
+                'prefix':       s.get_prefix()
+            },
+            'created':          lease_table_storage.from_seconds(created),
+            'released':         lease_table_storage.from_seconds(released),
+            'owner':            owner,
+            'locked':           flags & lease_table.locked != 0,
+            'version':          generation,
+            'should_be_locked': None,
+            'preseed_children': s.preseed_children == True,
+            'propagate_tags':   s.propagate_tags == True,
+            'inherit_tags':     s.inherit_tags == True,
+            'child_prefix':     None,
+            'tcp_ip_version':   s.net_obj_ver,
+            'tags':             [],
+            'parent_scope': {
+                'network':      s.get_parent_scope().network_address_to_big_number(),
+                'prefix':       s.get_parent_scope().get_prefix() } } )
+
+    '''
+    Converts a record's time (ex: created) to seconds since the epoch, as stored in a lease table slot
+    '''
+    @staticmethod
+    def to_seconds(value):
+        return( value != None
+                and datetime.datetime.fromisoformat(value).timestamp()
+                or None )
+
+    '''
+    Converts seconds since the epoch read from a lease table slot to a record's time
+    '''
+    @staticmethod
+    def from_seconds(value):
+        return( value != None
+                and str( datetime.datetime.fromtimestamp(value) )
+                or None )
+
+    '''
+    Writes the owner, lock state and times of a record to the lease's slot, if expected is specified the slot must
+    match it (see lease_table.write)
+    '''
+    def write(self, s, record, expected = None):
+        unsupported = [ key for key in record
+                        if key in [ 'tags', 'child_prefix', 'should_be_locked' ]
+                        and record.get(key) ]
+
+        if len(unsupported) > 0:
+            raise Exception(str.format(
+                "lease table can't store {} for scope {}",
+                unsupported,
+                s.get_network_object() ) )
+
+        generation = s.get_parent_scope(
+        ).get_lease_table(
+        ).write(
+            s.get_host_offset(),
+            record.get('owner'),
+            ( lease_table.allocated
+              | ( record.get('owner') != None and lease_table.owned or 0 )
+              | ( record.get('locked') and lease_table.locked or 0 ) ),
+            expected,
+            self.to_seconds(record.get('created') ),
+            self.to_seconds(record.get('released') ) )
+
+        if generation == None:
+            raise version_conflict(str.format(
+                "scope {} was changed by another process",
+                s.get_network_object() ) )
+
+    '''
+    '''
+    def insert(self, s, record):
+        self.write(
+            s,
+            record,
+            lambda owner, flags, generation: not flags & lease_table.allocated )
+
+    '''
+    The slot is compared with the version the record was read at (or, without a version, with the slot
+    read here) when it's written
+    '''
+    def update(self, s, fields, version = None):
+        record = self.get(s)
+
+        if record == None and version == None:
+            raise Exception("scope is not allocated, can't update record")
+
+        scope_storage.check_version(s, record, version)
+
+        version = scope_storage.get_version(record)
+
+        record.update(fields)
+
+        self.write(
+            s,
+            record,
+            lambda owner, flags, generation: flags & lease_table.allocated and generation == version )
+
+    '''
+    '''
+    def delete(self, s, version = None):
+        generation = s.get_parent_scope(
+        ).get_lease_table(
+        ).write(
+            s.get_host_offset(),
+            None,
+            0,
+            version != None
+            and ( lambda owner, flags, generation: flags & lease_table.allocated and generation == version )
+            or None )
+
+        if generation == None:
+            raise version_conflict(str.format(
+                "scope {} was changed by another process",
+                s.get_network_object() ) )
+
+    '''
+    The specified scope is the pool, records enumerated only hold the fields stored in the lease table
+    '''
+    def scan(self, s, prefix, owned = None):
+        table = s.get_lease_table()
+
+        if table == None or prefix != s.get_host_prefix():
+            return
+
+        for offset, owner, flags, generation in table.allocated_slots():
+            if owned != None and ( flags & lease_table.owned != 0 ) != owned:
+                continue
+
+            created, released = table.read_slot(offset)[ 3:5 ]
+
+            yield({
+                'scope': {
+                    'network':    s.network_address_to_big_number() + offset,
+                    'prefix':     prefix
+                },
+                'created':        self.from_seconds(created),
+                'released':       self.from_seconds(released),
+                'owner':          owner,
+                'locked':         flags & lease_table.locked != 0,
+                'version':        generation,
+                'tcp_ip_version': s.net_obj_ver } )
@@ -0,0 +1,231 @@
+import errno, fcntl, hashlib, os, threading, time
+
+'''
+Hierarchical lock manager for scopes, shared by every worker process. A scope is locked by key (see
+scope_storage.get_key) in one of two modes: intention exclusive (IX), taken on each parent of a scope
+that is about to be changed, and exclusive (X), taken on the scope that is changed. IX locks are
+compatible with each other and X locks are compatible with nothing, so that changes of different scopes
+of a pool run in parallel while a change of the pool itself waits for them (and the other way around).
+
+Each key is mapped to one byte of a single lock file, locked with a POSIX byte-range lock: shared for IX,
+exclusive for X. Since POSIX locks are held by a process, the locks of the threads of a process are
+tracked in memory and the byte is locked in the strongest mode any of them holds. Conflicting locks are
+waited for, polling, up to timeout seconds.
+
+Simple usage:
+
+from svc.lock_manager import lock_manager
+
+m = lock_manager('/data/.scopes.lock')
+
+m.acquire((4, 20, 1681915904), lock_manager.IX)
+
+m.acquire((4, 30, 1681915904), lock_manager.X)
+
+m.release((4, 30, 1681915904), lock_manager.X)
+
+'''
+class lock_manager():
+    '''
+    Intention exclusive mode, see acquire
+    '''
+    IX = 'IX'
+
+    '''
+    Exclusive mode, see acquire
+    '''
+    X = 'X'
+
+    '''
+    Creates a new lock manager
+
+    Parameters:
+
+    filename (str): path to the lock file shared by every process
+    timeout (float): seconds to wait for a conflicting lock before giving up
+    slots (int): number of bytes of the lock file keys are mapped to
+
+    '''
+    def __init__(
+            self,
+            filename = '/data/.scopes.lock',
+            timeout  = 5.0,
+            slots    = 1 << 40 ):
+
+        self.filename  = filename
+        self.timeout   = timeout
+        self.slots     = slots
+        self.fd        = None
+        self.pid       = None
+        self.holders   = {}
+        self.modes     = {}
+        self.condition = threading.Condition(threading.Lock() )
+
+        os.register_at_fork(after_in_child = self.reset)
+
+    '''
+    Forgets the locks of the parent process in a forked process (they are not inherited), the condition is
+    replaced since it may have been held by another thread of the parent process when it forked
+    '''
+    def reset(self):
+        self.condition = threading.Condition(threading.Lock() )
+        self.fd        = None
+        self.pid       = None
+        self.holders   = {}
+        self.modes     = {}
+
+    '''
+    Gets the byte of the lock file a key is locked at, the same in every process
+    '''
+    def get_offset(self, key):
+        return( int.from_bytes(
+            hashlib.blake2b(repr(key).encode('utf-8'), digest_size = 8).digest(),
+            'big' ) % self.slots )
+
+    '''
+    Gets the descriptor of the lock file, opened once in each process (locks are not inherited by forked
+    processes, and closing any descriptor of the file would release every lock of the process), called
+    while holding the condition
+    '''
+    def get_fd(self):
+        if self.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.filename), exist_ok = True)
+
+            self.fd      = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+            self.pid     = os.getpid()
+            self.holders = {}
+            self.modes   = {}
+
+        return(self.fd)
+
+    '''
+    Gets the mode the byte of an offset must be locked in for a list of held modes, or None
+    '''
+    @staticmethod
+    def get_file_mode(modes):
+        if lock_manager.X in modes:
+            return(lock_manager.X)
+
+        return( len(modes) > 0 and lock_manager.IX or None )
+
+    '''
+    Indicates whether a thread may hold a lock in the specified mode alongside the locks other threads of
+    this process hold on the same byte
+    '''
+    def is_compatible(self, offset, thread, mode):
+        others = [ held for owner, modes in self.holders.get(offset, {}).items()
+                   if owner != thread
+                   for held in modes ]
+
+        return( len(others) == 0
+                or ( mode == lock_manager.IX and lock_manager.X not in others ) )
+
+    '''
+    Locks the byte of an offset in the lock file in the specified mode (or unlocks it when mode is None)
+    unless it's already locked in that mode, without waiting. Returns whether the byte is locked.
+    '''
+    def lock_file(self, offset, mode):
+        if self.modes.get(offset) == mode:
+            return(True)
+
+        try:
+            fcntl.lockf(
+                self.get_fd(),
+                ( mode == lock_manager.X
+                  and fcntl.LOCK_EX | fcntl.LOCK_NB
+                  or ( mode == lock_manager.IX
+                       and fcntl.LOCK_SH | fcntl.LOCK_NB
+                       or fcntl.LOCK_UN ) ),
+                1,
+                offset )
+
+        except OSError as ex:
+            if ex.errno not in [ errno.EACCES, errno.EAGAIN ]:
+                raise
+
+            return(False)
+
+        self.modes[ offset ] = mode
+
+        return(True)
+
+    '''
+    Acquires a lock on a key for the current thread, waiting up to timeout seconds for conflicting locks of
+    other threads or processes to be released. Locks are counted, each acquire must be matched by a release.
+    '''
+    def acquire(self, key, mode):
+        offset   = self.get_offset(key)
+        thread   = threading.get_ident()
+        deadline = time.monotonic() + self.timeout
+        delay    = 0.001
+
+        with self.condition:
+            self.get_fd()
+
+            while True:
+                modes = self.holders.get(offset, {}).get(thread, [])
+
+                if ( self.is_compatible(offset, thread, mode)
+                     and self.lock_file(
+                         offset,
+                         self.get_file_mode([ mode ] + [
+                             held for index in self.holders.get(offset, {}).values()
+                             for held in index ]) ) ):
+
+                    self.holders.setdefault(offset, {})[ thread ] = modes + [ mode ]
+
+                    return(self)
+
+                if time.monotonic() >= deadline:
+                    raise Exception(str.format(
+                        "timed out waiting for {} lock on scope {}",
+                        mode,
+                        key ) )
+
+                self.condition.wait(min(delay, max(deadline - time.monotonic(), 0) ) )
+
+                delay = min(delay * 2, 0.05)
+
+    '''
+    Releases a lock the current thread acquired on a key, the byte of the key is unlocked (or downgraded)
+    once no thread of this process holds it (in exclusive mode). Releasing a lock that isn't held does
+    nothing.
+    '''
+    def release(self, key, mode):
+        offset = self.get_offset(key)
+        thread = threading.get_ident()
+
+        with self.condition:
+            modes = self.holders.get(offset, {}).get(thread, [])
+
+            if self.pid != os.getpid() or mode not in modes:
+                return(self)
+
+            modes.remove(mode)
+
+            if len(modes) == 0:
+                self.holders.get(offset).pop(thread)
+
+            if len(self.holders.get(offset) ) == 0:
+                self.holders.pop(offset)
+
+            self.lock_file(
+                offset,
+                self.get_file_mode([
+                    held for index in self.holders.get(offset, {}).values()
+                    for held in index ]) )
+
+            ( self.modes.get(offset) == None
+              and self.modes.pop(offset, None) )
+
+            self.condition.notify_all()
+
+        return(self)
+
+    '''
+    Indicates whether the current thread holds a lock on a key in the specified mode
+    '''
+    def is_held(self, key, mode = X):
+        with self.condition:
+            return( self.pid == os.getpid()
+                    and mode in self.holders.get(self.get_offset(key), {}).get(threading.get_ident(), []) )
@@ -0,0 +1,109 @@
+import threading
+
+'''
+Longest prefix match index of networks, one binary trie per TCP/IP version. Each node of the trie is one
+bit of a network address, a network is stored at the node reached by the first prefixlen bits of it's
+address. Looking up a network walks it's bits from the root and returns the value of the deepest stored
+network containing it, in at most 32 (IPv4) or 128 (IPv6) steps regardless of the number of networks.
+
+Simple usage:
+
+from svc.prefix_index import prefix_index
+from svc.scope_network import scope_network
+
+i = prefix_index()
+
+i.add(scope_network.parse('100.64.0.0/20', 4), 'pool parent')
+
+i.lookup(scope_network.parse('100.64.0.4/30', 4) )
+
+'''
+class prefix_index():
+    '''
+    Creates a new empty index
+    '''
+    def __init__(self):
+        self.roots = {}
+        self.guard = threading.Lock()
+
+    '''
+    Gets the node of the specified network, nodes are lists of [ child 0, child 1, value ]. Missing nodes are
+    created if create is set, otherwise None is returned.
+    '''
+    def get_node(self, net, create = False):
+        node = self.roots.get(net.version)
+
+        if node == None:
+            if not create:
+                return(None)
+
+            node = self.roots.setdefault(net.version, [ None, None, None ])
+
+        for depth in range(net.prefix):
+            bit = ( net.network >> ( net.get_max_prefix() - depth - 1 ) ) & 1
+
+            if node[ bit ] == None:
+                if not create:
+                    return(None)
+
+                node[ bit ] = [ None, None, None ]
+
+            node = node[ bit ]
+
+        return(node)
+
+    '''
+    Stores a value for the specified network
+    '''
+    def add(self, net, value):
+        with self.guard:
+            self.get_node(net, create = True)[ 2 ] = value
+
+        return(self)
+
+    '''
+    Removes the value stored for the specified network, empty nodes are left in place
+    '''
+    def discard(self, net):
+        with self.guard:
+            node = self.get_node(net)
+
+            if node != None:
+                node[ 2 ] = None
+
+        return(self)
+
+    '''
+    Gets the value of the longest stored network containing the specified network with a prefixlen of at most
+    max_prefix (the network's prefixlen by default), or None
+    '''
+    def lookup(self, net, max_prefix = None):
+        if max_prefix == None or max_prefix > net.prefix:
+            max_prefix = net.prefix
+
+        with self.guard:
+            node  = self.roots.get(net.version)
+            found = None
+
+            for depth in range(max_prefix + 1):
+                if node == None:
+                    break
+
+                if node[ 2 ] != None:
+                    found = node[ 2 ]
+
+                if depth == max_prefix:
+                    break
+
+                node = node[ ( net.network >> ( net.get_max_prefix() - depth - 1 ) ) & 1 ]
+
+            return(found)
+
+    '''
+    Removes every network from the index
+    '''
+    def clear(self):
+        with self.guard:
+            self.roots.clear()
+
+        return(self)
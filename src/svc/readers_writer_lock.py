@@ -0,0 +1,72 @@
+import contextlib, threading
+
+'''
+Readers-writer lock for the threads of a process: any number of readers hold the lock at once, a writer
+holds it alone. A waiting writer keeps new readers from acquiring the lock, so that writers are not
+starved by a steady stream of readers.
+
+Simple usage:
+
+from svc.readers_writer_lock import readers_writer_lock
+
+g = readers_writer_lock()
+
+with g.reading():
+    pass
+
+with g.writing():
+    pass
+
+'''
+class readers_writer_lock():
+    '''
+    Creates a new readers-writer lock that is not held
+    '''
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock() )
+        self.readers   = 0
+        self.writer    = None
+        self.waiting   = 0
+
+    '''
+    Holds the lock as a reader for the duration of a with block
+    '''
+    @contextlib.contextmanager
+    def reading(self):
+        with self.condition:
+            while self.writer != None or self.waiting > 0:
+                self.condition.wait()
+
+            self.readers += 1
+
+        try:
+            yield(self)
+
+        finally:
+            with self.condition:
+                self.readers -= 1
+
+                self.condition.notify_all()
+
+    '''
+    Holds the lock as the writer for the duration of a with block, once every reader released it
+    '''
+    @contextlib.contextmanager
+    def writing(self):
+        with self.condition:
+            self.waiting += 1
+
+            while self.writer != None or self.readers > 0:
+                self.condition.wait()
+
+            self.waiting -= 1
+            self.writer   = threading.get_ident()
+
+        try:
+            yield(self)
+
+        finally:
+            with self.condition:
+                self.writer = None
+
+                self.condition.notify_all()
@@ -0,0 +1,148 @@
+import bisect
+from .scope_network import scope_network
+
+'''
+Sorted set of the address ranges of a scope that can't be leased (ex: network, broadcast and gateway
+addresses, or blocks reserved in the schema for DHCP or static addresses.) Ranges are kept merged as
+(first, last) offsets from the scope's network address, so that candidates are skipped arithmetically:
+a lookup is a binary search and every reserved range is stepped over at once.
+
+Simple usage:
+
+from svc.reserved_ranges import reserved_ranges
+
+r = reserved_ranges(16)
+
+r.add(0, 1)
+
+r.add(*reserved_ranges.parse('100.64.0.8/30', 4), base = 1681915904)
+
+next(r.get_free_offsets() )
+
+'''
+class reserved_ranges():
+    '''
+    Creates a new set of reserved ranges without any reserved offset
+
+    Parameters:
+
+    size (int): number of addresses in the scope
+
+    '''
+    def __init__(self, size):
+        self.size   = size
+        self.ranges = []
+
+    '''
+    Gets the first and last address (as big numbers) of a reservation declared in the schema, either an
+    address, a CIDR or a range of two addresses separated by a dash (ex: 100.64.0.10-100.64.0.20)
+    '''
+    @staticmethod
+    def parse(entry, tcp_ip_ver):
+        if '-' in entry:
+            first, last = [ scope_network.parse(index.strip(), tcp_ip_ver)
+                            for index in entry.split('-') ]
+
+            return( ( first.network, last.get_broadcast() ) )
+
+        net = scope_network.parse(entry, tcp_ip_ver)
+
+        return( ( net.network, net.get_broadcast() ) )
+
+    '''
+    Reserves the offsets from first to last (inclusive), base is subtracted from both first and last
+    (ex: the scope's network address when first and last are addresses.) Offsets outside of the scope are
+    ignored.
+    '''
+    def add(self, first, last, base = 0):
+        first = max(first - base, 0)
+        last  = min(last - base, self.size - 1)
+
+        if first > last:
+            return(self)
+
+        index = bisect.bisect_left(self.ranges, ( first, ) )
+
+        if index > 0 and self.ranges[ index - 1 ][ 1 ] >= first - 1:
+            index -= 1
+
+        end = index
+
+        while end < len(self.ranges) and self.ranges[ end ][ 0 ] <= last + 1:
+            first = min(first, self.ranges[ end ][ 0 ])
+            last  = max(last, self.ranges[ end ][ 1 ])
+
+            end += 1
+
+        self.ranges[ index:end ] = [ ( first, last ) ]
+
+        return(self)
+
+    '''
+    Gets the reserved range containing the specified offset, or None
+    '''
+    def get_range(self, offset):
+        index = bisect.bisect_right(self.ranges, ( offset, float('inf') ) ) - 1
+
+        if index >= 0 and self.ranges[ index ][ 1 ] >= offset:
+            return(self.ranges[ index ])
+
+        return(None)
+
+    '''
+    Indicates whether the specified offset is reserved
+    '''
+    def contains(self, offset):
+        return(self.get_range(offset) != None )
+
+    '''
+    Enumerates the offsets that are not reserved, in order, starting from the specified offset
+    '''
+    def get_free_offsets(self, start = 0):
+        offset = start
+
+        index = bisect.bisect_right(self.ranges, ( offset, float('inf') ) ) - 1
+
+        index = max(index, 0)
+
+        while offset < self.size:
+            while index < len(self.ranges) and self.ranges[ index ][ 1 ] < offset:
+                index += 1
+
+            if index < len(self.ranges) and self.ranges[ index ][ 0 ] <= offset:
+                offset = self.ranges[ index ][ 1 ] + 1
+
+                continue
+
+            yield(offset)
+
+            offset += 1
+
+    '''
+    Enumerates every reserved offset
+    '''
+    def get_offsets(self):
+        for first, last in self.ranges:
+            for offset in range(first, last + 1):
+                yield(offset)
+
+    '''
+    Enumerates the aligned blocks that exactly cover the reserved ranges as (level, index), where a block
+    at level l is one of the scope's 2 ** l blocks of size / 2 ** l addresses (see allocation_trie) and
+    depth is the level of single addresses
+    '''
+    def get_blocks(self, depth):
+        for first, last in self.ranges:
+            offset = first
+
+            while offset <= last:
+                bits = depth
+
+                while ( bits > 0
+                        and offset % ( 1 << ( depth - bits + 1 ) ) == 0
+                        and offset + ( 1 << ( depth - bits + 1 ) ) - 1 <= last ):
+                    bits -= 1
+
+                yield( ( bits, offset >> ( depth - bits ) ) )
+
+                offset += 1 << ( depth - bits )
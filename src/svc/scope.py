@@ -2,13 +2,116 @@ import datetime
 import os
 import logging
 from ipaddress import IPv4Network as network_object_v4, IPv6Network as network_object_v6
-from tinydb import TinyDB, Query
+from tinydb import TinyDB
 from .tinydb_transaction_isolated_storage import transaction_isolated_storage
+from .scope_storage import scope_storage
+from .scope_network import scope_network
+from .data_layout import data_layout
+from .handle_pool import handle_pool
+from .tinydb_scope_storage import tinydb_scope_storage
+from .allocation_bitmap import allocation_bitmap
+from .allocation_trie import allocation_trie
+from .reserved_ranges import reserved_ranges
+from .interface_id import interface_id
+from .tag_index import tag_index
+from .scope_tree import scope_tree
+from .lease_table import lease_table
+from .lease_table_storage import lease_table_storage
+from .scope_journal import scope_journal
+from .scope_snapshot import scope_snapshot
+from .unit_of_work import unit_of_work
+from .lock_manager import lock_manager
 from tinydb.middlewares import CachingMiddleware
 
 '''
 '''
 class scope():
+    __slots__ = (
+        'network',
+        'net_obj_ver',
+        'child_prefix',
+        'parent_scope',
+        'propagate_tags',
+        'inherit_tags',
+        'preseed_children',
+        'should_be_locked',
+        'tags',
+        'reserved',
+        'own_db',
+        'db',
+        'storage' )
+
+    '''
+    Logger shared by every scope instance
+    '''
+    l = logging.getLogger(__name__)
+
+    '''
+    TinyDB storage class used by scopes that use their own file, see get_instance_db
+    '''
+    instance_storage = transaction_isolated_storage
+
+    '''
+    Directory layout of the files unique to each scope, see get_instance_file
+    '''
+    layout = data_layout()
+
+    '''
+    Open TinyDB instances shared by every scope in this process, see get_instance_db
+    '''
+    handles = handle_pool()
+
+    '''
+    Storage backend shared by scopes using TinyDB, so that one unit of work commits them as one batch
+    '''
+    tinydb_storage = tinydb_scope_storage()
+
+    '''
+    Storage backend for single address scopes of pools with a lease table, see get_lease_table
+    '''
+    lease_storage = lease_table_storage()
+
+    '''
+    Journal that scope changes are recorded to, see update_scope_change_log
+    '''
+    journal = scope_journal()
+
+    '''
+    Allocation tries of the owned child scopes of each scope in this process, by scope key, see get_allocation_trie
+    '''
+    allocation_tries = {}
+
+    '''
+    Reserved address ranges of each pool in this process, by scope key, see get_reserved_ranges
+    '''
+    reservations = {}
+
+    '''
+    Scopes whose children are implicitly pre-seeded, by scope key, and whether those children are locked
+    down, see is_preseeded
+    '''
+    preseeded = {}
+
+    '''
+    Effective tags of the scopes defined in the schema, see is_tagged and scope_factory.initialize
+    '''
+    tagged = tag_index()
+
+    '''
+    Interned schema scopes and allocated scopes of this process, see get_new_scope_object and get_parent_scope
+    '''
+    tree = scope_tree()
+
+    '''
+    Snapshot of the schema scopes and their indexes that workers start from, see scope_factory.initialize
+    '''
+    snapshot = scope_snapshot()
+
+    '''
+    Locks of the scopes being changed by every worker, see acquire_lock
+    '''
+    locks = lock_manager()
+
     '''
     string representation of object instance
     '''
@@ -30,22 +133,31 @@ class scope():
     '''
     Gets a db instance that utilizes it's own file unique to this scope instance,
     this is the default method of storage used by the scope class if no database
-    object is specified for the constructor parameter
+    object is specified for the constructor parameter. Instances are taken from the
+    process' handle pool rather than opened for every scope object.
     '''
     def get_instance_db(self):
-        return(TinyDB(str.format(
-            "/data/{}.{}.json",
+        return(scope.handles.get(
+            self.get_instance_file('json'),
+            lambda: TinyDB(
+                self.get_instance_file('json'),
+                storage = scope.instance_storage ) ) )
+
+    '''
+    Gets the path of a file unique to this scope instance with the specified extension
+    '''
+    def get_instance_file(self, extension):
+        return(scope.layout.get_path(
+            self.net_obj_ver,
+            self.get_prefix(),
             self.network_address_to_big_number(),
-            self.get_prefix()
-        ), storage = transaction_isolated_storage ) )
+            extension ) )
 
     '''
     Converts IP address to a big number (int fits all python, technically a ulong or ulonglong for ipv6)
     '''
     def network_address_to_big_number(self):
-        return(int.from_bytes(
-            self.get_network_object(
-            ).network_address.packed, 'big') )
+        return(self.network.network)
 
     '''
     Converts an unsigned long long or unsigned long (TCP/IP 6 vs 4) number to
@@ -59,15 +171,17 @@ class scope():
     ).to_bytes(16, 'big'))
 
     16 =  size of longlong, but the zero bits are not counted by bit_length()
-    and thus an ipv4 address will use approx, 32 bits
+    and thus an ipv4 address will use up to 32 bits. Numbers that fit in 32 bits with a prefixlen
+    of up to 32 are taken to be IPv4 addresses.
     '''
     @staticmethod
     def big_number_to_network_address(num, prefixlen):
 
-        if int.from_bytes(
+        if ( int.from_bytes(
                 num,
                 'big'
-        ).bit_length() == 128:
+        ).bit_length() > 32
+             or prefixlen > 32 ):
 
             return(network_object_v6(str.format(
                 "{}/{}",
@@ -77,11 +191,7 @@ class scope():
                 ).network_address,
                 prefixlen ) ) )
 
-        if int.from_bytes(
-                num,
-                'big'
-        ).bit_length() == 32:
-
+        else:
             return(network_object_v4(str.format(
                 "{}/{}",
                 network_object_v4(int.from_bytes(
@@ -94,11 +204,99 @@ class scope():
     Gets the database a table object from this scope's database instance
     '''
     def get_db_table(self):
-        return(self.db.table(str.format(
+        return(self.db.table(self.get_db_table_name() ) )
+
+    '''
+    Gets the name of this scope's table in it's database instance
+    '''
+    def get_db_table_name(self):
+        return(str.format(
             "{}/{}",
             self.get_network_object(
             ).network_address,
-            self.get_prefix() ) ) )
+            self.get_prefix() ) )
+
+    '''
+    Gets this scope's record from the storage backend, or None if this scope is not allocated. While a
+    unit of work is active the record is read once and served from memory. Pre-seeded children that
+    were never changed have no stored record, see get_preseeded_record.
+    '''
+    def get_record(self):
+        record = ( unit_of_work.get_current() or self.storage ).get(self)
+
+        if record == None and self.is_preseeded():
+            return(self.get_preseeded_record() )
+
+        return(record)
+
+    '''
+    Updates fields of this scope's record in the storage backend, or in the active unit of work. The
+    record of a pre-seeded child is stored on it's first update.
+    '''
+    def update_record(self, fields):
+        if ( self.is_preseeded()
+             and ( unit_of_work.get_current() or self.storage ).get(self) == None ):
+            record = self.get_preseeded_record()
+
+            record.update(fields)
+
+            return(self.insert_record(record) )
+
+        ( unit_of_work.get_current() or self.storage ).update(self, fields)
+
+        return(self)
+
+    '''
+    Stores a new record for this scope in the storage backend, or in the active unit of work
+    '''
+    def insert_record(self, record):
+        ( unit_of_work.get_current() or self.storage ).insert(self, record)
+
+        return(self)
+
+    '''
+    Deletes this scope's record from the storage backend, or from the active unit of work
+    '''
+    def delete_record(self):
+        ( unit_of_work.get_current() or self.storage ).delete(self)
+
+        unit_of_work.on_commit(
+            lambda: scope.tree.discard(self) )
+
+        return(self)
+
+    '''
+    Indicates whether this scope is a child (of the child prefixlen) of a scope whose children are pre-seeded,
+    such children are allocated from the start without being written to storage one by one, see
+    scope_factory.initialize
+    '''
+    def is_preseeded(self):
+        return( self.parent_scope != None
+                and scope_storage.get_key(self.parent_scope) in scope.preseeded
+                and self.get_prefix() == self.parent_scope.get_child_prefix() )
+
+    '''
+    Gets the record of a pre-seeded child as it is before it's first change: un-owned. The record is built
+    from this scope's settings rather than from storage.
+    '''
+    def get_preseeded_record(self):
+        return({
+            'scope': {
+                'network':      self.network_address_to_big_number(),
+                'prefix':       self.get_prefix()
+            },
+            'created':          str( datetime.datetime.now() ),
+            'owner':            None,
+            'should_be_locked': self.should_be_locked,
+            'preseed_children': self.preseed_children == True,
+            'propagate_tags':   self.propagate_tags == True,
+            'inherit_tags':     self.inherit_tags == True,
+            'child_prefix':     self.child_prefix,
+            'tcp_ip_version':   self.net_obj_ver,
+            'tags':             list(self.tags),
+            'parent_scope': {
+                'network':      self.parent_scope.network_address_to_big_number(),
+                'prefix':       self.parent_scope.get_prefix() } } )
 
     '''
     Gets the TCP/IP version (4 or 6) of this scope
@@ -107,46 +305,55 @@ class scope():
         if not self.is_allocated():
             return(self.net_obj_ver)
 
-        return(self.get_db_table().get(
-            Query(
-            ).scope != None
-        ).get('tcp_ip_version') )
+        return(self.get_record().get('tcp_ip_version') )
 
     '''
     Gets the current scope's parent scope or gets the current scopes "supernet"
     as defined by the IPv(x)Network class property supernet ( usually prefixlen - 1 )
-    If allocated, parent scope object is created from DB, and returned
+    If allocated, the parent scope is the node of the scope tree identified by the record's parent_scope,
+    otherwise a new scope object is created for it
     '''
     def get_parent_scope(self):
         if self.parent_scope != None:
             return self.parent_scope
 
         elif self.is_allocated():
-            if self.parent == None:
-                parent = self.get_db_table(
-                ).get(Query(
-                ).scope != None
-                ).get('parent')
-
-                if parent != None:
-                    self.parent_scope = self.get_new_scope_object(str.format(
-                        "{}/{}",
-                        parent.get('network'),
-                        parent.get('prefix') ) )
-                else:
-                    self.l.warn('allocated scope is missing parent')
+            parent = self.get_record().get('parent_scope')
+
+            if parent != None:
+                key = (
+                    self.net_obj_ver,
+                    parent.get('prefix'),
+                    parent.get('network') )
+
+                if scope.tree.get(key) != None:
+                    self.parent_scope = scope.tree.get(key)
 
                     return(self.parent_scope)
 
+                return(scope(
+                    tcp_ip_ver = self.net_obj_ver,
+                    cidr       = scope_network(
+                        parent.get('network'),
+                        parent.get('prefix'),
+                        self.net_obj_ver ),
+                    db         = ( self.use_own_db() != True
+                                   and self.db
+                                   or None ) ) )
+
+            self.l.warn('allocated scope is missing parent')
+
         return(scope(
             tcp_ip_ver = self.get_tcp_ip_ver(),
-            cidr = self.get_network_object(
-            ).supernet() ) )
+            cidr = self.network.get_supernet() ) )
 
     '''
     Checks whether a specified list of tags match tags defined for this scope in the schema or whether
     any tags inhierited from propagated parent scope tags match, currently only supports one tag
     TODO return a dict of true/false values?
+
+    Scopes defined in the schema are looked up in the tag index (see scope.tagged), other scopes walk up
+    their parent scopes.
     '''
     def is_tagged(self, tags):
         self.l.debug(str.format(
@@ -154,6 +361,11 @@ class scope():
             str(self),
             tags ) )
 
+        key = scope_storage.get_key(self)
+
+        if scope.tagged.contains(key):
+            return(scope.tagged.is_tagged(key, tags) )
+
         parent_is_tagged = False
 
         if (self.parent_scope != None
@@ -186,9 +398,7 @@ class scope():
                 self.tags) )
             return(self.tags)
 
-        answer = self.get_db_table(
-        ).get(Query().scope != None
-        ).get('tags')
+        answer = self.get_record().get('tags')
 
         self.l.debug(str.format(
                 "current_scope: {} tags: {}",
@@ -211,27 +421,37 @@ class scope():
             preseed_children  = False,
             propagate_tags    = True,
             should_be_locked  = None,
-            tags              = [] ):
+            tags              = None,
+            reserved          = None ):
 
-        self.l                = logging.getLogger(__name__)
         self.propagate_tags   = propagate_tags
         self.child_prefix     = child_prefix
         self.net_obj_ver      = tcp_ip_ver
-        self.cidr             = cidr
-        self.prefix           = self.get_network_object().prefixlen
+        self.network          = scope_network.parse(cidr, tcp_ip_ver)
         self.parent_scope     = parent
         self.inherit_tags     = inherit_tags
         self.preseed_children = preseed_children
-        self.tags             = tags
+        self.tags             = ( tags != None and tags or [] )
         self.should_be_locked = should_be_locked
+        self.reserved         = ( reserved != None and reserved or [] )
 
-        if db != None:
-            self.own_db = False
-            self.db = db
+        if isinstance(db, scope_storage):
+            self.own_db  = False
+            self.db      = db
+            self.storage = db
+
+        elif db != None:
+            self.own_db  = False
+            self.db      = db
+            self.storage = scope.tinydb_storage
 
         else:
-            self.own_db = True
-            self.db = self.get_instance_db()
+            self.own_db  = True
+            self.db      = self.get_instance_db()
+            self.storage = scope.tinydb_storage
+
+        if not self.l.isEnabledFor(logging.DEBUG):
+            return
 
         self.l.debug(str.format(
             '''
@@ -247,8 +467,8 @@ class scope():
             self.propagate_tags,
             self.child_prefix,
             self.net_obj_ver,
-            self.cidr,
-            self.prefix,
+            self.network,
+            self.get_prefix(),
             str(self.parent_scope),
             self.inherit_tags,
             self.preseed_children,
@@ -267,11 +487,7 @@ class scope():
         if not self.is_allocated():
             return(self.inherit_tags == True )
 
-        return(self.get_db_table(
-        ).get(
-            Query(
-            ).scope != None
-        ).get('inherit_tags') == True )
+        return(self.get_record().get('inherit_tags') == True )
 
     '''
     Checks whether all children for this scope should be enumerated and initialized by interpolation of
@@ -281,11 +497,7 @@ class scope():
         if not self.is_allocated():
             return(self.preseed_children == True )
 
-        return(self.get_db_table(
-        ).get(
-            Query(
-            ).scope != None
-        ).get('preseed_children') == True )
+        return(self.get_record().get('preseed_children') == True )
 
     '''
     Check whether if tags in this scope should be propagated to child scopes or not
@@ -294,10 +506,7 @@ class scope():
         if not self.is_allocated():
             return(self.propagate_tags == True )
 
-        return(self.get_db_table(
-        ).get(
-            Query().scope != None
-        ).get('propagate_tags') == True )
+        return(self.get_record().get('propagate_tags') == True )
 
     '''
     Gets the child prefixlen defined in the schema for this scope
@@ -306,79 +515,71 @@ class scope():
         if not self.is_allocated():
             return(self.child_prefix )
 
-        return(self.get_db_table().get(
-            Query(
-            ).scope != None
-        ).get('child_prefix') )
+        return(self.get_record().get('child_prefix') )
 
     '''
-    gets a new allocatable scope object for a given network object
+    gets a new allocatable scope object for a given network object. Scopes already in the scope tree are
+    returned as is, a new allocated scope (other than a single address) is added to the tree.
     '''
     def get_new_scope_object(self, net_obj):
+        net = scope_network.parse(net_obj, self.net_obj_ver)
+
+        if net.prefix != self.get_host_prefix():
+            node = scope.tree.get( ( self.net_obj_ver, net.prefix, net.network ) )
+
+            if node != None:
+                return(node)
+
+            s = scope(
+                cidr             = net,
+                propagate_tags   = self.propagate_tags_enabled(),
+                inherit_tags     = self.inherit_tags_enabled(),
+                preseed_children = self.preseed_children_enabled(),
+                tags             = [],
+                db               = ( self.use_own_db() != True
+                                     and self.db
+                                     or None ),
+                parent           = self,
+                tcp_ip_ver       = self.get_tcp_ip_ver() )
+
+            if s.is_allocated():
+                return(scope.tree.add(s) )
+
+            return(s)
+
+        if self.get_lease_table() != None:
+            return(scope(
+                cidr             = net,
+                propagate_tags   = self.propagate_tags_enabled(),
+                inherit_tags     = self.inherit_tags_enabled(),
+                preseed_children = self.preseed_children_enabled(),
+                tags             = [],
+                db               = scope.lease_storage,
+                parent           = self,
+                tcp_ip_ver       = self.get_tcp_ip_ver() ) )
+
         return(scope(
-            cidr             = net_obj.compressed,
+            cidr             = net,
             propagate_tags   = self.propagate_tags_enabled(),
             inherit_tags     = self.inherit_tags_enabled(),
             preseed_children = self.preseed_children_enabled(),
             tags             = [],
-            db               = ( self.use_own_db() == True
-                                 and None
-                                 or self.db ),
+            db               = ( self.use_own_db() != True
+                                 and self.db
+                                 or None ),
             parent           = self,
             tcp_ip_ver       = self.get_tcp_ip_ver() ) )
 
-    '''
-    Returns true if the network_address property of the parameter s
-    equals either the get_network_object().network_address or
-    get_network_object().broadcast_address of this scope and only
-    if the child prefix of this scope or the child prefix specified as a parameter of this function is 32 or 128.
-    '''
-    def is_broadcast_or_scope_network_address(
-            self,
-            s,
-            c_prefix       = None,
-            mode           = None,
-            operating_mode = None ):
-
-        self.l.debug(str.format(
-            '''
-            mode:                   {}
-            operating_mode:         {}
-            s_network_address:      {}
-            self_network_address:   {}
-            self_broadcast_address: {}
-            ''',
-            mode,
-            operating_mode,
-            str(s.network_address),
-            str(self.get_network_object(
-            ).network_address ),
-            str(self.get_network_object(
-            ).broadcast_address ) ) )
-
-        return( ( str(s.network_address)
-                  == str(self.get_network_object(
-                  ).network_address )
-                  or str(s.network_address)
-                  == str(self.get_network_object(
-                  ).broadcast_address ) )
-                and ( ( c_prefix
-                        and ( c_prefix
-                              == 32
-                              or c_prefix
-                              == 128 )
-                        == True)
-                      or ( self.get_child_prefix()
-                           == 32
-                           or self.get_child_prefix()
-                           == 128 ) ) )
-
     '''
     modes:
     0x2: pre-seed mode
     0x4: enumerate a single allocated and un-owned or unallocated scope from the current scope
     0x8: enumerate owned scopes from the current scope until an unallocated scope is reached
-    0x8|0x2: enumerate sparsely allocated owned scopes throughout the current scope
+    0x8|0x2: enumerate sparsely allocated owned scopes throughout the current scope, using a single
+             range scan of the storage backend
+
+    Reserved addresses (see get_reserved_ranges) are skipped in modes 0x4 and 0x8 when the children are
+    single addresses.
     '''
     def children(
             self,
@@ -388,16 +589,37 @@ class scope():
         operating_mode = mode
 
         c_prefix = ( child_net_obj != None
-                     and child_net_obj.prefixlen
+                     and scope_network.parse(child_net_obj, self.net_obj_ver).prefix
                      or self.get_child_prefix() )
 
-        if mode == 0x4 and self.is_locked():
-            raise(Exception(str.format(
-                "current scope is locked, interpolation cannot continue in mode {}", mode) ) )
+        if mode == 0x4:
+            self.acquire_lock(lock_manager.IX)
+
+        if mode == 0x8 | 0x2:
+            for record in self.get_child_storage(c_prefix).scan(
+                    self,
+                    c_prefix,
+                    owned = True ):
+
+                yield(self.get_new_scope_object(scope_network(
+                    record.get('scope').get('network'),
+                    c_prefix,
+                    self.net_obj_ver ) ) )
+
+            return
+
+        c_prefix = ( c_prefix != None
+                     and c_prefix
+                     or self.get_prefix() + 1 )
+
+        offsets = range(1 << ( c_prefix - self.get_prefix() ) )
+
+        if c_prefix == self.get_host_prefix() and operating_mode & ( 0x4 | 0x8 ):
+            offsets = self.get_reserved_ranges().get_free_offsets()
 
-        for index in self.get_network_object(
-        ).subnets(
-            new_prefix = c_prefix ) :
+        for index in (
+                self.network.get_subnet(offset, c_prefix)
+                for offset in offsets ):
 
             s = None
 
@@ -411,14 +633,6 @@ class scope():
                     yield(s)
 
             if operating_mode == 0x4:
-                if self.is_broadcast_or_scope_network_address(
-                        index,
-                        c_prefix,
-                        mode,
-                        operating_mode ):
-
-                    continue
-
                 s = self.get_new_scope_object(index)
                 if s.is_allocated() and not s.is_owned():
                     operating_mode = operating_mode ^ 0x4
@@ -431,14 +645,6 @@ class scope():
                     yield(s)
 
             if operating_mode & 0x8:
-                if self.is_broadcast_or_scope_network_address(
-                        index,
-                        c_prefix,
-                        mode,
-                        operating_mode ):
-
-                    continue
-
                 s = self.get_new_scope_object(index)
 
                 if s.is_allocated() and s.is_owned():
@@ -447,11 +653,20 @@ class scope():
                 elif not s.is_allocated() and not ( operating_mode & 0x2 ):
                         operating_mode = operating_mode ^ 0x8
 
+    '''
+    Gets the storage backend holding the records of this scope's children of the specified prefixlen
+    '''
+    def get_child_storage(self, c_prefix):
+        return( ( c_prefix == self.get_host_prefix()
+                  and self.get_lease_table() != None
+                  and scope.lease_storage )
+                or self.storage )
+
     '''
     Gets the prefixlen of the current scope
     '''
     def get_prefix(self):
-        return(self.prefix) # don't muck up the DB by trying to retrieve this
+        return(self.network.prefix) # don't muck up the DB by trying to retrieve this
                             # value from the DB just rely on the class prop
                             # too many circular dependencies
 
@@ -466,20 +681,18 @@ class scope():
 
     '''
     Gets either an IPv6Network or IPv4Network object, classes come from
-    the python ipaddress module
+    the python ipaddress module. Scopes keep their network as a network value (see scope_network)
+    and only build the object when this is called.
     '''
     def get_network_object(self, cidr=None):
+        if cidr == None:
+            return(self.network.to_network_object() )
+
         if self.net_obj_ver == 4:
-            return( network_object_v4( (
-                cidr != None
-                and cidr
-                or self.cidr ) ) )
+            return( network_object_v4(cidr) )
 
         elif self.net_obj_ver == 6:
-            return( network_object_v6( (
-                cidr != None
-                and cidr
-                or self.cidr ) ) )
+            return( network_object_v6(cidr) )
 
         else:
             raise Exception("invalid TCP/IP version or unsupported")
@@ -488,10 +701,7 @@ class scope():
     Checks whether or not the current scope has a database table entry
     '''
     def is_allocated(self):
-        return((self.get_db_table(
-        ).get(Query(
-        ).scope
-              != None ) )
+        return(self.get_record()
                != None )
 
     '''
@@ -500,20 +710,18 @@ class scope():
     def add_tags(self, tags):
         self.l.debug(str.format("for scope: {} adding tags: {}", self.get_network_object(), tags ) )
 
-        if self.is_locked():
-            raise Exception("scope is locked, can't set tags")
+        self.acquire_lock()
 
-        cur = self.get_db_table(
-        ).get( (
-            Query().scope != None )
-        ).get('tags')
+        cur = self.get_record().get('tags')
 
-        self.get_db_table().update( { 'tags': cur + tags } )
+        self.update_record( { 'tags': cur + tags } )
 
         self.update_scope_change_log({
             'reason': "tags were added",
             'tags': tags } )
 
+        self.update_tag_index(cur + tags)
+
         return(self)
 
     '''
@@ -522,17 +730,12 @@ class scope():
     def delete_tags(self, tags):
         self.l.debug(str.format("for scope: {} delete tags: {}", self.get_network_object(), tags ) )
 
-        if self.is_locked():
-            raise Exception("can't delete tags, locked")
+        self.acquire_lock()
 
-        new_tags = list(filter(
-            lambda x: [y for y in self.get_db_table(
-            ).get((
-                Query().scope != None )
-            ).get('tags') if x != y], tags
-        ) )
+        new_tags = [ index for index in self.get_record().get('tags')
+                     if index not in tags ]
 
-        self.get_db_table().update( { 'tags': new_tags } )
+        self.update_record( { 'tags': new_tags } )
 
         self.update_scope_change_log({
             'reason': 'tags were removed',
@@ -540,43 +743,47 @@ class scope():
             'new_tags': new_tags
         } )
 
+        self.update_tag_index(new_tags)
+
         return(self)
 
     '''
-    Unlocks the current scope indicating that no operations such as interpolation may be performed,
-    with the exception of pre-seeded scopes.
+    Replaces this scope's tags in the tag index once the unit of work commits, if this scope is indexed
     '''
-    def unlock_scope(self):
-        self.l.debug(str.format(
-            "unlocking scope: {}",
-            self.get_network_object() ) )
-
-        if not self.is_locked():
-            raise Exception(str.format(
-                "{} scope is already unlocked",
-                self.get_network_object().compressed ) )
+    def update_tag_index(self, tags):
+        key = scope_storage.get_key(self)
 
-        self.get_db_table().update( { 'locked': False } )
-
-        self.update_scope_change_log( { 'reason': "scope was unlocked" } )
+        unit_of_work.on_commit(
+            lambda: scope.tagged.update(key, tags) )
 
         return(self)
 
     '''
-    Sets the current scopes locked setting indicating that no changes may be made nor child scopes created, with
-    exception to pre-seeding
+    Locks the current scope in the lock manager shared by every worker (see lock_manager) before it's
+    changed: intention locks (IX) on each of it's parent scopes, outermost first, then the specified mode on
+    the scope itself (X to change the scope, IX to change it's children.) Conflicting locks of other
+    requests are waited for. Locks are held until the active unit of work ends, and the scope's record is
+    read again once it's locked since another worker may have changed it meanwhile.
     '''
-    def lock_scope(self):
-        self.l.debug(str.format(
-            "locking scope: {}",
-            self.get_network_object() ) )
+    def acquire_lock(self, mode = lock_manager.X):
+        parents = []
+        index   = self.parent_scope
 
-        if self.is_locked():
-            raise Exception("scope is already locked")
+        while index != None:
+            parents.insert(0, index)
 
-        self.get_db_table().update( { 'locked': True } )
+            index = index.parent_scope
 
-        self.update_scope_change_log( {'reason': "scope was locked" } )
+        for index, index_mode in [ ( index, lock_manager.IX ) for index in parents ] + [ ( self, mode ) ]:
+            key = scope_storage.get_key(index)
+
+            scope.locks.acquire(key, index_mode)
+
+            unit_of_work.on_exit(
+                lambda key = key, index_mode = index_mode: scope.locks.release(key, index_mode) )
+
+        ( unit_of_work.get_current() != None
+          and unit_of_work.get_current().reload(self) )
 
         return(self)
 
@@ -588,23 +795,7 @@ class scope():
             raise Exception("scope is not allocated, and therefore is not and cannot be owned")
 
         return(
-            self.get_db_table(
-            ).get( (
-                Query().scope != None )
-            ).get('owner') != None )
-
-    '''
-    Indicates whether or not the current scope is locked
-    '''
-    def is_locked(self):
-        if not self.is_allocated():
-            raise Exception("scope is not allocated, can't be locked")
-
-        return(
-            self.get_db_table(
-            ).get( (
-                Query().scope != None )
-            ).get('locked') == True )
+            self.get_record().get('owner') != None )
 
     '''
     '''
@@ -613,20 +804,17 @@ class scope():
             return(self.should_be_locked)
 
         elif self.is_allocated():
-              self.lock_down = self.get_db_table(
-              ).get((Query(
-              ).scope != None )
-              ).get('should_be_locked')
+              lock_down = self.get_record().get('should_be_locked')
 
-              if self.lock_down:
-                  return(self.lock_down)
+              if lock_down:
+                  return(lock_down)
 
-              elif self.get_parent_scope() != None:
-                  return(self.get_parent_scope(
-                  ).should_be_locked() == True )
+              elif self.parent_scope != None:
+                  return(self.parent_scope.scope_should_be_locked() == True )
 
     '''
-    Updates the changelog for the current scope
+    Updates the changelog for the current scope, the entry is queued to the scope journal rather than stored in
+    the scope's record
     '''
     def update_scope_change_log(self, reason):
         self.l.debug(str.format(
@@ -637,24 +825,34 @@ class scope():
         if not self.is_allocated():
             raise Exception("scope is not yet allocated")
 
-        cur_change_log = (self.get_db_table(
-        ).get((
-            Query().scope != None )
-        ).get('change_log') )
-
-        cur_change_log.append({
+        entry = {
+            "scope": self.get_scope_id(),
+            "tcp_ip_version": self.net_obj_ver,
             "modification_date": str(datetime.datetime.now() ),
             "reason": reason
-        } )
+        }
 
-        self.get_db_table().update( { 'change_log': cur_change_log } )
+        unit_of_work.on_commit(
+            lambda: scope.journal.append(entry) )
 
         return(self)
 
     '''
-    Creates a database table and saves the current scope
+    Gets the changelog for the current scope, entries stored in the scope's record before the scope journal
+    existed come first
     '''
-    def initialize_allocation(self):
+    def get_scope_change_log(self):
+        if not self.is_allocated():
+            raise Exception("scope is not yet allocated")
+
+        return(( self.get_record().get('change_log') or [] ) + [
+            index for index in scope.journal.read(self.get_scope_id() )
+            if index.get('tcp_ip_version') == self.net_obj_ver ] )
+
+    '''
+    Creates a database table and saves the current scope, optionally already owned
+    '''
+    def initialize_allocation(self, owner = None):
         self.l.debug(str.format(
             "initializing scope allocation: {}",
             self.get_network_object() ) )
@@ -662,26 +860,33 @@ class scope():
         if self.is_allocated():
             raise Exception("already allocated")
 
-        self.get_db_table().insert({
+        self.insert_record({
             'scope': {
                 'network':      self.network_address_to_big_number(),
                 'prefix':       self.get_prefix()
             },
             'created':          str( datetime.datetime.now() ),
-            'owner':            None,
-            'locked':           False,
+            'owner':            owner,
             'should_be_locked': self.scope_should_be_locked(),
             'preseed_children': self.preseed_children_enabled(),
             'propagate_tags':   self.propagate_tags_enabled(),
             'inherit_tags':     self.inherit_tags_enabled(),
             'child_prefix':     self.get_child_prefix(),
             'tcp_ip_version':   self.get_tcp_ip_ver(),
-            'change_log':       [],
             'tags':             self.get_tags(),
             'parent_scope': {
                 'network':      self.get_parent_scope().network_address_to_big_number(),
                 'prefix':       self.get_parent_scope().get_prefix() } } )
 
+        if ( self.get_child_prefix() == None
+             and self.get_allocation_bitmap() != None ):
+            unit_of_work.on_commit(
+                lambda: self.initialize_allocation_bitmap(scan_storage = False) )
+
+        if self.get_prefix() != self.get_host_prefix():
+            unit_of_work.on_commit(
+                lambda: scope.tree.add(self) )
+
         return(self)
 
     '''
@@ -693,29 +898,80 @@ class scope():
             self.get_network_object(),
             new_owner ) )
 
-        if self.is_locked():
-            raise Exception("locked can't set owner")
+        self.acquire_lock()
 
         if self.is_owned():
             raise Exception("already owned, must use clear_ownership() owner first")
 
-        self.get_db_table().update( { 'owner': new_owner } )
+        self.update_record( { 'owner': new_owner } )
 
         self.update_scope_change_log({
             'reason': "new owner was assigned",
             'owner': new_owner
         } )
 
+        self.update_parent_allocation_bitmap(True)
+
+        self.update_parent_allocation_trie(True)
+
         return(self)
 
     '''
-    Gets an allocated child scope from the current scope that is not currently assigned
+    Gets an allocated child scope from the current scope that is not currently assigned, of the child
+    prefixlen defined in the schema or of the specified prefixlen. The first free block of the prefixlen is
+    found with the allocation trie and checked against storage since another process may have claimed it, in
+    which case the next free block is tried. When the trie has no free block it is rebuilt from storage once,
+    in case another process released one, before reporting that none is available. The returned scope is not
+    locked: claiming it fails with version_conflict when the unit of work commits if another process claimed
+    it meanwhile, see unit_of_work.retry.
     '''
-    def get_unassigned_scope(self):
+    def get_unassigned_scope(self, prefix = None):
 
         self.l.debug(str.format(
-            "requested unassigned child scope for current scope: {}",
-            self.get_network_object() ) )
+            "requested unassigned child scope for current scope: {} prefixlen: {}",
+            self.get_network_object(),
+            prefix ) )
+
+        if prefix != None and not self.get_prefix() < prefix < self.get_host_prefix():
+            raise Exception(str.format(
+                "prefixlen {} is not within scope {}",
+                prefix,
+                self.get_network_object() ) )
+
+        if self.get_child_prefix() != None:
+            self.acquire_lock(lock_manager.IX)
+
+            level = ( prefix != None
+                      and prefix
+                      or self.get_child_prefix() ) - self.get_prefix()
+
+            for refresh in [ False, True ]:
+                trie   = self.get_allocation_trie(refresh)
+                offset = trie.find_first_free(level)
+
+                while offset != None:
+                    index = self.get_new_scope_object(
+                        self.get_child_network_object(offset, self.get_prefix() + level) )
+
+                    if index.is_allocated() and not index.is_owned():
+                        self.l.debug(str.format(
+                            "found previously allocated unassigned child scope {}",
+                            index ) )
+
+                        return(index)
+
+                    elif not index.is_allocated():
+                        self.l.debug(str.format(
+                            "found un-allocated (never before owned) child scope {}",
+                            index ) )
+
+                        return(index)
+
+                    trie.set(level, offset)
+
+                    offset = trie.find_first_free(level)
+
+            raise Exception('no unassigned scopes available')
 
         for index in self.children(
                 mode = 0x4 ):
@@ -743,16 +999,79 @@ class scope():
             "clearing ownership for scope: {}",
             self.get_network_object() ) )
 
-        if self.is_locked():
-            raise Exception("can't erase ownership, locked")
+        self.acquire_lock()
 
         if not self.is_owned():
             raise Exception("clear ownership called but scope is not owned")
 
-        self.get_db_table().update( { 'owner': None } )
+        self.update_record( {
+            'owner':    None,
+            'released': str( datetime.datetime.now() ) } )
 
         self.update_scope_change_log( { 'reason': "ownership was cleared" } )
 
+        self.update_parent_allocation_bitmap(False)
+
+        self.update_parent_allocation_trie(False)
+
+        return(self)
+
+    '''
+    Claims the current scope for an owner, allocating it first if required, with a single record write and a
+    single changelog entry. The scope is not locked, the record is written compare-and-swap against the
+    version it was read at (see unit_of_work.commit) so that of two workers claiming the same scope only one
+    succeeds.
+    '''
+    def claim(self, owner):
+        self.l.debug(str.format(
+            "claiming scope: {} for owner {}",
+            self.get_network_object(),
+            owner ) )
+
+        if not self.is_allocated():
+            self.initialize_allocation(
+                owner = owner )
+
+        elif self.is_owned():
+            raise Exception("already owned, must use release() first")
+
+        else:
+            self.update_record( { 'owner': owner } )
+
+        self.update_scope_change_log({
+            'reason': "scope was claimed",
+            'owner': owner
+        } )
+
+        self.update_parent_allocation_bitmap(True)
+
+        self.update_parent_allocation_trie(True)
+
+        return(self)
+
+    '''
+    Releases the current scope's owner with a single record write and a single changelog entry
+    '''
+    def release(self):
+        self.l.debug(str.format(
+            "releasing scope: {}",
+            self.get_network_object() ) )
+
+        self.acquire_lock()
+
+        if not self.is_owned():
+            raise Exception("release called but scope is not owned")
+
+        self.update_record( {
+            'owner':    None,
+            'released': str( datetime.datetime.now() ) } )
+
+        self.update_scope_change_log( { 'reason': "scope was released" } )
+
+        self.update_parent_allocation_bitmap(False)
+
+        self.update_parent_allocation_trie(False)
+
         return(self)
 
     '''
@@ -764,47 +1083,553 @@ class scope():
             "deleting scope: {}",
             self.get_network_object() ) )
 
-        if self.is_allocated() and self.is_locked():
-            raise Exception("scope is locked, can't delete until unlocked")
+        self.acquire_lock()
 
-        self.db.drop_table(str.format(
-            "{}/{}",
-            self.get_network_object().network_address,
-            self.get_prefix() ) )
+        self.delete_record()
+
+        unit_of_work.on_commit(self.delete_instance_files)
+
+        return(self)
 
-        if self.use_own_db() == True:
-            self.db.close()
+    '''
+    Removes the allocation bitmap and lease table files of the current scope, the record's own file (if any)
+    is removed by the storage backend. The scope's allocation trie is dropped from this process.
+    '''
+    def delete_instance_files(self):
+        scope.allocation_tries.pop(scope_storage.get_key(self), None)
+
+        lease_table.tables.discard(self.get_instance_file('leases') )
+
+        allocation_bitmap.bitmaps.discard(self.get_instance_file('bitmap') )
 
-            os.remove(str.format(
-                "/data/{}.{}.json",
-                self.network_address_to_big_number(),
-                self.get_prefix()
-            ) )
+        for extension in [ 'bitmap', 'leases' ]:
+            if os.path.exists(self.get_instance_file(extension) ):
+                os.remove(self.get_instance_file(extension) )
 
         return(self)
 
     '''
     Retrieves a scope of prefixlen 32 (for IPv4) or 128 (for IPv6) - A single address
-    in either case
+    in either case. Reserved addresses are never leased, except for the gateway address when gateway
+    is set (ex: Docker requesting the address of the network's gateway.)
+
+    Pools indexed by an allocation bitmap lease their first free address, larger pools (ex: an IPv6 /64)
+    lease an address derived from the endpoint's MAC address or a hash, see lease_interface_id_address. The
+    pool is locked for changes of it's children (IX, see acquire_lock) but the address is not: workers lease
+    from the same pool in parallel, and claiming an address another worker claimed meanwhile fails when the
+    unit of work commits (see claim).
+
+    Addresses held by lease reservations are only leased with the reservation's token (see
+    reserve_network_addresses), once the reservation is used up or expired the token gets a free address.
     '''
-    def lease_network_address(self):
+    def lease_network_address(self, gateway = False, mac_address = None, token = None):
         self.l.debug(str.format(
             'leasing IP address from scope: {}',
             self.get_network_object().network_address ) )
 
-        for index in self.children(
-                child_net_obj = (
-                    self.get_tcp_ip_ver() == 4
-                    and self.get_network_object("0.0.0.0/32")
-                    or  self.get_network_object("0::/0") ),
-                mode = 0x4 ):
+        if gateway:
+            return(self.lease_gateway_address() )
+
+        reservation = token != None and self.take_lease_reservation(token) or None
+
+        if reservation != None:
+            return(reservation)
+
+        bitmap = self.get_allocation_bitmap()
+
+        if bitmap != None:
+            self.acquire_lock(lock_manager.IX)
+
+            if not bitmap.exists():
+                self.initialize_allocation_bitmap()
 
-            return(index)
+            offset = bitmap.find_first_free()
+
+            while offset != None:
+                s = self.get_new_scope_object(
+                    self.get_host_network_object(offset) )
+
+                if not s.is_allocated() or not s.is_owned():
+                    return(s)
+
+                s.update_parent_allocation_bitmap(True)
+
+                offset = bitmap.find_first_free(offset + 1)
+
+            raise Exception("no un-leased addresses available in scope")
+
+        return(self.lease_interface_id_address(mac_address) )
+
+    '''
+    Retrieves a single address whose host part is a candidate interface identifier (see interface_id): the
+    EUI-64 identifier of mac_address, then hashes keyed by this scope. Each candidate is looked up by key,
+    an address that is reserved, owned, held by a lease reservation or in exclude is skipped for the next
+    candidate.
+    '''
+    def lease_interface_id_address(self, mac_address = None, exclude = []):
+        self.acquire_lock(lock_manager.IX)
+
+        reserved = self.get_reserved_ranges()
+
+        held = set(exclude) | { index.get('network') for index in self.get_lease_reservations() }
+
+        for offset in interface_id.get_candidates(
+                self.network.network.to_bytes(16, 'big') + bytes([ self.get_prefix() ]),
+                self.get_host_prefix() - self.get_prefix(),
+                mac_address ):
+
+            if reserved.contains(offset) or self.network.network + offset in held:
+                continue
+
+            s = self.get_new_scope_object(self.get_host_network_object(offset) )
+
+            if not s.is_allocated() or not s.is_owned():
+                return(s)
 
         raise Exception("no un-leased addresses available in scope")
 
     '''
-    Retrieves an existing /32 or /128 (single address) scope
+    Reserves count addresses of this scope for the single address leases requested with the reservation's
+    token (see lease_network_address) and returns ( token, addresses ), ex: for the containers of a
+    scale-out that is about to start. With an allocation bitmap the addresses are a contiguous range when
+    one is free, and the bitmap is updated once for all of them. The reservation is stored in this scope's
+    record within the active unit of work, addresses of a reservation that were not leased within ttl
+    seconds are available again (see expire_lease_reservations).
+    '''
+    def reserve_network_addresses(self, count, ttl = 300):
+        self.l.debug(str.format(
+            'reserving {} IP addresses from scope: {}',
+            count,
+            self.get_network_object() ) )
+
+        self.acquire_lock()
+
+        if count <= 0:
+            raise Exception("number of addresses to reserve must be positive")
+
+        if ttl < 0:
+            raise Exception("time to live of a reservation must not be negative")
+
+        bitmap   = self.get_allocation_bitmap()
+        networks = []
+
+        if bitmap != None:
+            if not bitmap.exists():
+                self.initialize_allocation_bitmap()
+
+            offsets = bitmap.find_free_offsets(count)
+
+            if offsets == None:
+                raise Exception("not enough un-leased addresses available in scope")
+
+            networks = [ self.network.network + offset for offset in offsets ]
+
+            unit_of_work.on_commit(
+                lambda: [ self.get_allocation_bitmap().set(offset) for offset in offsets ] )
+
+        else:
+            for index in range(count):
+                networks.append(self.lease_interface_id_address(
+                    exclude = networks ).network_address_to_big_number() )
+
+        expires = str(datetime.datetime.now() + datetime.timedelta(seconds = ttl) )
+        token   = os.urandom(16).hex()
+
+        self.update_record( {
+            'lease_reservations': self.get_lease_reservations() + [
+                { 'network': index, 'expires': expires, 'token': token } for index in networks ] } )
+
+        self.update_scope_change_log( {
+            'reason':  "addresses were reserved",
+            'count':   count,
+            'expires': expires } )
+
+        return( (
+            token,
+            [ self.get_new_scope_object(scope_network(index, self.get_host_prefix(), self.net_obj_ver) )
+              for index in networks ] ) )
+
+    '''
+    Gets the lease reservations of this scope (see reserve_network_addresses) that have not expired
+    '''
+    def get_lease_reservations(self):
+        now = datetime.datetime.now()
+
+        return( [ index for index in ( ( self.get_record() or {} ).get('lease_reservations') or [] )
+                  if datetime.datetime.fromisoformat(index.get('expires') ) > now ] )
+
+    '''
+    Removes the first address reserved with token from this scope's lease reservations and returns it, or
+    None if no address is reserved with token. Expired reservations are dropped meanwhile, see
+    expire_lease_reservations.
+    '''
+    def take_lease_reservation(self, token):
+        reservations = ( self.get_record() or {} ).get('lease_reservations') or []
+
+        if not any(index.get('token') == token for index in reservations):
+            return(None)
+
+        self.acquire_lock()
+
+        pending = self.expire_lease_reservations()
+
+        taken = next( ( index for index in pending if index.get('token') == token ), None)
+
+        if taken == None:
+            return(None)
+
+        self.update_record( {
+            'lease_reservations': [ index for index in pending if index is not taken ] } )
+
+        return(self.get_new_scope_object(scope_network(
+            taken.get('network'),
+            self.get_host_prefix(),
+            self.net_obj_ver ) ) )
+
+    '''
+    Drops the expired lease reservations of this scope, their addresses are freed in the allocation bitmap
+    once the unit of work commits. Returns the reservations that have not expired. Called when leasing with
+    a token and by the collector, so that reservations that are never used don't hold addresses forever.
+    '''
+    def expire_lease_reservations(self):
+        reservations = ( self.get_record() or {} ).get('lease_reservations') or []
+
+        pending = self.get_lease_reservations()
+
+        if len(pending) == len(reservations):
+            return(pending)
+
+        self.acquire_lock()
+
+        reservations = ( self.get_record() or {} ).get('lease_reservations') or []
+
+        pending = self.get_lease_reservations()
+
+        expired = [ index.get('network') - self.network.network
+                    for index in reservations if index not in pending ]
+
+        self.update_record( { 'lease_reservations': pending } )
+
+        self.update_scope_change_log( {
+            'reason': "address reservations expired",
+            'count':  len(expired) } )
+
+        if self.get_allocation_bitmap() != None and len(expired) > 0:
+            unit_of_work.on_commit(
+                lambda: [ bitmap.clear(offset)
+                          for bitmap in [ self.get_allocation_bitmap() ]
+                          if bitmap.exists()
+                          for offset in expired ] )
+
+        return(pending)
+
+    '''
+    Retrieves the gateway address of this scope (see get_gateway_offset) if it isn't owned
+    '''
+    def lease_gateway_address(self):
+        self.acquire_lock(lock_manager.IX)
+
+        offset = self.get_gateway_offset()
+
+        if offset == None:
+            raise Exception("scope has no gateway address")
+
+        s = self.get_new_scope_object(self.get_host_network_object(offset) )
+
+        if s.is_allocated() and s.is_owned():
+            raise Exception("gateway address is already leased")
+
+        return(s)
+
+    '''
+    Gets the offset of this scope's gateway address, the first address after the network address, or None
+    if this scope is too small to have one
+    '''
+    def get_gateway_offset(self):
+        if self.network.get_num_addresses() < 4:
+            return(None)
+
+        return(1)
+
+    '''
+    Gets the address ranges of this scope that are never leased: the network, broadcast and gateway addresses,
+    and the reservations declared in the schema for this scope or any of it's parent scopes. The ranges are
+    computed once per scope in a process.
+    '''
+    def get_reserved_ranges(self):
+        key = scope_storage.get_key(self)
+
+        if key not in scope.reservations:
+            ranges = self.get_declared_reserved_ranges()
+
+            if self.get_prefix() != self.get_host_prefix():
+                ranges.add(0, 0)
+                ranges.add(ranges.size - 1, ranges.size - 1)
+
+                if self.get_gateway_offset() != None:
+                    ranges.add(self.get_gateway_offset(), self.get_gateway_offset() )
+
+            scope.reservations[ key ] = ranges
+
+        return(scope.reservations.get(key) )
+
+    '''
+    Gets the address ranges of this scope reserved in the schema (the reserved list of this scope and it's
+    parent scopes)
+    '''
+    def get_declared_reserved_ranges(self):
+        ranges = reserved_ranges(self.network.get_num_addresses() )
+
+        index = self
+
+        while index != None:
+            for entry in index.reserved:
+                first, last = reserved_ranges.parse(entry, self.net_obj_ver)
+
+                ranges.add(first, last, base = self.network.network)
+
+            index = index.parent_scope
+
+        return(ranges)
+
+    '''
+    Gets the prefixlen of a single address (32 for IPv4, 128 for IPv6) for the current scope
+    '''
+    def get_host_prefix(self):
+        return(self.network.get_max_prefix() )
+
+    '''
+    Gets the single address network value at the specified offset from this scope's network address
+    '''
+    def get_host_network_object(self, offset):
+        return(self.network.get_subnet(offset, self.get_host_prefix() ) )
+
+    '''
+    Gets the allocation bitmap for the addresses in this scope, or None if this scope is a single
+    address or has too many addresses to be indexed by a bitmap
+    '''
+    def get_allocation_bitmap(self):
+        if self.get_prefix() == self.get_host_prefix():
+            return(None)
+
+        size = self.network.get_num_addresses()
+
+        if not allocation_bitmap.supports_size(size):
+            return(None)
+
+        return(allocation_bitmap.open(
+            self.get_instance_file('bitmap'),
+            size ) )
+
+    '''
+    Creates the allocation bitmap for this scope, marking the reserved addresses (see get_reserved_ranges),
+    the addresses held by lease reservations and every address already owned in storage. A newly allocated scope has no owned children so
+    scan_storage may be disabled, otherwise (ex: a scope allocated before bitmaps existed) every
+    address is enumerated once.
+    '''
+    def initialize_allocation_bitmap(self, scan_storage = True):
+        bitmap = self.get_allocation_bitmap()
+
+        self.l.debug(str.format(
+            "initializing allocation bitmap for scope: {}",
+            self.get_network_object() ) )
+
+        bitmap.create(reserved = list(self.get_reserved_ranges().get_offsets() ) + [
+            index.get('network') - self.network.network for index in self.get_lease_reservations() ] )
+
+        if not scan_storage:
+            return(self)
+
+        if self.get_lease_table() != None:
+            [ bitmap.set(offset)
+              for offset, owner, flags, generation in self.get_lease_table().allocated_slots()
+              if flags & lease_table.owned ]
+
+            return(self)
+
+        for index in self.children(
+                child_net_obj = self.get_host_network_object(0),
+                mode = 0x8 | 0x2 ):
+
+            bitmap.set(index.get_host_offset() )
+
+        return(self)
+
+    '''
+    Gets the lease table holding the single address scopes of this scope, or None if this scope is a single
+    address or has too many addresses for a lease table. The lease table is created on first use, leases
+    already stored as records (ex: by a version without lease tables) are imported with one storage scan.
+    '''
+    def get_lease_table(self):
+        if self.get_prefix() == self.get_host_prefix():
+            return(None)
+
+        size = self.network.get_num_addresses()
+
+        if not lease_table.supports_size(size):
+            return(None)
+
+        table = lease_table.open(
+            self.get_instance_file('leases'),
+            size )
+
+        if table.map == None and not table.exists():
+            self.l.debug(str.format(
+                "initializing lease table for scope: {}",
+                self.get_network_object() ) )
+
+            table.create()
+
+            for record in self.storage.scan(
+                    self,
+                    self.get_host_prefix() ):
+
+                table.write(
+                    record.get('scope').get('network') - self.network_address_to_big_number(),
+                    record.get('owner'),
+                    ( lease_table.allocated
+                      | ( record.get('owner') != None and lease_table.owned or 0 )
+                      | ( record.get('locked') and lease_table.locked or 0 ) ),
+                    created  = lease_table_storage.to_seconds(record.get('created') ),
+                    released = lease_table_storage.to_seconds(record.get('released') ) )
+
+        return(table)
+
+    '''
+    Gets the offset of this scope's network address from it's parent scope's network address
+    '''
+    def get_host_offset(self):
+        return( self.network_address_to_big_number()
+                - self.get_parent_scope().network_address_to_big_number() )
+
+    '''
+    Sets or clears this single address scope's bit in the parent scope's allocation bitmap, if the
+    parent scope has one. The bit of a reserved address (ex: the gateway) stays set when it's released.
+    '''
+    def update_parent_allocation_bitmap(self, owned):
+        if ( self.parent_scope == None
+             or self.get_prefix() != self.get_host_prefix()
+             or self.is_reserved_in_parent() ):
+            return(self)
+
+        if self.parent_scope.get_allocation_bitmap() != None:
+            unit_of_work.on_commit(
+                lambda: [ bitmap.update(self.get_host_offset(), owned)
+                          for bitmap in [ self.parent_scope.get_allocation_bitmap() ]
+                          if bitmap.exists() ] )
+
+        return(self)
+
+    '''
+    Indicates whether this single address scope is one of the parent scope's reserved addresses
+    '''
+    def is_reserved_in_parent(self):
+        return(self.parent_scope.get_reserved_ranges().contains(self.get_offset_in(self.parent_scope) ) )
+
+    '''
+    Gets the network value at the specified offset among this scope's subnets of the specified prefixlen
+    (the child prefixlen by default)
+    '''
+    def get_child_network_object(self, offset, prefix = None):
+        return(self.network.get_subnet(
+            offset,
+            ( prefix != None
+              and prefix
+              or self.get_child_prefix() ) ) )
+
+    '''
+    Gets the offset of this scope among the specified parent scope's subnets of this scope's prefixlen
+    '''
+    def get_offset_in(self, parent):
+        return(parent.network.get_offset(self.network) )
+
+    '''
+    Gets the allocation trie of the blocks allocated within this scope, or None if this scope has no child
+    prefixlen. Owned children and children with children of their own (ex: scopes nested in the schema) of
+    the child prefixlen, and owned children of other prefixlens carved from this scope (see
+    get_unassigned_scope) are allocated. Blocks reserved in the schema are never free, nor are the other
+    reserved addresses (see get_reserved_ranges) when children are single addresses. The levels of released
+    children carved from this scope are recorded as well, see scope_collector.get_pool_prefixes.
+
+    The trie is built from storage with one scan per prefixlen on first use in a process (or when refresh
+    is set) and kept current by claim, release, set_owner and clear_ownership.
+    '''
+    def get_allocation_trie(self, refresh = False):
+        if self.get_child_prefix() == None:
+            return(None)
+
+        key = scope_storage.get_key(self)
+
+        if refresh or key not in scope.allocation_tries:
+            self.l.debug(str.format(
+                "building allocation trie for scope: {}",
+                self.get_network_object() ) )
+
+            trie = allocation_trie(self.get_host_prefix() - self.get_prefix() )
+
+            [ trie.set(level, index)
+              for level, index in (
+                  self.get_child_prefix() == self.get_host_prefix()
+                  and self.get_reserved_ranges()
+                  or self.get_declared_reserved_ranges() ).get_blocks(trie.depth) ]
+
+            for prefix in range(self.get_prefix() + 1, self.get_host_prefix() + 1):
+                if prefix == self.get_host_prefix() and prefix != self.get_child_prefix():
+                    continue
+
+                for record in self.get_child_storage(prefix).scan(self, prefix):
+                    if ( prefix == self.get_child_prefix()
+                         and ( record.get('owner') != None
+                               or record.get('child_prefix') != None ) ) or (
+                            record.get('owner') != None
+                            and record.get('parent_scope') == {
+                                'network': self.network_address_to_big_number(),
+                                'prefix':  self.get_prefix() } ):
+
+                        trie.set(
+                            prefix - self.get_prefix(),
+                            ( record.get('scope').get('network') - self.network_address_to_big_number() )
+                            >> ( self.get_host_prefix() - prefix ) )
+
+                    elif record.get('parent_scope') == {
+                            'network': self.network_address_to_big_number(),
+                            'prefix':  self.get_prefix() }:
+
+                        trie.add_level(prefix - self.get_prefix() )
+
+            scope.allocation_tries[ key ] = trie
+
+        return(scope.allocation_tries.get(key) )
+
+    '''
+    Allocates or frees this scope's block in the parent scope's allocation trie, if the trie has been built
+    in this process. A freed block is merged with it's free buddies.
+    '''
+    def update_parent_allocation_trie(self, owned):
+        if self.parent_scope == None:
+            return(self)
+
+        trie = scope.allocation_tries.get(scope_storage.get_key(self.parent_scope) )
+
+        if ( trie == None
+             or self.get_prefix() <= self.parent_scope.get_prefix()
+             or ( self.get_prefix() == self.get_host_prefix()
+                  and self.is_reserved_in_parent() ) ):
+            return(self)
+
+        level  = self.get_prefix() - self.parent_scope.get_prefix()
+        offset = self.get_offset_in(self.parent_scope)
+
+        unit_of_work.on_commit(
+            lambda: ( owned and trie.set or trie.clear )(level, offset) )
+
+        return(self)
+
+    '''
+    Retrieves an existing /32 or /128 (single address) scope. The address (a string, with or without
+    prefixlen, or a network object) is resolved directly to it's record by key: the scope's own record,
+    or it's slot in this scope's lease table, without enumerating the other addresses of this scope.
+    Reserved addresses are resolved as well, ex: the gateway address once it has been leased.
     '''
     def get_network_address(self, address):
         self.l.debug(str.format(
@@ -815,22 +1640,20 @@ class scope():
         request = None
 
         if type(address) == str:
-            request = self.get_network_object(address)
+            request = scope_network.parse(address, self.net_obj_ver)
 
         elif type(address) == type(self.get_network_object()):
-            request = address
+            request = scope_network.parse(address, self.net_obj_ver)
 
         else:
             raise Exception('unknown type for address parameter')
 
-        for index in self.children(
-                child_net_obj = (
-                    self.get_tcp_ip_ver() == 4
-                    and self.get_network_object("0.0.0.0/32")
-                    or  self.get_network_object("0::/128") ),
-                mode = 0x8 ):
+        if ( request.prefix == self.get_host_prefix()
+             and self.network.contains(request) ):
 
-            if index.get_network_object() == request:
-                return(index)
+            s = self.get_new_scope_object(request)
+
+            if s.is_allocated():
+                return(s)
 
         raise Exception("Requested scope was not found")
@@ -0,0 +1,490 @@
+import datetime, fcntl, itertools, logging, os, threading, time
+from .scope import scope
+from .scope_storage import scope_storage, version_conflict
+from .scope_network import scope_network
+from .lease_table import lease_table
+from .allocation_bitmap import allocation_bitmap
+from .unit_of_work import unit_of_work
+
+'''
+Incremental garbage collector for scopes and files that are no longer used. Collects:
+
+- leaf scopes (scopes without allocated children) that were released, or allocated but never owned,
+  more than grace_period seconds ago; their record, file, allocation bitmap and lease table are deleted
+- expired lease reservations of pools, their addresses are freed (see scope.expire_lease_reservations)
+- files in the data directory that no scope refers to any more, once unmodified for grace_period
+  seconds: files of networks outside of every schema scope (ex: after a schema change), bitmaps and lease
+  tables of scopes that have no record, records whose parent scope no longer exists, address records
+  superseded by their pool's lease table and temporary files left by interrupted writes
+
+Scopes defined in the schema are never collected. Collection runs in a background thread, one batch of
+candidates per interval, so that a collection cycle is spread over time rather than blocking requests.
+Every process sharing the data directory runs a collector but only one batch runs per interval across
+all of them.
+
+Simple usage:
+
+from svc.scope_collector import scope_collector
+
+c = scope_collector(f.scopes).start()
+
+c.get_reclaimed()
+
+'''
+class scope_collector():
+    '''
+    Creates a new collector instance
+
+    Parameters:
+
+    scopes (list): the scopes defined in the schema, see scope_factory.initialize
+    interval (float): seconds between batches
+    batch (int): number of candidates (scopes or files) examined per batch
+    grace_period (int): seconds a released scope or an orphaned file is kept before it's collected
+
+    '''
+    def __init__(
+            self,
+            scopes,
+            interval     = 1.0,
+            batch        = 16,
+            grace_period = 24 * 60 * 60 ):
+
+        self.l               = logging.getLogger(__name__)
+        self.scopes          = scopes
+        self.interval        = interval
+        self.batch           = batch
+        self.grace_period    = grace_period
+        self.cycle           = None
+        self.cycle_reclaimed = None
+        self.pid             = None
+        self.guard           = threading.Lock()
+        self.reclaimed       = {
+            'scopes': 0,
+            'files':  0,
+            'bytes':  0 }
+
+    '''
+    Starts the collector thread, once in each process (ex: after uWSGI forks it's workers)
+    '''
+    def start(self):
+        with self.guard:
+            if self.pid == os.getpid():
+                return(self)
+
+            if self.pid == None:
+                os.register_at_fork(after_in_child = self.restart)
+
+            self.pid   = os.getpid()
+            self.cycle = None
+
+            threading.Thread(
+                target = self.run,
+                daemon = True ).start()
+
+        return(self)
+
+    '''
+    Starts the collector thread in a forked process, the guard is replaced since it may have been held by
+    another thread of the parent process when it forked
+    '''
+    def restart(self):
+        self.guard = threading.Lock()
+
+        self.start()
+
+    '''
+    Gets the number of scopes, files and bytes reclaimed by this process' collector
+    '''
+    def get_reclaimed(self):
+        with self.guard:
+            return(dict(self.reclaimed) )
+
+    '''
+    Collector thread, runs a batch every interval
+    '''
+    def run(self):
+        while self.pid == os.getpid():
+            time.sleep(self.interval)
+
+            try:
+                self.run_batch()
+
+            except Exception as ex:
+                self.l.error(ex, exc_info = True)
+
+    '''
+    Examines the next batch of candidates of the current cycle, unless another process ran a batch less
+    than interval seconds ago
+    '''
+    def run_batch(self):
+        os.makedirs(scope.layout.root, exist_ok = True)
+
+        filename = os.path.join(scope.layout.root, '.collector.lock')
+
+        with open(filename, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+            except BlockingIOError:
+                return(False)
+
+            if time.time() - os.fstat(lock.fileno() ).st_mtime < self.interval:
+                return(False)
+
+            os.utime(filename)
+
+            if self.cycle == None:
+                self.cycle           = self.get_candidates()
+                self.cycle_reclaimed = self.get_reclaimed()
+
+            for index in range(self.batch):
+                candidate = next(self.cycle, None)
+
+                if candidate == None:
+                    if self.get_reclaimed() != self.cycle_reclaimed:
+                        self.l.info(str.format(
+                            "collection cycle complete, reclaimed {} in total",
+                            self.get_reclaimed() ) )
+
+                    self.cycle = None
+
+                    break
+
+                try:
+                    if type(candidate) == str:
+                        self.collect_file(candidate)
+
+                    else:
+                        self.collect_scope(candidate)
+
+                except Exception as ex:
+                    self.l.error(ex, exc_info = True)
+
+        return(True)
+
+    '''
+    Enumerates the candidates of one collection cycle, child scopes of every schema scope (deepest first)
+    followed by every file of the data directory
+    '''
+    def get_candidates(self):
+        schema = { scope_storage.get_key(index) for index in self.scopes }
+
+        for index in list(self.scopes):
+            for candidate in self.get_scope_candidates(index, schema):
+                yield(candidate)
+
+        for directory, name in scope.layout.get_files():
+            yield(os.path.join(directory, name) )
+
+    '''
+    Enumerates the un-owned descendants of a scope that are not defined in the schema, and the ones holding
+    lease reservations. Pools are enumerated at the prefixlens in use in the scope (see get_pool_prefixes)
+    since pools claimed with a custom prefixlen are not at the child prefixlen, the ones of a nested scope
+    are enumerated with it. Address leases kept in a lease table are not enumerated, they are removed with
+    their pool.
+    '''
+    def get_scope_candidates(self, parent, schema):
+        if parent.get_prefix() == parent.get_host_prefix():
+            return
+
+        if parent.get_child_prefix() == None:
+            if not os.path.exists(parent.get_instance_file('leases') ):
+                for record, child in self.get_children(parent, parent.get_host_prefix(), owned = False):
+                    yield(child)
+
+            return
+
+        for prefix in self.get_pool_prefixes(parent):
+            for record, child in self.get_children(parent, prefix):
+                if ( scope_storage.get_key(child) in schema
+                     or ( prefix != parent.get_child_prefix()
+                          and record.get('parent_scope') != {
+                              'network': parent.network_address_to_big_number(),
+                              'prefix':  parent.get_prefix() } ) ):
+                    continue
+
+                for candidate in self.get_scope_candidates(child, schema):
+                    yield(candidate)
+
+                if record.get('owner') == None or len(record.get('lease_reservations') or []) > 0:
+                    yield(child)
+
+    '''
+    Gets the prefixlens pools of a scope are allocated with, from the longest so that nested pools are
+    enumerated before the pools that contain them: the child prefixlen and the prefixlens blocks of the
+    scope's allocation trie were allocated at (see allocation_trie.get_levels), rather than every prefixlen
+    between the scope's and it's host prefixlen. The trie is built once per process and kept current by the claims of
+    this process, a pool another worker carved at a new prefixlen since is enumerated by that worker's
+    collector or once the trie is rebuilt.
+    '''
+    @staticmethod
+    def get_pool_prefixes(s):
+        trie = s.get_allocation_trie()
+
+        return(sorted(
+            { prefix for prefix in itertools.chain(
+                [ s.get_child_prefix() ],
+                trie != None and [ s.get_prefix() + level for level in trie.get_levels() ] or [] )
+              if s.get_prefix() < prefix < s.get_host_prefix() },
+            reverse = True ) )
+
+    '''
+    Enumerates (record, scope) for the allocated children of a scope with the specified prefixlen. Scope
+    objects are created directly rather than with get_new_scope_object, which creates lease tables.
+    '''
+    @staticmethod
+    def get_children(parent, prefix, owned = None):
+        for record in parent.storage.scan(parent, prefix, owned = owned):
+            yield( (
+                record,
+                scope(
+                    cidr       = scope_network(
+                        record.get('scope').get('network'),
+                        prefix,
+                        parent.net_obj_ver ),
+                    db         = ( parent.use_own_db() != True
+                                   and parent.db
+                                   or None ),
+                    parent     = parent,
+                    tcp_ip_ver = parent.get_tcp_ip_ver() ) ) )
+
+    '''
+    Deletes a scope if it can be collected, within a unit of work so that the record read to decide and
+    the deletion are consistent. A scope claimed by another worker meanwhile is skipped, it's record is
+    deleted compare-and-swap (see unit_of_work.commit). Expired lease reservations of the scope are
+    dropped first.
+    '''
+    def collect_scope(self, s):
+        self.expire_lease_reservations(s)
+
+        sizes = self.get_sizes([ s.get_instance_file(extension) for extension in (
+            s.use_own_db() == True
+            and [ 'json', 'json.wal', 'bitmap', 'leases' ]
+            or [ 'bitmap', 'leases' ] ) ] )
+
+        try:
+            with unit_of_work():
+                s.acquire_lock()
+
+                if not self.is_collectable(s):
+                    return(False)
+
+                self.l.debug(str.format(
+                    "collecting scope: {}",
+                    s.get_network_object() ) )
+
+                s.update_scope_change_log( { 'reason': "scope was collected" } )
+
+                s.delete_record()
+
+                s.update_parent_allocation_trie(False)
+
+                unit_of_work.on_commit(s.delete_instance_files)
+
+        except version_conflict as ex:
+            self.l.debug(str.format(
+                "not collecting scope: {}",
+                ex ) )
+
+            return(False)
+
+        self.add_reclaimed(1, {
+            filename: size for filename, size in sizes.items()
+            if not os.path.exists(filename) } )
+
+        return(True)
+
+    '''
+    Drops the expired lease reservations of a scope in a unit of work of their own, a scope changed by
+    another worker meanwhile is skipped until the next cycle
+    '''
+    def expire_lease_reservations(self, s):
+        try:
+            with unit_of_work():
+                s.expire_lease_reservations()
+
+        except version_conflict as ex:
+            self.l.debug(str.format(
+                "not expiring lease reservations: {}",
+                ex ) )
+
+    '''
+    Indicates whether a scope is allocated, un-owned since more than grace_period seconds and has no
+    allocated children
+    '''
+    def is_collectable(self, s):
+        record = s.get_record()
+
+        if record == None or record.get('owner') != None:
+            return(False)
+
+        since = ( record.get('released') != None
+                  and record.get('released')
+                  or record.get('created') )
+
+        if ( since == None
+             or ( datetime.datetime.now()
+                  - datetime.datetime.fromisoformat(since) ).total_seconds() < self.grace_period ):
+            return(False)
+
+        return(not self.has_children(s) )
+
+    '''
+    Indicates whether a scope has allocated children, released addresses in it's lease table are not
+    counted since the lease table is deleted with the scope. Children are looked up at every prefixlen
+    between the scope's and it's host prefixlen rather than only the ones in use in this process (see
+    get_pool_prefixes), the scope is about to be deleted.
+    '''
+    @staticmethod
+    def has_children(s):
+        if s.get_prefix() == s.get_host_prefix():
+            return(False)
+
+        if s.get_child_prefix() != None:
+            return(any(
+                next(s.storage.scan(s, prefix), None) != None
+                for prefix in range(s.get_host_prefix() - 1, s.get_prefix(), -1) ) )
+
+        if os.path.exists(s.get_instance_file('leases') ):
+            return(any(
+                flags & lease_table.owned
+                for offset, owner, flags, generation in s.get_lease_table().allocated_slots() ) )
+
+        return(next(s.storage.scan(s, s.get_host_prefix() ), None) != None )
+
+    '''
+    Deletes a file of the data directory if no scope refers to it
+    '''
+    def collect_file(self, filename):
+        if not os.path.exists(filename) or not self.is_orphaned_file(filename):
+            return(False)
+
+        self.l.debug(str.format(
+            "collecting orphaned file: {}",
+            filename ) )
+
+        sizes = self.get_sizes([ filename ])
+
+        scope.handles.discard(filename)
+
+        lease_table.tables.discard(filename)
+
+        allocation_bitmap.bitmaps.discard(filename)
+
+        os.remove(filename)
+
+        self.add_reclaimed(0, sizes)
+
+        return(True)
+
+    '''
+    Indicates whether a file of the data directory is no longer referred to by any scope
+    '''
+    def is_orphaned_file(self, filename):
+        if time.time() - os.stat(filename).st_mtime < self.grace_period:
+            return(False)
+
+        match = scope.layout.shard_file.match(os.path.basename(filename) )
+
+        if match.group(4) != None:
+            return(True)
+
+        network, prefix, extension = int(match.group(1) ), int(match.group(2) ), match.group(3)
+
+        schema_scope = self.get_schema_scope(network, prefix)
+
+        if schema_scope == None:
+            return(True)
+
+        tcp_ip_ver = schema_scope.net_obj_ver
+
+        if scope_storage.get_key(schema_scope) == ( tcp_ip_ver, prefix, network ):
+            return(False)
+
+        if schema_scope.use_own_db() != True:
+            return( extension in [ 'bitmap', 'leases' ]
+                    and schema_scope.storage.get(scope(
+                        cidr       = scope_network(network, prefix, tcp_ip_ver),
+                        db         = schema_scope.db,
+                        tcp_ip_ver = tcp_ip_ver ) ) == None )
+
+        if extension in [ 'json', 'json.wal' ]:
+            return(not self.has_parent(
+                tcp_ip_ver,
+                scope.layout.get_path(tcp_ip_ver, prefix, network, 'json') ) )
+
+        return(not self.has_record(tcp_ip_ver, prefix, network) )
+
+    '''
+    Indicates whether a scope using it's own file has a record, the record may only be in the write-ahead
+    log when PYIPAM_STORAGE=tinydb-wal
+    '''
+    @staticmethod
+    def has_record(tcp_ip_ver, prefix, network):
+        return(any(
+            os.path.exists(scope.layout.get_path(tcp_ip_ver, prefix, network, extension) )
+            for extension in [ 'json', 'json.wal' ] ) )
+
+    '''
+    Gets the most specific schema scope that contains the specified network, or None
+    '''
+    def get_schema_scope(self, network, prefix):
+        candidates = [
+            index for index in self.scopes
+            if prefix <= index.get_host_prefix()
+            and index.network.contains(scope_network(network, prefix, index.net_obj_ver) ) ]
+
+        return(max(
+            candidates,
+            key     = lambda s: s.get_prefix(),
+            default = None ) )
+
+    '''
+    Indicates whether the record in a scope's own file has a parent scope, that is either defined in the
+    schema or has a file of it's own. Address records of a pool with a lease table were imported into the
+    lease table and are not counted as having a parent.
+    '''
+    def has_parent(self, tcp_ip_ver, filename):
+        data = scope.instance_storage(filename).read() or {}
+
+        record = next( (
+            index for table in data.values()
+            for index in table.values()
+            if index.get('scope') != None ), None )
+
+        if record == None:
+            return(False)
+
+        if record.get('parent_scope') == None:
+            return(True)
+
+        key = (
+            tcp_ip_ver,
+            record.get('parent_scope').get('prefix'),
+            record.get('parent_scope').get('network') )
+
+        if ( record.get('scope').get('prefix') == ( tcp_ip_ver == 4 and 32 or 128 )
+             and os.path.exists(scope.layout.get_path(*key, 'leases') ) ):
+            return(False)
+
+        return( key in { scope_storage.get_key(index) for index in self.scopes }
+                or self.has_record(*key) )
+
+    '''
+    Gets the size of each of the specified files that exists
+    '''
+    @staticmethod
+    def get_sizes(filenames):
+        return( { filename: os.path.getsize(filename)
+                  for filename in filenames
+                  if os.path.exists(filename) } )
+
+    '''
+    Adds collected scopes and the sizes of removed files to the reclaimed totals
+    '''
+    def add_reclaimed(self, scopes, sizes):
+        with self.guard:
+            self.reclaimed[ 'scopes' ] += scopes
+            self.reclaimed[ 'files' ]  += len(sizes)
+            self.reclaimed[ 'bytes' ]  += sum(sizes.values() )
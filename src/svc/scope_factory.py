@@ -1,5 +1,11 @@
-import json, logging, itertools
+import atexit, fcntl, json, logging, itertools, os, threading, time
 from .scope import scope
+from .scope_storage import scope_storage
+from .scope_snapshot import scope_snapshot
+from .readers_writer_lock import readers_writer_lock
+from .unit_of_work import unit_of_work
+from .scope_network import scope_network
+from .prefix_index import prefix_index
 from ipaddress import IPv6Network as n6, IPv4Network as n4
 
 '''
@@ -11,6 +17,11 @@ f = sf()
 
 s = f.initialize()
 
+f.watch()
+
+with f.reading():
+    f.get_pool_scope('1681915904/30')
+
 '''
 class scope_factory():
     '''
@@ -19,7 +30,8 @@ class scope_factory():
     Parameters:
 
     schema (str): A path to the scope schema JSON file, defaults to /work/schema.json
-    db (TinyDB): A tinyDB instance. If specified, is passed by reference to each scope object instance.
+    db (TinyDB or scope_storage): A tinyDB instance or a storage backend (ex: sqlite_scope_storage.) If
+    specified, is passed by reference to each scope object instance, otherwise each scope uses it's own file.
 
     '''
     def __init__(
@@ -27,16 +39,25 @@ class scope_factory():
             schema   = '/work/schema.json',
             db       = None ):
 
-        self.schema  = json.load(open(schema ) )
-        self.db      = db
-        self.l       = logging.getLogger(__name__)
-        self.scopes  = []
+        self.schema_file     = schema
+        self.schema_modified = self.get_schema_modified()
+        self.schema          = json.load(open(schema ) )
+        self.db              = db
+        self.l               = logging.getLogger(__name__)
+        self.scopes          = []
+        self.prefixes        = prefix_index()
+        self.version         = readers_writer_lock()
+        self.watcher         = None
+        self.watch_interval  = None
+        self.guard           = threading.Lock()
 
         if self.db != None:
             self.use_own_db = False
         else:
             self.use_own_db = True
 
+        unit_of_work.add_listener(scope.snapshot.increment_generation)
+
         self.l.debug((str.format(
             "schema: <{}...>, db: {}",
             str(self.schema)[:50],
@@ -97,6 +118,29 @@ class scope_factory():
                 'big' ),
             int( prefixlen ) ) )
 
+    '''
+    Gets the most specific schema scope containing the pool identified by a pool id (ex: 3323088896/30),
+    and the pool's scope. The schema scope is found with one longest prefix match lookup in the prefix index
+    built by initialize, the pool's scope is it's node in the scope tree (see scope.get_new_scope_object).
+    '''
+    def get_pool_scope(self, pool_id):
+        id, prefix = pool_id.split('/')
+
+        net = scope_network.parse(
+            self.network_id_to_network_object(
+                id,
+                int( prefix ) ),
+            None )
+
+        parent = self.prefixes.lookup(net, net.prefix - 1)
+
+        if parent == None:
+            raise Exception(str.format(
+                "pool {} is not within a scope defined in the schema",
+                net ) )
+
+        return( ( parent, parent.get_new_scope_object(net) ) )
+
     '''
     Retrieve a single known and allocated or unknown but allocated scope
     '''
@@ -327,7 +371,8 @@ class scope_factory():
         return(ret)
 
     '''
-    Enumerates parent scopes defined in the schema as scope objects
+    Enumerates parent scopes defined in the schema as scope objects, scopes none of the filter tags apply to
+    are skipped with a lookup in the tag index
     '''
     def get_parent_scopes(
             self,
@@ -336,8 +381,15 @@ class scope_factory():
             p_s_filter   = lambda factory, s, n, t: factory.parent_scope_filter( s, n, t ),
             s_enumerator = lambda factory: factory.scopes ):
 
+        tagged = None
+
+        if type(filter_tags) == list and len(filter_tags) > 0:
+            tagged = scope.tagged.get_scopes(filter_tags)
+
         for index in s_enumerator(self):
-            self.l.debug('hi')
+            if tagged != None and scope_storage.get_key(index) not in tagged:
+                continue
+
             if p_s_filter(
                     self,
                     index,
@@ -347,7 +399,228 @@ class scope_factory():
                 yield(index)
 
     '''
-    Parses schema and creates/initializes top-level existing scopes, method is recursive
+    Builds the tag index (see scope.tagged) of the scopes defined in the schema, resolving the tags each
+    scope inherits from it's parent scopes once. Scopes are indexed after their parent scope since
+    initialize adds a scope before the scopes nested in it.
+    '''
+    def index_tags(self):
+        scope.tagged.clear()
+
+        for index in self.scopes:
+            scope.tagged.add(
+                scope_storage.get_key(index),
+                ( index.parent_scope != None
+                  and scope_storage.get_key(index.parent_scope)
+                  or None ),
+                index.get_tags(),
+                index.inherit_tags_enabled() )
+
+        return(self)
+
+    '''
+    Pre-seeds the children of a scope if enabled in the schema. Children are not created one by one, the
+    scope's whole child range is marked as pre-seeded (locked down if the schema locks down the scope or
+    it's parent) and each child is only written to storage once it changes, see scope.is_preseeded
+    '''
+    def preseed_children(self, s, current, parent_schema):
+        if not s.preseed_children_enabled():
+            return(self)
+
+        scope.preseeded[ scope_storage.get_key(s) ] = (
+            current.get('lock_down') == True
+            or ( parent_schema != None
+                 and parent_schema.get('lock_down') == True ) )
+
+        return(self)
+
+    '''
+    Creates the scope object of a scope defined in the schema, settings missing from the schema are taken
+    from the parent scope
+    '''
+    def new_schema_scope(self, current, parent):
+        return(scope(
+            cidr = str.format(
+                '{}/{}',
+                current.get('network'), (
+                    current.get('prefix') != None
+                    and current.get('prefix')
+                    or ( parent != None
+                         and parent.get_child_prefix()
+                         or ( _ for _ in () ).throw(Exception(
+                             'missing required schema parameter for child prefix' ) ) ) ) ),
+            child_prefix = current.get('child_prefix'),
+            parent = parent,
+            tags = (
+                current.get('tags') != None
+                and current.get('tags')
+                or [] ),
+            reserved = (
+                current.get('reserved') != None
+                and current.get('reserved')
+                or [] ),
+            preseed_children = (
+                parent != None
+                and parent.preseed_children_enabled()
+                or ( current.get('pre_seed_children')
+                     and current.get('pre_seed_children')
+                     or False ) ),
+            propagate_tags = (
+                current.get('propagate_tags') != None
+                and current.get('propagate_tags')
+                or False ),
+            tcp_ip_ver = (
+                current.get('tcp_ip_version') != None
+                and current.get('tcp_ip_version')
+                or ( parent != None
+                     and parent.get_tcp_ip_ver()
+                     or (_ for _ in ()).throw(Exception(
+                         'missing required schema parameter for TCP/IP version') ) ) ),
+            db = (
+                not self.use_own_db
+                and self.db
+                or None ),
+            should_be_locked = (
+                current.get('lock_down')
+                and current.get('lock_down')
+                or None ),
+            inherit_tags = (
+                current.get('inherit_tags')
+                and current.get('inherit_tags')
+                or ( parent != None
+                    and parent.propagate_tags_enabled()
+                    or True ) ) ) )
+
+    '''
+    Adds the scopes defined in the schema to the scope tree and the prefix index
+    '''
+    def index_scopes(self):
+        scope.tree.clear()
+
+        [ scope.tree.add(index) for index in self.scopes ]
+
+        self.prefixes.clear()
+
+        [ self.prefixes.add(index.network, index) for index in self.scopes ]
+
+        return(self)
+
+    '''
+    Gets the key of the snapshot of this factory's scopes, see scope_snapshot.get_key
+    '''
+    def get_snapshot_key(self):
+        return(scope_snapshot.get_key(
+            self.schema,
+            ( self.use_own_db
+              and scope.instance_storage.__name__
+              or type(self.db).__name__ ) ) )
+
+    '''
+    Gets the state of the scopes defined in the schema to store in a snapshot: the settings of each scope
+    (parents are referred to by their position, a scope follows it's parent), the pre-seeded scopes, the
+    tag index and the allocation tries
+    '''
+    def get_snapshot_state(self):
+        positions = { id(index): position for position, index in enumerate(self.scopes) }
+        keys      = [ scope_storage.get_key(index) for index in self.scopes ]
+
+        return( {
+            'scopes': [ {
+                'network':          index.network,
+                'parent':           positions.get(id(index.parent_scope) ),
+                'tcp_ip_ver':       index.get_tcp_ip_ver(),
+                'child_prefix':     index.child_prefix,
+                'preseed_children': index.preseed_children,
+                'propagate_tags':   index.propagate_tags,
+                'inherit_tags':     index.inherit_tags,
+                'should_be_locked': index.should_be_locked,
+                'tags':             index.tags,
+                'reserved':         index.reserved }
+                for index in self.scopes ],
+            'preseeded': { key: scope.preseeded.get(key)
+                           for key in keys if key in scope.preseeded },
+            'tagged':    scope.tagged,
+            'tries':     dict(scope.allocation_tries) } )
+
+    '''
+    Saves a snapshot of the scopes defined in the schema for the specified storage generation, a snapshot
+    that can't be written is logged and skipped
+    '''
+    def save_snapshot(self, generation):
+        try:
+            scope.snapshot.save(
+                self.get_snapshot_key(),
+                generation,
+                self.get_snapshot_state() )
+
+        except Exception as ex:
+            self.l.warning(str.format(
+                "unable to save snapshot: {}",
+                ex ) )
+
+        return(self)
+
+    '''
+    Saves a snapshot if the scopes of this process reflect the current storage generation (no other
+    worker wrote records since this process loaded or saved a snapshot), called at exit
+    '''
+    def save_current_snapshot(self):
+        if scope.snapshot.is_current():
+            self.save_snapshot(scope.snapshot.known)
+
+        return(self)
+
+    '''
+    Loads the scopes defined in the schema from the snapshot instead of rebuilding them from the schema and
+    storage: the scopes are created from their stored settings without reading their records, the
+    indexes and allocation tries are restored as stored. Returns False when there is no snapshot for the
+    schema and the current storage generation.
+    '''
+    def load_snapshot(self):
+        state = scope.snapshot.load(self.get_snapshot_key() )
+
+        if state == None:
+            return(False)
+
+        self.scopes = []
+
+        for index in state.get('scopes'):
+            self.scopes.append(scope(
+                cidr             = index.get('network'),
+                parent           = (
+                    index.get('parent') != None
+                    and self.scopes[ index.get('parent') ]
+                    or None ),
+                tcp_ip_ver       = index.get('tcp_ip_ver'),
+                child_prefix     = index.get('child_prefix'),
+                preseed_children = index.get('preseed_children'),
+                propagate_tags   = index.get('propagate_tags'),
+                inherit_tags     = index.get('inherit_tags'),
+                should_be_locked = index.get('should_be_locked'),
+                tags             = index.get('tags'),
+                reserved         = index.get('reserved'),
+                db               = (
+                    not self.use_own_db
+                    and self.db
+                    or None ) ) )
+
+        self.index_scopes()
+
+        scope.preseeded.update(state.get('preseeded') )
+
+        scope.tagged = state.get('tagged')
+
+        scope.allocation_tries.update(state.get('tries') )
+
+        self.l.info(str.format(
+            "loaded {} scopes from snapshot",
+            len(self.scopes) ) )
+
+        return(True)
+
+    '''
+    Parses schema and creates/initializes top-level existing scopes, method is recursive. The first call
+    loads the scopes from the snapshot when it matches the schema and storage generation (see load_snapshot),
+    otherwise the scopes are built and a snapshot of them is saved.
 
     Parameters:
     current (dict): First call should be none, used during recursion to process nested scope blocks defined in the schema
@@ -375,59 +648,35 @@ class scope_factory():
             str( parent_schema )[ :50 ] ) )
 
         if current == None:
+            atexit.register(self.save_current_snapshot)
+
+            if self.load_snapshot():
+                return(self.scopes)
+
+            if self.use_own_db and os.path.isdir(scope.layout.root):
+                scope.layout.migrate()
+
+                scope.tinydb_storage.move_nested_tables(
+                    scope.layout,
+                    scope.instance_storage )
+
             [ self.initialize( current = index )
               for index in self.schema.get('scopes') ]
 
+            generation = scope.snapshot.get_generation()
+
+            self.index_scopes()
+
+            [ index.get_allocation_trie() for index in self.scopes ]
+
+            self.index_tags()
+
+            self.save_snapshot(generation)
+
             return(self.scopes)
 
         else:
-            s = scope(
-                cidr = str.format(
-                    '{}/{}',
-                    current.get('network'), (
-                        current.get('prefix') != None
-                        and current.get('prefix')
-                        or ( parent != None
-                             and parent.get_child_prefix()
-                             or ( _ for _ in () ).throw(Exception(
-                                 'missing required schema parameter for child prefix' ) ) ) ) ),
-                child_prefix = current.get('child_prefix'),
-                parent = parent,
-                tags = (
-                    current.get('tags') != None
-                    and current.get('tags')
-                    or [] ),
-                preseed_children = (
-                    parent != None
-                    and parent.preseed_children_enabled()
-                    or ( current.get('pre_seed_children')
-                         and current.get('pre_seed_children')
-                         or False ) ),
-                propagate_tags = (
-                    current.get('propagate_tags') != None
-                    and current.get('propagate_tags')
-                    or False ),
-                tcp_ip_ver = (
-                    current.get('tcp_ip_version') != None
-                    and current.get('tcp_ip_version')
-                    or ( parent != None
-                         and parent.get_tcp_ip_ver()
-                         or (_ for _ in ()).throw(Exception(
-                             'missing required schema parameter for TCP/IP version') ) ) ),
-                db = (
-                    self.use_own_db
-                    and self.db
-                    or None ),
-                should_be_locked = (
-                    current.get('lock_down')
-                    and current.get('lock_down')
-                    or None ),
-                inherit_tags = (
-                    current.get('inherit_tags')
-                    and current.get('inherit_tags')
-                    or ( parent != None
-                        and parent.propagate_tags_enabled()
-                        or True ) ) )
+            s = self.new_schema_scope(current, parent)
 
             if ( not s.is_allocated() ):
                 s.initialize_allocation()
@@ -440,41 +689,14 @@ class scope_factory():
                     parent_schema = current )
                   for index in current.get('scopes') ]
 
-                if s.preseed_children_enabled():
-                    [ self.scopes.append( ( ( not index.is_allocated()
-                          and (
-                              current.get('lock_down') )
-                          or (
-                              parent_schema != None
-                              and parent_schema.get('lock_down') ) )
-                         and (
-                             index.initialize_allocation().lock_scope() ) )
-                        or (
-                            index.is_allocated()
-                            and index ) )
-                        for index in s.children(
-                                mode = 0x2 ) ]
-
-                if ( current.get('lock_down')
-                    or (
-                        parent_schema != None
-                        and parent_schema.get('lock_down') ) ):
-                    s.lock_scope()
+                self.preseed_children(s, current, parent_schema)
 
                 return
 
             elif s.is_allocated():
-                if current.get('lock_down') == True and not s.is_locked():
-                    self.l.warn(str.format(
-                        "schema says scope {} should be locked down but it isn't current_schema: <{}...>",
-                        s.get_network_object(),
-                        str( current )[ :50 ] ) )
-
                 self.scopes.append(s)
 
-                if s.preseed_children_enabled():
-                    [ self.scopes.append(index) for index in s.children(
-                        mode = 0x2 ) ]
+                self.preseed_children(s, current, parent_schema)
 
                 [ self.initialize(
                     current       = index,
@@ -483,3 +705,336 @@ class scope_factory():
                   for index in current.get('scopes') ]
 
                 return
+
+    '''
+    Holds the current version of the scopes defined in the schema for the duration of a with block, a schema
+    reload (see reload_schema) waits for requests holding it and is applied before the next request
+    '''
+    def reading(self):
+        return(self.version.reading() )
+
+    '''
+    Gets the modification time and size of the schema file, see watch
+    '''
+    def get_schema_modified(self):
+        stat = os.stat(self.schema_file)
+
+        return( ( stat.st_mtime_ns, stat.st_size ) )
+
+    '''
+    Enumerates the scopes defined in a schema as dicts of the scope's key (see scope_storage.get_key), the
+    key of it's parent scope, it's schema and parent schema and it's settings; a scope follows it's
+    parent. Settings missing from the schema are taken from the parent scope's settings as initialize
+    does, without reading storage, so that the scopes of two schemas can be compared.
+    '''
+    @staticmethod
+    def get_schema_nodes(schema, current = None, parent = None, parent_schema = None):
+        if current == None:
+            for index in schema.get('scopes'):
+                for node in scope_factory.get_schema_nodes(schema, index):
+                    yield(node)
+
+            return
+
+        parent_settings = ( parent != None
+                            and parent.get('settings')
+                            or {} )
+
+        tcp_ip_ver = (
+            current.get('tcp_ip_version') != None
+            and current.get('tcp_ip_version')
+            or ( parent_settings.get('tcp_ip_ver') != None
+                 and parent_settings.get('tcp_ip_ver')
+                 or (_ for _ in ()).throw(Exception(
+                     'missing required schema parameter for TCP/IP version') ) ) )
+
+        network = scope_network.parse(
+            str.format(
+                '{}/{}',
+                current.get('network'), (
+                    current.get('prefix') != None
+                    and current.get('prefix')
+                    or ( parent_settings.get('child_prefix') != None
+                         and parent_settings.get('child_prefix')
+                         or ( _ for _ in () ).throw(Exception(
+                             'missing required schema parameter for child prefix' ) ) ) ) ),
+            tcp_ip_ver )
+
+        node = {
+            'key':           ( network.version, network.prefix, network.network ),
+            'parent':        ( parent != None
+                               and parent.get('key')
+                               or None ),
+            'schema':        current,
+            'parent_schema': parent_schema,
+            'settings':      {
+                'tcp_ip_ver':       tcp_ip_ver,
+                'child_prefix':     current.get('child_prefix'),
+                'tags':             current.get('tags') or [],
+                'reserved':         current.get('reserved') or [],
+                'preseed_children': (
+                    parent_settings.get('preseed_children') == True
+                    or current.get('pre_seed_children') == True ),
+                'propagate_tags':   current.get('propagate_tags') == True,
+                'inherit_tags':     (
+                    current.get('inherit_tags')
+                    and current.get('inherit_tags')
+                    or True ),
+                'should_be_locked': (
+                    current.get('lock_down')
+                    and current.get('lock_down')
+                    or None ),
+                'lock_down':        (
+                    current.get('lock_down') == True
+                    or ( parent_schema != None
+                         and parent_schema.get('lock_down') == True ) ) } }
+
+        yield(node)
+
+        for index in current.get('scopes') or []:
+            for child in scope_factory.get_schema_nodes(schema, index, node, current):
+                yield(child)
+
+    '''
+    Removes a scope that is no longer defined in the schema from the scope tree and indexes, it's record and
+    files are left to the collector (see scope_collector)
+    '''
+    def remove_schema_scope(self, s):
+        key = scope_storage.get_key(s)
+
+        scope.tree.discard(s)
+
+        self.prefixes.discard(s.network)
+
+        scope.tagged.remove(key)
+
+        scope.preseeded.pop(key, None)
+
+        scope.allocation_tries.pop(key, None)
+
+        return(self)
+
+    '''
+    Creates, allocates and indexes a scope added to the schema
+    '''
+    def add_schema_scope(self, node, parent):
+        s = self.new_schema_scope(node.get('schema'), parent)
+
+        with unit_of_work():
+            if not s.is_allocated():
+                s.initialize_allocation()
+
+        scope.tree.discard(s)
+        scope.tree.add(s)
+
+        self.prefixes.add(s.network, s)
+
+        self.preseed_children(s, node.get('schema'), node.get('parent_schema') )
+
+        scope.tagged.add(
+            node.get('key'),
+            node.get('parent'),
+            s.get_tags(),
+            s.inherit_tags_enabled() )
+
+        return(s)
+
+    '''
+    Applies the changed settings of a scope defined in the schema to it's scope object, record (tags added
+    at runtime are kept) and indexes
+    '''
+    def update_schema_scope(self, s, node, previous, parent):
+        settings = node.get('settings')
+
+        s.parent_scope     = parent
+        s.child_prefix     = settings.get('child_prefix')
+        s.tags             = settings.get('tags')
+        s.reserved         = settings.get('reserved')
+        s.preseed_children = settings.get('preseed_children')
+        s.propagate_tags   = settings.get('propagate_tags')
+        s.inherit_tags     = settings.get('inherit_tags')
+        s.should_be_locked = settings.get('should_be_locked')
+
+        with unit_of_work():
+            if not s.is_allocated():
+                s.initialize_allocation()
+
+            record = s.get_record()
+
+            changes = { key: value for key, value in {
+                'child_prefix':     settings.get('child_prefix'),
+                'preseed_children': settings.get('preseed_children'),
+                'propagate_tags':   settings.get('propagate_tags'),
+                'inherit_tags':     settings.get('inherit_tags'),
+                'should_be_locked': settings.get('should_be_locked'),
+                'tags':             settings.get('tags') + [
+                    index for index in record.get('tags') or []
+                    if index not in previous.get('settings').get('tags')
+                    and index not in settings.get('tags') ],
+                'parent_scope':     (
+                    parent != None
+                    and {
+                        'network': parent.network_address_to_big_number(),
+                        'prefix':  parent.get_prefix() }
+                    or record.get('parent_scope') ) }.items()
+                if record.get(key) != value }
+
+            if len(changes) > 0:
+                s.update_record(changes)
+
+                s.update_scope_change_log({
+                    'reason':  "schema was reloaded",
+                    'changes': changes } )
+
+        if node.get('parent') != previous.get('parent'):
+            scope.tree.discard(s)
+            scope.tree.add(s)
+
+        scope.tagged.add(
+            node.get('key'),
+            node.get('parent'),
+            s.get_tags(),
+            s.inherit_tags_enabled() )
+
+        scope.preseeded.pop(node.get('key'), None)
+
+        self.preseed_children(s, node.get('schema'), node.get('parent_schema') )
+
+        return(s)
+
+    '''
+    Reloads the schema file and applies the differences between the scopes defined in the current and the
+    new schema, compared by key (network and prefixlen): scopes that were removed are dropped from the
+    indexes, scopes that were added are created, and scopes whose settings (ex: tags, lock_down,
+    child_prefix) changed are updated in place. Only the affected scopes are touched: allocation tries are
+    rebuilt for added and changed scopes and the parents of added scopes, reserved ranges are resolved again
+    if any reservation changed. Changes are applied while holding the version as the writer (see reading),
+    and storage changes while holding a lock shared by every worker. Returns whether the schema changed.
+    '''
+    def reload_schema(self):
+        schema = json.load(open(self.schema_file) )
+
+        if schema == self.schema:
+            return(False)
+
+        previous = { node.get('key'): node for node in self.get_schema_nodes(self.schema) }
+        nodes    = list(self.get_schema_nodes(schema) )
+        keys     = { node.get('key') for node in nodes }
+
+        removed = [ key for key in reversed(list(previous) ) if key not in keys ]
+        added   = [ node for node in nodes if node.get('key') not in previous ]
+        changed = { node.get('key') for node in nodes
+                    if node.get('key') in previous
+                    and ( node.get('settings') != previous.get(node.get('key') ).get('settings')
+                          or node.get('parent') != previous.get(node.get('key') ).get('parent') ) }
+
+        if len(removed) + len(added) + len(changed) == 0:
+            self.schema = schema
+
+            return(False)
+
+        with self.version.writing():
+            os.makedirs(scope.layout.root, exist_ok = True)
+
+            with open(os.path.join(scope.layout.root, '.schema.lock'), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+                current   = { scope_storage.get_key(index): index for index in self.scopes }
+                refresh   = set()
+                reserving = set()
+
+                for key in removed:
+                    self.remove_schema_scope(current.pop(key) )
+
+                for node in nodes:
+                    key    = node.get('key')
+                    parent = current.get(node.get('parent') )
+
+                    if key not in previous:
+                        current[ key ] = self.add_schema_scope(node, parent)
+
+                        refresh.update([ key, node.get('parent') ])
+
+                    elif key in changed:
+                        self.update_schema_scope(current.get(key), node, previous.get(key), parent)
+
+                        refresh.add(key)
+
+                        ( node.get('settings').get('reserved')
+                          != previous.get(key).get('settings').get('reserved')
+                          and reserving.add(key) )
+
+                    ( node.get('parent') in reserving
+                      and reserving.add(key) )
+
+                if len(reserving) > 0:
+                    scope.reservations.clear()
+
+                    refresh.update(reserving)
+
+                for key in refresh:
+                    ( current.get(key) != None
+                      and current.get(key).get_allocation_trie(refresh = True) )
+
+            self.scopes[:] = [ current.get(node.get('key') ) for node in nodes ]
+
+            self.schema = schema
+
+        self.l.info(str.format(
+            "schema reloaded, {} scopes added, {} removed, {} changed",
+            len(added),
+            len(removed),
+            len(changed) ) )
+
+        self.save_current_snapshot()
+
+        return(True)
+
+    '''
+    Starts watching the schema file for changes, once in each process (ex: after uWSGI forks it's workers):
+    the file is checked every interval seconds and reloaded when it's modified, see reload_schema
+    '''
+    def watch(self, interval = 1.0):
+        with self.guard:
+            if self.watcher == os.getpid():
+                return(self)
+
+            if self.watcher == None:
+                os.register_at_fork(after_in_child = self.rewatch)
+
+            self.watcher        = os.getpid()
+            self.watch_interval = interval
+
+            threading.Thread(
+                target = self.run_watcher,
+                daemon = True ).start()
+
+        return(self)
+
+    '''
+    Starts watching the schema file in a forked process, the locks are replaced since they may have been
+    held by another thread of the parent process when it forked
+    '''
+    def rewatch(self):
+        self.guard   = threading.Lock()
+        self.version = readers_writer_lock()
+
+        self.watch(self.watch_interval)
+
+    '''
+    Watcher thread, reloads the schema when it's modification time or size changed
+    '''
+    def run_watcher(self):
+        while self.watcher == os.getpid():
+            time.sleep(self.watch_interval)
+
+            try:
+                modified = self.get_schema_modified()
+
+                if modified != self.schema_modified:
+                    self.schema_modified = modified
+
+                    self.reload_schema()
+
+            except Exception as ex:
+                self.l.error(ex, exc_info = True)
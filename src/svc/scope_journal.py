@@ -0,0 +1,177 @@
+import atexit, fcntl, glob, json, logging, os, queue, threading, time
+
+'''
+Append-only audit journal of scope changes (see scope.update_scope_change_log), entries are JSON
+records, one per line. Entries are handed to a background writer thread so that callers never wait
+on journal I/O. The journal is rotated once it grows past max_bytes or becomes older than max_age
+seconds, and only the newest retention rotated files are kept.
+
+Simple usage:
+
+from svc.scope_journal import scope_journal
+
+j = scope_journal('/data/journal/scope_changes.log')
+
+j.append({ 'scope': '1681915904/30', 'reason': 'scope was locked' })
+
+j.flush()
+
+[ index for index in j.read('1681915904/30') ]
+
+'''
+class scope_journal():
+    '''
+    Creates a new journal instance
+
+    Parameters:
+
+    filename (str): path to the current journal file, rotated files are named <filename>.<timestamp>
+    max_bytes (int): size at which the journal is rotated
+    max_age (int): age in seconds at which the journal is rotated
+    retention (int): number of rotated journal files to keep
+
+    '''
+    def __init__(
+            self,
+            filename  = '/data/journal/scope_changes.log',
+            max_bytes = 16 * 1024 * 1024,
+            max_age   = 24 * 60 * 60,
+            retention = 7 ):
+
+        self.l         = logging.getLogger(__name__)
+        self.filename  = filename
+        self.max_bytes = max_bytes
+        self.max_age   = max_age
+        self.retention = retention
+        self.pending   = None
+        self.writer    = None
+        self.pid       = None
+        self.guard     = threading.Lock()
+
+    '''
+    Queues an entry to be appended to the journal
+    '''
+    def append(self, entry):
+        self.get_pending().put(dict(
+            entry,
+            journaled = time.time() ) )
+
+        return(self)
+
+    '''
+    Blocks until every queued entry has been written
+    '''
+    def flush(self):
+        self.get_pending().join()
+
+        return(self)
+
+    '''
+    Gets the queue of entries waiting to be written, the writer thread is started on first use in
+    each process (ex: after uWSGI forks it's workers), queued entries are flushed at exit
+    '''
+    def get_pending(self):
+        with self.guard:
+            if self.pid != os.getpid():
+                self.pending = queue.Queue()
+
+                self.writer = threading.Thread(
+                    target = self.write_pending,
+                    daemon = True )
+
+                self.writer.start()
+
+                self.pid = os.getpid()
+
+                atexit.register(self.flush)
+
+        return(self.pending)
+
+    '''
+    Writer thread, appends every entry available in the queue with a single write
+    '''
+    def write_pending(self):
+        while True:
+            entries = [ self.pending.get() ]
+
+            while not self.pending.empty():
+                entries.append(self.pending.get_nowait() )
+
+            try:
+                self.write(entries)
+
+            except Exception as ex:
+                self.l.error(ex, exc_info = True)
+
+            finally:
+                [ self.pending.task_done() for index in entries ]
+
+    '''
+    Appends entries to the journal, rotating it first if required
+    '''
+    def write(self, entries):
+        os.makedirs(os.path.dirname(self.filename), exist_ok = True)
+
+        with open(self.filename + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            if self.should_rotate():
+                self.rotate()
+
+            with open(self.filename, 'a') as handle:
+                handle.write(''.join(
+                    json.dumps(index) + '\n'
+                    for index in entries ) )
+
+    '''
+    Indicates whether the current journal file is too large or too old
+    '''
+    def should_rotate(self):
+        if not os.path.exists(self.filename):
+            return(False)
+
+        with open(self.filename) as handle:
+            first = handle.readline()
+
+        return( os.stat(self.filename).st_size >= self.max_bytes
+                or ( first.endswith('\n')
+                     and time.time() - json.loads(first).get('journaled', time.time() )
+                     >= self.max_age ) )
+
+    '''
+    Renames the current journal file and deletes rotated files past the retention count
+    '''
+    def rotate(self):
+        os.rename(self.filename, str.format(
+            "{}.{}",
+            self.filename,
+            time.time_ns() ) )
+
+        for index in self.get_rotated_files()[ : -self.retention or None ]:
+            os.remove(index)
+
+    '''
+    Gets rotated journal files, oldest first
+    '''
+    def get_rotated_files(self):
+        return(sorted(
+            index for index in glob.glob(self.filename + '.*')
+            if index[ len(self.filename) + 1: ].isdigit() ) )
+
+    '''
+    Enumerates journal entries for the specified scope id, oldest first
+    '''
+    def read(self, scope_id):
+        for filename in self.get_rotated_files() + [ self.filename ]:
+            if not os.path.exists(filename):
+                continue
+
+            with open(filename) as handle:
+                for line in handle:
+                    if not line.endswith('\n'):
+                        break
+
+                    entry = json.loads(line)
+
+                    if entry.get('scope') == scope_id:
+                        yield(entry)
@@ -0,0 +1,127 @@
+from ipaddress import IPv4Network as network_object_v4, IPv6Network as network_object_v6
+
+'''
+Compact value type for the network of a scope: the network address as an integer, the prefixlen and
+the TCP/IP version. Containment, supernets, subnets, offsets and broadcast addresses are computed on
+integers, IPv4Network / IPv6Network objects are only built by to_network_object (ex: for responses
+and log messages.)
+
+Simple usage:
+
+from svc.scope_network import scope_network
+
+n = scope_network.parse('100.64.0.0/20', 4)
+
+n.get_subnet(3, 30).to_network_object()
+
+'''
+class scope_network():
+    __slots__ = ( 'network', 'prefix', 'version' )
+
+    '''
+    Creates a new network value
+
+    Parameters:
+
+    network (int): the network address
+    prefix (int): the prefixlen
+    version (int): the TCP/IP version (4 or 6)
+
+    '''
+    def __init__(self, network, prefix, version):
+        self.network = network
+        self.prefix  = prefix
+        self.version = version
+
+    '''
+    Gets a network value from a CIDR string, an IPv4Network / IPv6Network object or a network value
+    '''
+    @staticmethod
+    def parse(cidr, version):
+        if isinstance(cidr, scope_network):
+            return(cidr)
+
+        if isinstance(cidr, str):
+            if version == 4:
+                cidr = network_object_v4(cidr)
+
+            elif version == 6:
+                cidr = network_object_v6(cidr)
+
+            else:
+                raise Exception("invalid TCP/IP version or unsupported")
+
+        return(scope_network(
+            int(cidr.network_address),
+            cidr.prefixlen,
+            cidr.version ) )
+
+    '''
+    Gets the prefixlen of a single address (32 for IPv4, 128 for IPv6)
+    '''
+    def get_max_prefix(self):
+        return( self.version == 4 and 32 or 128 )
+
+    '''
+    Gets the number of addresses in the network
+    '''
+    def get_num_addresses(self):
+        return( 1 << ( self.get_max_prefix() - self.prefix ) )
+
+    '''
+    Gets the broadcast (last) address of the network
+    '''
+    def get_broadcast(self):
+        return( self.network + self.get_num_addresses() - 1 )
+
+    '''
+    Indicates whether the specified network is this network or one of it's subnets
+    '''
+    def contains(self, other):
+        return( other.version == self.version
+                and other.prefix >= self.prefix
+                and self.network <= other.network <= self.get_broadcast() )
+
+    '''
+    Gets the network containing this network with a prefixlen one shorter
+    '''
+    def get_supernet(self):
+        return(scope_network(
+            self.network & ~ ( ( 1 << ( self.get_max_prefix() - self.prefix + 1 ) ) - 1 ),
+            self.prefix - 1,
+            self.version ) )
+
+    '''
+    Gets the subnet of the specified prefixlen at the specified offset (index among this network's subnets
+    of that prefixlen)
+    '''
+    def get_subnet(self, offset, prefix):
+        return(scope_network(
+            self.network + ( offset << ( self.get_max_prefix() - prefix ) ),
+            prefix,
+            self.version ) )
+
+    '''
+    Gets the offset of a subnet among this network's subnets of the subnet's prefixlen
+    '''
+    def get_offset(self, other):
+        return( ( other.network - self.network ) >> ( self.get_max_prefix() - other.prefix ) )
+
+    '''
+    Gets the IPv4Network or IPv6Network object for this network
+    '''
+    def to_network_object(self):
+        return( ( self.version == 4
+                  and network_object_v4
+                  or network_object_v6 )( ( self.network, self.prefix ) ) )
+
+    def __eq__(self, other):
+        return( isinstance(other, scope_network)
+                and ( self.network, self.prefix, self.version )
+                == ( other.network, other.prefix, other.version ) )
+
+    def __hash__(self):
+        return(hash( ( self.network, self.prefix, self.version ) ) )
+
+    def __str__(self):
+        return(self.to_network_object().compressed)
@@ -0,0 +1,266 @@
+import fcntl, hashlib, json, logging, mmap, os, tempfile, threading
+from .allocation_trie import allocation_trie
+from .scope_network import scope_network
+from .tag_index import tag_index
+
+'''
+Versioned snapshot of the scopes materialized by scope_factory.initialize (the schema scopes, the pre-seeded
+scopes, the tag index and the allocation tries), so that a starting worker loads the scope tree from one
+memory-mapped file instead of rebuilding it from the schema and storage. A snapshot is keyed by a hash of
+the schema (and storage backend) and by the storage generation: a counter in the snapshot directory that
+is incremented by every unit of work that writes records, in any worker. A snapshot whose format version,
+key or generation doesn't match is ignored and the scopes are rebuilt.
+
+The snapshot is stored as JSON rather than pickled, so that loading a snapshot never runs code. Values
+JSON has no type for (tuples, sets, dicts with non-string keys, network values, allocation tries and tag
+indexes) are stored as single-key objects naming their type, see encode; any other object is refused
+when the snapshot is loaded.
+
+Simple usage:
+
+from svc.scope_snapshot import scope_snapshot
+
+s = scope_snapshot('/data/snapshot')
+
+s.save(key, s.get_generation(), { 'scopes': [] })
+
+s.load(key)
+
+'''
+class scope_snapshot():
+    '''
+    Format version of the snapshot file, snapshots of another version are ignored
+    '''
+    version = 3
+
+    '''
+    Types stored by their state (see __getstate__ and __setstate__), by the name they are stored under
+    '''
+    types = {
+        'allocation_trie': allocation_trie,
+        'tag_index':       tag_index }
+
+    '''
+    Creates a new snapshot instance
+
+    Parameters:
+
+    directory (str): directory of the snapshot and storage generation files
+
+    '''
+    def __init__(self, directory = '/data/snapshot'):
+        self.l         = logging.getLogger(__name__)
+        self.directory = directory
+        self.filename  = os.path.join(directory, 'scopes.snapshot')
+        self.counter   = os.path.join(directory, 'generation')
+        self.known     = None
+        self.guard     = threading.Lock()
+
+    '''
+    Gets the key of a snapshot: a hash of the schema and the names of the storage backends, so that a
+    snapshot is never loaded for another schema or storage configuration
+    '''
+    @staticmethod
+    def get_key(schema, *storage):
+        return( hashlib.sha256(
+            repr( ( schema, storage ) ).encode('utf-8') ).hexdigest() )
+
+    '''
+    Converts a value to the JSON types, values JSON has no type for are converted to an object with a
+    single key naming their type
+    '''
+    @staticmethod
+    def encode(value):
+        if isinstance(value, ( str, int, float, bool ) ) or value == None:
+            return(value)
+
+        if isinstance(value, list):
+            return( [ scope_snapshot.encode(index) for index in value ] )
+
+        if isinstance(value, tuple):
+            return( { 'tuple': [ scope_snapshot.encode(index) for index in value ] } )
+
+        if isinstance(value, ( set, frozenset ) ):
+            return( { 'set': [ scope_snapshot.encode(index) for index in value ] } )
+
+        if isinstance(value, dict):
+            return( { 'dict': [ [ scope_snapshot.encode(key), scope_snapshot.encode(index) ]
+                                for key, index in value.items() ] } )
+
+        if isinstance(value, scope_network):
+            return( { 'scope_network': [ value.network, value.prefix, value.version ] } )
+
+        for name, kind in scope_snapshot.types.items():
+            if type(value) is kind:
+                return( { name: scope_snapshot.encode(value.__getstate__() ) } )
+
+        raise Exception(str.format(
+            "unable to store value of type {} in a snapshot",
+            type(value).__name__ ) )
+
+    '''
+    Converts an object read from JSON back to the value it was encoded from (see encode), objects that
+    don't name a known type are refused
+    '''
+    @staticmethod
+    def decode(value):
+        if len(value) != 1:
+            raise Exception("invalid object in snapshot")
+
+        name, state = next(iter(value.items() ) )
+
+        if name == 'tuple':
+            return(tuple(state) )
+
+        if name == 'set':
+            return(set(state) )
+
+        if name == 'dict':
+            return(dict(state) )
+
+        if name == 'scope_network':
+            return(scope_network(*state) )
+
+        if name in scope_snapshot.types:
+            decoded = scope_snapshot.types.get(name).__new__(scope_snapshot.types.get(name) )
+
+            decoded.__setstate__(state)
+
+            return(decoded)
+
+        raise Exception(str.format(
+            "invalid object of type {} in snapshot",
+            name ) )
+
+    '''
+    Reads and optionally increments the storage generation, under an exclusive lock of the generation file
+    shared by every worker
+    '''
+    def update_generation(self, increment):
+        os.makedirs(self.directory, exist_ok = True)
+
+        fd = os.open(self.counter, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            generation = int.from_bytes(
+                os.pread(fd, 8, 0).ljust(8, b'\0'),
+                'big' )
+
+            if increment:
+                os.pwrite(fd, ( generation + 1 ).to_bytes(8, 'big'), 0)
+
+            return(generation)
+
+        finally:
+            os.close(fd)
+
+    '''
+    Gets the current storage generation
+    '''
+    def get_generation(self):
+        return(self.update_generation(False) )
+
+    '''
+    Increments the storage generation, called once records were written (see unit_of_work.commit). The
+    generation the scopes of this process are current with (see is_current) follows along as long as no
+    other process wrote records in between.
+    '''
+    def increment_generation(self):
+        generation = self.update_generation(True)
+
+        with self.guard:
+            self.known = ( self.known == generation
+                           and generation + 1
+                           or None )
+
+        return(self)
+
+    '''
+    Indicates whether the scopes of this process reflect every record written up to the current storage
+    generation, ex: to save a snapshot at exit
+    '''
+    def is_current(self):
+        with self.guard:
+            return( self.known != None and self.known == self.get_generation() )
+
+    '''
+    Loads the state stored in the snapshot, or None if there is no snapshot or it's version, key or
+    generation doesn't match. The file is memory-mapped and decoded from the mapping, see decode.
+    '''
+    def load(self, key):
+        if not os.path.isfile(self.filename):
+            return(None)
+
+        try:
+            with open(self.filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+                    snapshot = json.loads(m[:], object_hook = scope_snapshot.decode)
+
+        except Exception as ex:
+            self.l.warning(str.format(
+                "ignoring unreadable snapshot {}: {}",
+                self.filename,
+                ex ) )
+
+            return(None)
+
+        generation = self.get_generation()
+
+        if ( snapshot.get('version') != scope_snapshot.version
+             or snapshot.get('key') != key
+             or snapshot.get('generation') != generation ):
+
+            self.l.info(str.format(
+                "ignoring snapshot {} of another schema, storage or generation (version: {}, generation: {}, current generation: {})",
+                self.filename,
+                snapshot.get('version'),
+                snapshot.get('generation'),
+                generation ) )
+
+            return(None)
+
+        with self.guard:
+            self.known = generation
+
+        return(snapshot.get('state') )
+
+    '''
+    Stores a state in the snapshot, for the storage generation it was built at (read before the state
+    was built, so that records written meanwhile make the snapshot stale.) The snapshot is written to a
+    temporary file and renamed into place.
+    '''
+    def save(self, key, generation, state):
+        os.makedirs(self.directory, exist_ok = True)
+
+        fd, temporary = tempfile.mkstemp(dir = self.directory)
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(
+                    scope_snapshot.encode( {
+                        'version':    scope_snapshot.version,
+                        'key':        key,
+                        'generation': generation,
+                        'state':      state } ),
+                    f )
+
+            os.chmod(temporary, 0o644)
+
+            os.replace(temporary, self.filename)
+
+        except Exception:
+            os.path.exists(temporary) and os.remove(temporary)
+
+            raise
+
+        with self.guard:
+            self.known = generation
+
+        self.l.debug(str.format(
+            "saved snapshot {} at generation {}",
+            self.filename,
+            generation ) )
+
+        return(self)
@@ -0,0 +1,129 @@
+import abc, time
+
+'''
+Storage backend interface used by the scope class to persist scope records. A scope record is
+identified by the scope's TCP/IP version, prefixlen and network address (as a big number.)
+
+Every write increments a record's version, updates and deletes given the version the record was read
+at are compare-and-swap: they raise version_conflict if another process wrote the record meanwhile.
+
+Implementations:
+
+tinydb_scope_storage: one TinyDB table per scope, in either a shared database or one file per scope
+sqlite_scope_storage: a single indexed SQLite database for all scopes
+lease_table_storage: the single address scopes of a pool, in the pool's lease table
+
+Backends implement get, insert, update, delete and scan, a backend missing one of them can't be
+instantiated.
+
+'''
+class scope_storage(abc.ABC):
+    '''
+    Gets the key identifying the specified scope's record
+    '''
+    @staticmethod
+    def get_key(s):
+        return( (
+            s.net_obj_ver,
+            s.get_prefix(),
+            s.network_address_to_big_number() ) )
+
+    '''
+    Gets the version of a record, records written before versions were introduced are at version 0
+    '''
+    @staticmethod
+    def get_version(record):
+        return( record != None
+                and record.get('version')
+                or 0 )
+
+    '''
+    Gets the version of a newly inserted record: the current time in nanoseconds rather than 1, so that a
+    record that is deleted and inserted again never repeats a version another process may have read
+    '''
+    @staticmethod
+    def get_initial_version():
+        return(time.time_ns() )
+
+    '''
+    Raises version_conflict if the stored record of a scope is missing or not at the expected version, an
+    expected version of None is not checked
+    '''
+    @staticmethod
+    def check_version(s, record, version):
+        if version != None and ( record == None or scope_storage.get_version(record) != version ):
+            raise version_conflict(str.format(
+                "scope {} was changed by another process (expected version: {}, stored version: {})",
+                s.get_network_object(),
+                version,
+                record != None and scope_storage.get_version(record) or None ) )
+
+    '''
+    Gets the record for the specified scope, or None if the scope is not allocated
+    '''
+    @abc.abstractmethod
+    def get(self, s):
+        pass
+
+    '''
+    Stores a new record for the specified scope, raises version_conflict if the scope already has a record
+    '''
+    @abc.abstractmethod
+    def insert(self, s, record):
+        pass
+
+    '''
+    Updates fields of the specified scope's existing record and increments it's version, if version is
+    specified the stored record must be at that version (see check_version)
+    '''
+    @abc.abstractmethod
+    def update(self, s, fields, version = None):
+        pass
+
+    '''
+    Deletes the specified scope's record, if version is specified the stored record must be at that version
+    '''
+    @abc.abstractmethod
+    def delete(self, s, version = None):
+        pass
+
+    '''
+    Enumerates records of allocated scopes of the specified prefixlen within the network of the
+    specified scope, in network address order. If owned is True or False only owned or un-owned
+    records are enumerated.
+    '''
+    @abc.abstractmethod
+    def scan(self, s, prefix, owned = None):
+        pass
+
+    '''
+    Starts a transaction grouping the following writes, backends without transactions ignore this
+    '''
+    def begin(self):
+        pass
+
+    '''
+    Commits the transaction started by begin
+    '''
+    def commit(self):
+        pass
+
+    '''
+    Discards the transaction started by begin
+    '''
+    def rollback(self):
+        pass
+
+    '''
+    Releases any resources held by this storage backend
+    '''
+    def close(self):
+        pass
+
+
+'''
+Raised by a storage backend when a record was written by another process since it was read, see
+scope_storage.check_version
+'''
+class version_conflict(Exception):
+    pass
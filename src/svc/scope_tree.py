@@ -0,0 +1,87 @@
+import threading
+from .scope_storage import scope_storage
+
+'''
+Canonical in-memory tree of the scopes defined in the schema and the allocated scopes (pools) carved from
+them. Each scope is interned by it's key (see scope_storage.get_key), so that the same scope is
+represented by a single object in a process and it's parent_scope pointer is the parent scope's node:
+ancestry walks, tag inheritance and lock down resolution follow pointers rather than rebuilding parent
+scopes from storage. Single address scopes are not kept in the tree, they are resolved by key in their
+pool's storage or lease table.
+
+Simple usage:
+
+from svc.scope_tree import scope_tree
+
+t = scope_tree()
+
+s = t.add(s)
+
+t.get_children(s)
+
+'''
+class scope_tree():
+    '''
+    Creates a new empty tree
+    '''
+    def __init__(self):
+        self.nodes    = {}
+        self.children = {}
+        self.guard    = threading.Lock()
+
+    '''
+    Gets the node of the scope with the specified key, or None
+    '''
+    def get(self, key):
+        return(self.nodes.get(key) )
+
+    '''
+    Adds a scope to the tree unless a node with the same key exists, returns the node
+    '''
+    def add(self, s):
+        key = scope_storage.get_key(s)
+
+        with self.guard:
+            if key not in self.nodes:
+                self.nodes[ key ] = s
+
+                if s.parent_scope != None:
+                    self.children.setdefault(
+                        scope_storage.get_key(s.parent_scope),
+                        set() ).add(key)
+
+            return(self.nodes.get(key) )
+
+    '''
+    Removes a scope's node from the tree, ex: once it's record has been deleted
+    '''
+    def discard(self, s):
+        key = scope_storage.get_key(s)
+
+        with self.guard:
+            node = self.nodes.pop(key, None)
+
+            if node != None and node.parent_scope != None:
+                self.children.get(
+                    scope_storage.get_key(node.parent_scope),
+                    set() ).discard(key)
+
+        return(self)
+
+    '''
+    Gets the nodes of a scope's children in the tree
+    '''
+    def get_children(self, s):
+        with self.guard:
+            return( [ self.nodes.get(index) for index in sorted(
+                self.children.get(scope_storage.get_key(s), set() ) ) ] )
+
+    '''
+    Removes every node from the tree
+    '''
+    def clear(self):
+        with self.guard:
+            self.nodes.clear()
+            self.children.clear()
+
+        return(self)
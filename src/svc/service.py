@@ -1,6 +1,11 @@
-import json, logging, traceback, sys, datetime, itertools
+import json, logging, traceback, sys, datetime, itertools, os
 from .scope import scope
 from .scope_factory import scope_factory
+from .scope_collector import scope_collector
+from .unit_of_work import unit_of_work
+from .sqlite_scope_storage import sqlite_scope_storage
+from .tinydb_transaction_isolated_storage import write_ahead_log_storage
+from .handle_pool import handle_pool
 from ipaddress import IPv6Network as n6, IPv4Network as n4
 
 """
@@ -14,17 +19,60 @@ class service():
         self.h = [
              ( "Content-Type", "application/vnd.docker.plugins.v1.2+json" ) ]
 
-        self.f = scope_factory()
+        scope.handles = handle_pool(int(
+            os.environ.get('PYIPAM_MAX_OPEN_HANDLES') != None
+            and os.environ.get('PYIPAM_MAX_OPEN_HANDLES')
+            or 1024 ) )
+
+        self.tries = int(
+            os.environ.get('PYIPAM_CLAIM_TRIES') != None
+            and os.environ.get('PYIPAM_CLAIM_TRIES')
+            or 16 )
+
+        scope.locks.timeout = float(
+            os.environ.get('PYIPAM_LOCK_TIMEOUT') != None
+            and os.environ.get('PYIPAM_LOCK_TIMEOUT')
+            or 5.0 )
+
+        if os.environ.get('PYIPAM_STORAGE') == 'tinydb-wal':
+            scope.instance_storage = write_ahead_log_storage
+
+        self.f = scope_factory(
+            db = ( os.environ.get('PYIPAM_STORAGE') == 'sqlite'
+                   and sqlite_scope_storage()
+                   or None ) )
+
         self.f.initialize()
 
+        self.c = scope_collector(
+            self.f.scopes,
+            interval     = float(
+                os.environ.get('PYIPAM_GC_INTERVAL') != None
+                and os.environ.get('PYIPAM_GC_INTERVAL')
+                or 1.0 ),
+            batch        = int(
+                os.environ.get('PYIPAM_GC_BATCH') != None
+                and os.environ.get('PYIPAM_GC_BATCH')
+                or 16 ),
+            grace_period = int(
+                os.environ.get('PYIPAM_GC_GRACE_PERIOD') != None
+                and os.environ.get('PYIPAM_GC_GRACE_PERIOD')
+                or 24 * 60 * 60 ) )
+
+        ( os.environ.get('PYIPAM_GC') != 'off'
+          and self.c.start() )
+
+        ( os.environ.get('PYIPAM_SCHEMA_RELOAD') != 'off'
+          and self.f.watch(
+              interval = float(
+                  os.environ.get('PYIPAM_SCHEMA_RELOAD_INTERVAL') != None
+                  and os.environ.get('PYIPAM_SCHEMA_RELOAD_INTERVAL')
+                  or 1.0 ) ) )
+
     '''
     Retrieves default HTTP response headers list of tuples (header/value pairs)
     '''
     def get_standard_headers(self):
-        self.l.debug((
-            request,
-            request.data ) )
-
         return(self.h)
 
     '''
@@ -119,6 +167,8 @@ class service():
             return(response)
 
     '''
+    Claims a free pool, the pool is claimed without locking it (see scope.claim) and another free pool is
+    tried when another worker claimed the same one meanwhile, see unit_of_work.retry
     '''
     def request_pool(self, request):
         self.l.debug((
@@ -130,98 +180,85 @@ class service():
         response  = None
         candidate = None
 
-        try:
-            data = json.loads(request.data)
-
-            docker_requested_pool = data.get('Pool')
+        with self.f.reading():
+            try:
+                data = json.loads(request.data)
 
-            docker_requested_sub_pool = data.get('SubPool')
+                docker_requested_pool = data.get('Pool')
 
-            id = data.get(
-                    'Options'
-                ).get('id')
-
-            id = (id != None
-                  and id
-                  or "not specified" )
-
-            scope_filter_tags = ( data.get(
-                'Options'
-            ).get(
-                'scope_filter_tags'
-            ) != None
-                     and data.get(
-                         'Options'
-                     ).get(
-                         'scope_filter_tags'
-                     ).split(
-                         ',')
-                     or ['_default_'] )
-
-            parent, child = self.f.get_allocated_network_scope(
-                filter_tags              = scope_filter_tags,
-                net_obj_or_id_and_prefix = (
-                    docker_requested_sub_pool != None
-                    and docker_requested_sub_pool
-                    or None ),
-                parent_net_or_net_obj    = (
-                    docker_requested_pool != None
-                    and docker_requested_pool
-                    or None ) )
-
-            candidate = ( child
-             or parent
-            ).unlock_scope(
-            ).get_unassigned_scope()
-
-            ( candidate.is_allocated()
-              and candidate.unlock_scope(
-             ).set_owner(
-                 id
-             ).lock_scope()
-              or candidate.initialize_allocation(
-             ).set_owner(
-                 id
-             ).lock_scope() )
-
-            response = (
-                200,
-                json.dumps({
-                    "PoolID": candidate.get_scope_id() ,
-                    "Pool": candidate.get_network_object().compressed,
-                    "Data": { } } ),
-                self.h )
-
-            return(response)
-
-        except Exception as ex:
-            self.l.error(ex, exc_info = True)
-
-            response = (
-                500,
-                json.dumps({
-                    "Err": (
-                        hasattr('ex', 'message')
-                        and ex.message
-                        or "see error log for details" ) } ),
-                self.h )
+                docker_requested_sub_pool = data.get('SubPool')
 
-        finally:
-            ( child != None
-             and ( not child.is_locked()
-                   and child.lock_scope() ) )
+                id = data.get(
+                        'Options'
+                    ).get('id')
 
-            ( parent != None
-             and ( not parent.is_locked()
-                   and parent.lock_scope() ) )
+                id = (id != None
+                      and id
+                      or "not specified" )
 
-            ( candidate != None
-              and ( not candidate.is_locked()
-                    and candidate.lock_scope() ) )
+                prefix_length = data.get(
+                    'Options'
+                ).get('prefix_length')
 
-            return(response)
+                scope_filter_tags = ( data.get(
+                    'Options'
+                ).get(
+                    'scope_filter_tags'
+                ) != None
+                         and data.get(
+                             'Options'
+                         ).get(
+                             'scope_filter_tags'
+                         ).split(
+                             ',')
+                         or ['_default_'] )
+
+                parent, child = self.f.get_allocated_network_scope(
+                    filter_tags              = scope_filter_tags,
+                    net_obj_or_id_and_prefix = (
+                        docker_requested_sub_pool != None
+                        and docker_requested_sub_pool
+                        or None ),
+                    parent_net_or_net_obj    = (
+                        docker_requested_pool != None
+                        and docker_requested_pool
+                        or None ) )
+
+                candidate = unit_of_work.retry(
+                    lambda: parent.get_unassigned_scope(
+                        prefix = ( prefix_length != None
+                                   and int(prefix_length)
+                                   or None )
+                    ).claim(id),
+                    tries = self.tries )
+
+                response = (
+                    200,
+                    json.dumps({
+                        "PoolID": candidate.get_scope_id() ,
+                        "Pool": candidate.get_network_object().compressed,
+                        "Data": { } } ),
+                    self.h )
+
+                return(response)
+
+            except Exception as ex:
+                self.l.error(ex, exc_info = True)
+
+                response = (
+                    500,
+                    json.dumps({
+                        "Err": (
+                            hasattr('ex', 'message')
+                            and ex.message
+                            or "see error log for details" ) } ),
+                    self.h )
+
+            finally:
+                return(response)
 
     '''
+    Releases a pool, the response is built once the release is committed
     '''
     def release_pool(self, request):
         self.l.debug((
@@ -232,49 +269,41 @@ class service():
         child    = None
         response = None
 
-        try:
-            data = json.loads(request.data)
+        with self.f.reading():
+            try:
+                data = json.loads(request.data)
 
-            pool_net = data.get('PoolID')
+                pool_net = data.get('PoolID')
 
-            parent, child = self.f.get_allocated_network_scope(
-                net_obj_or_id_and_prefix = pool_net )
+                parent, child = self.f.get_pool_scope(pool_net)
 
-            ( child
-              or parent
-            ).unlock_scope(
-            ).clear_ownership(
-            ).lock_scope()
+                unit_of_work.retry(
+                    child.release,
+                    tries = self.tries )
 
-            response = (
-                200,
-                json.dumps( { } ),
-                self.h )
+                response = (
+                    200,
+                    json.dumps( { } ),
+                    self.h )
 
-        except Exception as ex:
-            self.l.error(ex, exc_info = True)
+            except Exception as ex:
+                self.l.error(ex, exc_info = True)
 
-            response = (
-                500,
-                json.dumps({
-                "Err": (
-                    hasattr('ex', 'message')
-                    and ex.message
-                    or "see error log for details" ) } ),
-                self.h )
-
-        finally:
-            ( child != None
-             and ( not child.is_locked()
-                   and child.lock_scope() ) )
-
-            ( parent != None
-             and ( not parent.is_locked()
-                   and parent.lock_scope() ) )
+                response = (
+                    500,
+                    json.dumps({
+                    "Err": (
+                        hasattr('ex', 'message')
+                        and ex.message
+                        or "see error log for details" ) } ),
+                    self.h )
 
-            return(response)
+            finally:
+                return(response)
 
     '''
+    Leases a free address of a pool, the address is claimed without locking it (see scope.claim) and another
+    free address is tried when another worker claimed the same one meanwhile, see unit_of_work.retry
     '''
     def request_address(self, request):
         self.l.debug((
@@ -286,146 +315,187 @@ class service():
         child        = None
         response     = None
 
-        try:
-            data = json.loads(request.data)
-
-            pool_net = data.get('PoolID')
-
-            options = data.get('Options')
-
-            owner = (
-                options != None
-                and ( options.get(
-                    'RequestAddressType' ) != None
-                     and options.get(
-                         'RequestAddressType' )
-                     or 'not specified' )
-            or 'not specified' )
+        with self.f.reading():
+            try:
+                data = json.loads(request.data)
+
+                pool_net = data.get('PoolID')
+
+                options = data.get('Options')
+
+                owner = (
+                    options != None
+                    and ( options.get(
+                        'RequestAddressType' ) != None
+                         and options.get(
+                             'RequestAddressType' )
+                         or 'not specified' )
+                or 'not specified' )
+
+                parent, child = self.f.get_pool_scope(pool_net)
+
+                network_addr = unit_of_work.retry(
+                    lambda: child.lease_network_address(
+                        gateway     = owner == 'com.docker.network.gateway',
+                        mac_address = (
+                            options != None
+                            and options.get('com.docker.network.endpoint.macaddress')
+                            or None ),
+                        token       = (
+                            options != None
+                            and options.get('reservation_token')
+                            or None )
+                    ).claim(owner),
+                    tries = self.tries )
+
+                response = (
+                    200,
+                    json.dumps({
+                        "Address": str.format(
+                            "{}/{}",
+                            network_addr.get_network_object().network_address,
+                            network_addr.parent_scope.get_prefix() ),
+                        "Data": {} } ),
+                    self.h )
+
+            except Exception as ex:
+                self.l.error(
+                    ex,
+                    exc_info = True )
+
+                response = (
+                    500,
+                    json.dumps({
+                        "Err": (
+                            hasattr('ex', 'message')
+                            and ex.message
+                            or "see error log for details" ) } ),
+                    self.h )
+
+            finally:
+                return(response)
 
-            parent, child = self.f.get_allocated_network_scope(
-                parent_net_or_net_obj = pool_net )
-
-            network_addr = ( child
-                            or parent
-            ).unlock_scope(
-            ).lease_network_address()
-
-            ( child
-            or parent
-            ).lock_scope()
-
-            network_addr = (
-                not network_addr.is_allocated()
-                and network_addr.initialize_allocation()
-                or network_addr.unlock_scope()
-            ).set_owner(
-                owner
-            ).lock_scope()
-
-            response = (
-                200,
-                json.dumps({
-                    "Address": str.format(
-                        "{}/{}",
-                        network_addr.get_network_object().network_address,
-                        network_addr.parent_scope.get_prefix() ),
-                    "Data": {} } ),
-                self.h )
-
-        except Exception as ex:
-            self.l.error(
-                ex,
-                exc_info = True )
-
-            response = (
-                500,
-                json.dumps({
-                    "Err": (
-                        hasattr('ex', 'message')
-                        and ex.message
-                        or "see error log for details" ) } ),
-                self.h )
-
-        finally:
-            ( child != None
-             and ( not child.is_locked()
-                   and child.lock_scope() ) )
-
-            ( parent != None
-             and ( not parent.is_locked()
-                   and parent.lock_scope() ) )
+    '''
+    Reserves a number of addresses of a pool for the RequestAddress calls on that pool that pass the returned
+    Token as their reservation_token option, and returns them together, ex: before an orchestrator starts the
+    replicas of a service. Not part of the Docker plugin protocol, the request holds the PoolID, the Count of
+    addresses and optionally the TTL (seconds, 300 by default) of the reservation. A missing or non-positive
+    Count or a negative TTL is refused with a 400 response. The response is built once the reservation is
+    committed.
+    '''
+    def reserve_addresses(self, request):
+        self.l.debug((
+            request,
+            request.data ) )
 
-            ( network_addr != None
-              and ( not network_addr.is_locked()
-                    and network_addr.lock_scope() ) )
+        parent   = None
+        child    = None
+        response = None
 
-            return(response)
+        with self.f.reading():
+            try:
+                data = json.loads(request.data)
+
+                pool_net = data.get('PoolID')
+
+                count    = int(data.get('Count') or 0)
+                ttl      = data.get('TTL') == None and 300 or int(data.get('TTL') )
+
+                if count <= 0 or ttl < 0:
+                    response = (
+                        400,
+                        json.dumps({
+                            "Err": (
+                                count <= 0
+                                and "Count must be a positive number of addresses"
+                                or "TTL must be a number of seconds that isn't negative" ) } ),
+                        self.h )
+
+                    return(response)
+
+                parent, child = self.f.get_pool_scope(pool_net)
+
+                token, addresses = unit_of_work.retry(
+                    lambda: child.reserve_network_addresses(
+                        count,
+                        ttl = ttl ),
+                    tries = self.tries )
+
+                response = (
+                    200,
+                    json.dumps({
+                        "Addresses": [ str.format(
+                            "{}/{}",
+                            index.get_network_object().network_address,
+                            index.parent_scope.get_prefix() ) for index in addresses ],
+                        "Token": token,
+                        "Data": {} } ),
+                    self.h )
+
+            except Exception as ex:
+                self.l.error(
+                    ex,
+                    exc_info = True )
+
+                response = (
+                    500,
+                    json.dumps({
+                        "Err": (
+                            hasattr('ex', 'message')
+                            and ex.message
+                            or "see error log for details" ) } ),
+                    self.h )
+
+            finally:
+                return(response)
 
     '''
+    Releases an address of a pool if it's leased, the response is built once the release is committed
     '''
     def release_address(self, request):
         self.l.debug((
             request,
             request.data ) )
 
-        parent    = None
-        child     = None
-        response  = None
-        candidate = None
-
-        try:
-            data = json.loads(request.data)
-
-            pool_net  = data.get('PoolID')
-
-            options = data.get('Options')
-
-            address = str.format(
-                "{}/32",
-                data.get('Address') )
+        parent   = None
+        child    = None
+        response = None
 
-            parent, child = self.f.get_allocated_network_scope(
-                parent_net_or_net_obj       = pool_net )
+        with self.f.reading():
+            try:
+                data = json.loads(request.data)
 
-            candidate = ( child
-                          or parent
-            ).get_network_address(address)
+                pool_net  = data.get('PoolID')
 
-            ( cadidate.is_owned()
-             and candidate.unlock_scope(
-             ).clear_ownership(
-             ).lock_scope() )
+                options = data.get('Options')
 
-            response = (
-                200,
-                json.dumps({ }),
-                self.h )
+                address = data.get('Address')
 
-        except Exception as ex:
-            self.l.error(
-                ex,
-                exc_info = True )
+                parent, child = self.f.get_pool_scope(pool_net)
 
-            response = (
-                500,
-                json.dumps({
-                    "Err": (
-                        hasattr('ex', 'message')
-                        and ex.message
-                        or "see error log for details" ) } ),
-                self.h )
+                unit_of_work.retry(
+                    lambda: [ index.release() for index in [ child.get_network_address(address) ]
+                              if index.is_owned() ],
+                    tries = self.tries )
 
-        finally:
-            ( child != None
-             and ( not child.is_locked()
-                   and child.lock_scope() ) )
+                response = (
+                    200,
+                    json.dumps({ }),
+                    self.h )
 
-            ( parent != None
-             and ( not parent.is_locked()
-                   and parent.lock_scope() ) )
+            except Exception as ex:
+                self.l.error(
+                    ex,
+                    exc_info = True )
 
-            ( candidate != None
-              and ( not candidate.is_locked()
-                    and candidate.lock_scope() ) )
+                response = (
+                    500,
+                    json.dumps({
+                        "Err": (
+                            hasattr('ex', 'message')
+                            and ex.message
+                            or "see error log for details" ) } ),
+                    self.h )
 
-            return(response)
+            finally:
+                return(response)
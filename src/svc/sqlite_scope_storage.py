@@ -0,0 +1,229 @@
+import json, os, sqlite3, threading
+from .scope_storage import scope_storage, version_conflict
+
+'''
+SQLite storage backend, every scope record is kept in a single WAL mode database indexed by
+(tcp_ip_version, prefix, network). Network addresses are stored as 16 byte big endian blobs so
+that IPv4 and IPv6 networks sort numerically and a range of child scopes is a single index scan.
+
+Simple usage:
+
+from svc.sqlite_scope_storage import sqlite_scope_storage
+from svc.scope_factory import scope_factory as sf
+
+f = sf(db = sqlite_scope_storage('/data/scopes.sqlite3') )
+
+'''
+class sqlite_scope_storage(scope_storage):
+    '''
+    Creates a new instance of the SQLite storage backend
+
+    Parameters:
+
+    filename (str): path to the SQLite database file, defaults to /data/scopes.sqlite3
+    timeout (float): seconds to wait for another process' write transaction to finish
+
+    '''
+    def __init__(
+            self,
+            filename = '/data/scopes.sqlite3',
+            timeout  = 30.0 ):
+
+        self.filename = filename
+        self.timeout  = timeout
+        self.local    = threading.local()
+
+        self.get_connection().executescript('''
+            CREATE TABLE IF NOT EXISTS scopes (
+                tcp_ip_version INTEGER NOT NULL,
+                prefix         INTEGER NOT NULL,
+                network        BLOB    NOT NULL,
+                owner          TEXT,
+                record         TEXT    NOT NULL,
+                PRIMARY KEY ( tcp_ip_version, prefix, network ) ) WITHOUT ROWID;
+        ''')
+
+    '''
+    Gets a connection for the current thread, connections are not shared between threads nor
+    inherited by forked (ex: uWSGI worker) processes
+    '''
+    def get_connection(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = sqlite3.connect(
+                self.filename,
+                timeout         = self.timeout,
+                isolation_level = None )
+
+            self.local.connection.execute('PRAGMA journal_mode = WAL')
+            self.local.connection.execute('PRAGMA synchronous = NORMAL')
+
+            self.local.pid   = os.getpid()
+            self.local.depth = 0
+
+        return(self.local.connection)
+
+    '''
+    Converts a scope key into SQL parameters
+    '''
+    @staticmethod
+    def get_parameters(s):
+        tcp_ip_ver, prefix, network = scope_storage.get_key(s)
+
+        return( (
+            tcp_ip_ver,
+            prefix,
+            network.to_bytes(16, 'big') ) )
+
+    '''
+    '''
+    def get(self, s):
+        row = self.get_connection().execute(
+            '''
+            SELECT record FROM scopes
+            WHERE tcp_ip_version = ? AND prefix = ? AND network = ?
+            ''',
+            self.get_parameters(s) ).fetchone()
+
+        return( row != None
+                and json.loads(row[ 0 ])
+                or None )
+
+    '''
+    '''
+    def insert(self, s, record):
+        try:
+            self.get_connection().execute(
+                '''
+                INSERT INTO scopes ( tcp_ip_version, prefix, network, owner, record )
+                VALUES ( ?, ?, ?, ?, ? )
+                ''',
+                self.get_parameters(s) + (
+                    record.get('owner'),
+                    json.dumps(dict(
+                        record,
+                        version = scope_storage.get_initial_version() ) ) ) )
+
+        except sqlite3.IntegrityError:
+            raise version_conflict(str.format(
+                "scope {} was allocated by another process",
+                s.get_network_object() ) )
+
+    '''
+    The record is read, compared and re-written inside of a single write transaction
+    '''
+    def update(self, s, fields, version = None):
+        self.begin()
+
+        try:
+            record = self.get(s)
+
+            if record == None and version == None:
+                raise Exception("scope is not allocated, can't update record")
+
+            scope_storage.check_version(s, record, version)
+
+            record.update(fields)
+
+            record[ 'version' ] = scope_storage.get_version(record) + 1
+
+            self.get_connection().execute(
+                '''
+                UPDATE scopes SET owner = ?, record = ?
+                WHERE tcp_ip_version = ? AND prefix = ? AND network = ?
+                ''',
+                ( record.get('owner'),
+                  json.dumps(record) ) + self.get_parameters(s) )
+
+            self.commit()
+
+        except Exception:
+            self.rollback()
+
+            raise
+
+    '''
+    Starts a write transaction, transactions started while one is already open on this thread are
+    part of the open transaction
+    '''
+    def begin(self):
+        connection = self.get_connection()
+
+        if self.local.depth == 0:
+            connection.execute('BEGIN IMMEDIATE')
+
+        self.local.depth += 1
+
+    '''
+    '''
+    def commit(self):
+        self.local.depth -= 1
+
+        if self.local.depth == 0:
+            self.local.connection.execute('COMMIT')
+
+    '''
+    '''
+    def rollback(self):
+        self.local.depth -= 1
+
+        if self.local.depth == 0:
+            self.local.connection.execute('ROLLBACK')
+
+    '''
+    '''
+    def delete(self, s, version = None):
+        self.begin()
+
+        try:
+            if version != None:
+                scope_storage.check_version(s, self.get(s), version)
+
+            self.get_connection().execute(
+                '''
+                DELETE FROM scopes
+                WHERE tcp_ip_version = ? AND prefix = ? AND network = ?
+                ''',
+                self.get_parameters(s) )
+
+            self.commit()
+
+        except Exception:
+            self.rollback()
+
+            raise
+
+    '''
+    Rows are fetched before the first record is yielded so that no read statement is left open while
+    the caller updates records
+    '''
+    def scan(self, s, prefix, owned = None):
+        first = s.network_address_to_big_number()
+        last  = s.network.get_broadcast()
+
+        rows = self.get_connection().execute(
+            str.format(
+                '''
+                SELECT record FROM scopes
+                WHERE tcp_ip_version = ? AND prefix = ? AND network BETWEEN ? AND ? {}
+                ORDER BY network
+                ''',
+                ( owned == True
+                  and 'AND owner IS NOT NULL'
+                  or ( owned == False
+                       and 'AND owner IS NULL'
+                       or '' ) ) ),
+            ( s.net_obj_ver,
+              prefix,
+              first.to_bytes(16, 'big'),
+              last.to_bytes(16, 'big') ) ).fetchall()
+
+        for row in rows:
+            yield(json.loads(row[ 0 ]) )
+
+    '''
+    '''
+    def close(self):
+        if getattr(self.local, 'pid', None) == os.getpid():
+            self.local.connection.close()
+
+            self.local.pid = None
@@ -0,0 +1,167 @@
+import threading
+
+'''
+Inverted index of the effective tags of scopes: the tags of a scope plus, when the scope inherits tags, the
+effective tags of it's parent scope. Each tag maps to the set of keys (see scope_storage.get_key) of the
+scopes it applies to, so that scopes are selected by tag with set lookups rather than by walking up the
+parent scopes of every scope. Inheritance is resolved once when a scope is added, and again for the
+scope and it's descendants when it's tags change.
+
+Simple usage:
+
+from svc.tag_index import tag_index
+
+i = tag_index()
+
+i.add((4, 15, 1681915904), None, [ 'netwerk' ], True)
+
+i.add((4, 20, 1681915904), (4, 15, 1681915904), [ 'default' ], True)
+
+i.get_scopes([ 'netwerk' ])
+
+'''
+class tag_index():
+    '''
+    Creates a new empty tag index
+    '''
+    def __init__(self):
+        self.scopes    = {}
+        self.tags      = {}
+        self.effective = {}
+        self.parents   = {}
+        self.children  = {}
+        self.inherits  = {}
+        self.guard     = threading.Lock()
+
+    '''
+    Gets the state of the index to store (ex: in a scope snapshot), without the guard
+    '''
+    def __getstate__(self):
+        return( { key: value for key, value in self.__dict__.items() if key != 'guard' } )
+
+    '''
+    Restores the state of a stored index, with a new guard
+    '''
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        self.guard = threading.Lock()
+
+    '''
+    Indicates whether the scope with the specified key is indexed
+    '''
+    def contains(self, key):
+        return(key in self.effective)
+
+    '''
+    Adds a scope to the index, it's parent scope (if any) must have been added first. A scope that is
+    already indexed is moved to the specified parent scope along with it's descendants.
+    '''
+    def add(self, key, parent, tags, inherit):
+        with self.guard:
+            previous = self.parents.get(key)
+
+            if previous != parent and key in self.children.get(previous, []):
+                self.children.get(previous).remove(key)
+
+            self.tags[ key ]     = set(tags)
+            self.parents[ key ]  = parent
+            self.inherits[ key ] = inherit
+
+            self.children.setdefault(key, [])
+
+            if parent in self.children and key not in self.children[ parent ]:
+                self.children[ parent ].append(key)
+
+            self.resolve(key)
+
+        return(self)
+
+    '''
+    Replaces the tags of an indexed scope, the effective tags of it's descendants are resolved again
+    '''
+    def update(self, key, tags):
+        with self.guard:
+            if key not in self.effective:
+                return(self)
+
+            self.tags[ key ] = set(tags)
+
+            self.resolve(key)
+
+        return(self)
+
+    '''
+    Removes a scope from the index, the scopes nested in it must be removed or added again (see add)
+    '''
+    def remove(self, key):
+        with self.guard:
+            for tag in self.effective.pop(key, set() ):
+                self.scopes.get(tag).discard(key)
+
+            parent = self.parents.pop(key, None)
+
+            if key in self.children.get(parent, []):
+                self.children.get(parent).remove(key)
+
+            [ index.pop(key, None) for index in [
+                self.tags,
+                self.children,
+                self.inherits ] ]
+
+        return(self)
+
+    '''
+    Removes every scope from the index
+    '''
+    def clear(self):
+        with self.guard:
+            [ index.clear() for index in [
+                self.scopes,
+                self.tags,
+                self.effective,
+                self.parents,
+                self.children,
+                self.inherits ] ]
+
+        return(self)
+
+    '''
+    Resolves the effective tags of a scope and it's descendants and updates the tag sets, called while holding
+    the guard
+    '''
+    def resolve(self, key):
+        pending = [ key ]
+
+        while len(pending) > 0:
+            index  = pending.pop()
+            parent = self.parents.get(index)
+
+            effective = set(self.tags.get(index) )
+
+            if parent in self.effective and self.inherits.get(index):
+                effective |= self.effective.get(parent)
+
+            for tag in self.effective.get(index, set() ) - effective:
+                self.scopes.get(tag).discard(index)
+
+            for tag in effective:
+                self.scopes.setdefault(tag, set() ).add(index)
+
+            self.effective[ index ] = effective
+
+            pending.extend(self.children.get(index, []) )
+
+    '''
+    Gets the keys of the scopes any of the specified tags apply to
+    '''
+    def get_scopes(self, tags):
+        with self.guard:
+            return(set().union(*[ self.scopes.get(tag, set() ) for tag in tags ]) )
+
+    '''
+    Indicates whether any of the specified tags apply to the scope with the specified key
+    '''
+    def is_tagged(self, key, tags):
+        with self.guard:
+            return(any(tag in self.effective.get(key, set() ) for tag in tags) )
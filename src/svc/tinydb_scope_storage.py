@@ -0,0 +1,294 @@
+import os, threading
+from ipaddress import ip_network
+from tinydb import Query
+from .scope_storage import scope_storage, version_conflict
+from .tinydb_transaction_isolated_storage import transaction_isolated_storage
+
+'''
+TinyDB storage backend, each scope's record is kept in it's own table of the scope's db instance, which
+is either a database shared by every scope or a file unique to the scope (see scope.get_instance_db).
+Since files are not locked between a read and the group commit of a write, a record is locked in the
+scope lock manager (see scope.acquire_lock) from it's version check until the batch it's written in is
+committed.
+'''
+class tinydb_scope_storage(scope_storage):
+    '''
+    Creates a new instance of the TinyDB storage backend
+    '''
+    def __init__(self):
+        self.local = threading.local()
+
+    '''
+    '''
+    def get(self, s):
+        return(s.get_db_table(
+        ).get(Query(
+        ).scope != None ) )
+
+    '''
+    Locks a scope's record until the open batch is committed or discarded, see end
+    '''
+    def latch(self, s):
+        key = scope_storage.get_key(s)
+
+        type(s).locks.acquire(key, type(s).locks.X)
+
+        self.local.latched.append( ( type(s).locks, key ) )
+
+    '''
+    '''
+    def insert(self, s, record):
+        self.begin()
+
+        try:
+            self.latch(s)
+
+            if self.get(s) != None:
+                raise version_conflict(str.format(
+                    "scope {} was allocated by another process",
+                    s.get_network_object() ) )
+
+            s.get_db_table().insert(dict(
+                record,
+                version = scope_storage.get_initial_version() ) )
+
+        except Exception:
+            self.rollback()
+
+            raise
+
+        self.commit()
+
+    '''
+    '''
+    def update(self, s, fields, version = None):
+        self.begin()
+
+        try:
+            self.latch(s)
+
+            record = self.get(s)
+
+            scope_storage.check_version(s, record, version)
+
+            s.get_db_table().update(dict(
+                fields,
+                version = scope_storage.get_version(record) + 1 ) )
+
+        except Exception:
+            self.rollback()
+
+            raise
+
+        self.commit()
+
+    '''
+    Scopes using their own file have the file removed rather than their table dropped, a dropped table
+    would otherwise be written back by the open group commit batch
+    '''
+    def delete(self, s, version = None):
+        self.begin()
+
+        try:
+            self.latch(s)
+
+            if version != None:
+                scope_storage.check_version(s, self.get(s), version)
+
+            self.remove(s)
+
+        except Exception:
+            self.rollback()
+
+            raise
+
+        self.commit()
+
+    '''
+    Removes a scope's table or file, see delete
+    '''
+    def remove(self, s):
+        if s.use_own_db() != True:
+            s.db.drop_table(s.get_db_table_name() )
+
+        else:
+            transaction_isolated_storage.committer.discard(s.get_instance_file('json') )
+
+            type(s).handles.discard(s.get_instance_file('json') )
+
+            for filename in [
+                    s.get_instance_file('json'),
+                    s.get_instance_file('json.wal') ]:
+
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    '''
+    Moves the tables of child scopes found in another scope's own file (written by versions that stored
+    child scopes in their parent's file) to the child scope's own file, see data_layout.get_path
+    '''
+    @staticmethod
+    def move_nested_tables(layout, storage):
+        moved = 0
+
+        for directory, name in list(layout.get_files() ):
+            match = layout.shard_file.match(name)
+
+            if match.group(3) != 'json' or match.group(4) != None:
+                continue
+
+            source = storage(os.path.join(directory, name) )
+            data   = source.read() or {}
+            tables = len(data)
+
+            for table in list(data):
+                try:
+                    net = ip_network(table)
+
+                except ValueError:
+                    continue
+
+                if ( int(net.network_address), net.prefixlen ) == ( int(match.group(1) ), int(match.group(2) ) ):
+                    continue
+
+                target = storage(layout.get_path(
+                    net.version,
+                    net.prefixlen,
+                    int(net.network_address),
+                    'json' ) )
+
+                target.write(dict(
+                    target.read() or {},
+                    **{ table: data.pop(table) } ) )
+
+            if len(data) < tables:
+                source.write(data)
+
+                moved += tables - len(data)
+
+        return(moved)
+
+    '''
+    Writes until commit are queued as a single group commit batch
+    '''
+    def begin(self):
+        if getattr(self.local, 'depth', 0) == 0:
+            self.local.latched = []
+
+        self.local.depth = getattr(self.local, 'depth', 0) + 1
+
+        transaction_isolated_storage.committer.begin()
+
+    '''
+    '''
+    def commit(self):
+        try:
+            transaction_isolated_storage.committer.commit()
+
+        finally:
+            self.end()
+
+    '''
+    '''
+    def rollback(self):
+        try:
+            transaction_isolated_storage.committer.rollback()
+
+        finally:
+            self.end()
+
+    '''
+    Ends a batch started by begin, the records locked in the batch are unlocked once it's written
+    '''
+    def end(self):
+        self.local.depth -= 1
+
+        if self.local.depth == 0:
+            for locks, key in reversed(self.local.latched):
+                locks.release(key, locks.X)
+
+            self.local.latched = []
+
+    '''
+    Scopes using their own file are found by listing the shard directories of the prefixlen rather than
+    opening a file for every possible child network, scopes sharing a database are found by table name
+    '''
+    def scan(self, s, prefix, owned = None):
+        first = s.network_address_to_big_number()
+        last  = s.network.get_broadcast()
+
+        candidates = (
+            s.use_own_db()
+            and self.get_file_candidates(s, prefix, first, last)
+            or self.get_table_candidates(s, prefix, first, last) )
+
+        for network, records in sorted(
+                candidates,
+                key = lambda c: c[ 0 ] ):
+
+            record = next( (
+                index for index in records
+                if index.get('scope') != None ), None )
+
+            if ( record == None
+                 or record.get('tcp_ip_version') != s.net_obj_ver ):
+                continue
+
+            if owned != None and ( record.get('owner') != None ) != owned:
+                continue
+
+            yield(record)
+
+    '''
+    '''
+    def get_file_candidates(self, s, prefix, first, last):
+        for directory, name in [
+                ( directory, name )
+                for directory in type(s).layout.get_directories(
+                    s.net_obj_ver,
+                    prefix,
+                    first,
+                    last )
+                for name in os.listdir(directory) ]:
+
+            parts = name.split('.')
+
+            if ( len(parts) != 3
+                 or parts[ 2 ] != 'json'
+                 or parts[ 1 ] != str(prefix) ):
+                continue
+
+            network = int(parts[ 0 ])
+
+            if network < first or network > last:
+                continue
+
+            data = type(s).instance_storage(
+                os.path.join(directory, name ) ).read()
+
+            if data == None:
+                continue
+
+            yield( (
+                network,
+                [ record for table in data.values()
+                  for record in table.values() ] ) )
+
+    '''
+    '''
+    def get_table_candidates(self, s, prefix, first, last):
+        for name in s.db.tables():
+            try:
+                net = ip_network(name)
+
+            except ValueError:
+                continue
+
+            if ( net.prefixlen != prefix
+                 or int(net.network_address) < first
+                 or int(net.network_address) > last ):
+                continue
+
+            yield( (
+                int(net.network_address),
+                s.db.table(name).all() ) )
@@ -1,27 +1,182 @@
-import fcntl, json, os
+import copy, fcntl, json, os, threading
 from tinydb.storages import JSONStorage
+from .group_commit import group_commit
 
 
+'''
+Writes are handed to a group commit shared by every process using the data directory, which replaces
+files atomically (write, fsync, rename) so readers never see a partially written file. TinyDB hands write()
+the whole document, only the documents that changed since the current thread's last read() are committed
+and merged into the file's current contents (see group_commit.diff) so that scopes sharing a file don't
+overwrite each other's changes.
+'''
 class transaction_isolated_storage(JSONStorage):
+    committer = group_commit()
 
+    '''
+    The document last read or written is kept per thread, a TinyDB instance (and it's storage) is shared
+    by every thread of the process
+    '''
     def __init__(self, filename):
         self.filename = filename
+        self.local    = threading.local()
 
     def read(self):
-        if not os.path.exists(self.filename) or os.stat(self.filename).st_size == 0:
-            return None
+        pending = self.committer.get_pending(self.filename)
+
+        if pending != None:
+            data = copy.deepcopy(pending)
+
+        elif not os.path.exists(self.filename) or os.stat(self.filename).st_size == 0:
+            data = {}
 
-        with open(self.filename) as handle:
-            fcntl.flock(handle, fcntl.LOCK_SH)
+        else:
+            with open(self.filename) as handle:
+                fcntl.flock(handle, fcntl.LOCK_SH)
 
-            return(json.load(handle) )
+                data = json.load(handle)
+
+        self.local.snapshot = copy.deepcopy(data)
+
+        return(len(data) > 0
+               and data
+               or None )
 
     def write(self, data):
-        with open(self.filename, 'w+') as handle:
-            fcntl.flock(handle, fcntl.LOCK_EX)
+        records = self.committer.diff(getattr(self.local, 'snapshot', {}), data)
+
+        self.local.snapshot = copy.deepcopy(data)
 
-            json.dump(data, handle)
+        if len(records) == 0:
+            return
+
+        self.committer.write(
+            self.filename,
+            copy.deepcopy(data),
+            records )
 
     def close(self):
         pass
 
+
+'''
+Write-ahead log storage, TinyDB hands write() the whole document but only the documents that changed
+since the current thread's last read() are appended to <filename>.wal as one JSON record per line. The
+records are handed to the group commit, they are appended (and fsync'd) with the rest of the unit of
+work's batch or not at all. Once the log grows past checkpoint_size it is folded into <filename> (the
+checkpoint) by a background thread holding the group commit's lock. Log records hold whole documents so
+replaying a record that is already part of the checkpoint (ex: after a crash during a checkpoint) is
+harmless.
+'''
+class write_ahead_log_storage(transaction_isolated_storage):
+    checkpoint_size        = 64 * 1024
+    checkpoints_running    = set()
+    checkpoints_guard      = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename     = filename
+        self.log_filename = filename + '.wal'
+        self.local        = threading.local()
+
+    def read(self):
+        pending = self.committer.get_pending(self.filename)
+
+        if pending != None:
+            data = copy.deepcopy(pending)
+
+        elif not os.path.exists(self.log_filename):
+            data = self.load_checkpoint()
+
+        else:
+            with open(self.log_filename, 'a+') as handle:
+                fcntl.flock(handle, fcntl.LOCK_SH)
+
+                data = self.replay(handle)
+
+        self.local.snapshot = copy.deepcopy(data)
+
+        return(len(data) > 0
+               and data
+               or None )
+
+    def write(self, data):
+        records = self.committer.diff(getattr(self.local, 'snapshot', {}), data)
+
+        self.local.snapshot = copy.deepcopy(data)
+
+        if len(records) == 0:
+            return
+
+        self.committer.write(
+            self.filename,
+            copy.deepcopy(data),
+            records,
+            log = self.log_filename )
+
+        if ( os.path.exists(self.log_filename)
+             and os.stat(self.log_filename).st_size > self.checkpoint_size ):
+            self.start_checkpoint()
+
+    '''
+    Loads the checkpoint and applies every complete record in the log, a torn record at the end of the
+    log (ex: a crash mid-append) is ignored
+    '''
+    def replay(self, handle):
+        data = self.load_checkpoint()
+
+        handle.seek(0)
+
+        for line in handle:
+            if not line.endswith('\n'):
+                break
+
+            self.committer.apply(data, json.loads(line) )
+
+        return(data)
+
+    '''
+    Loads the checkpoint without taking a lock, callers hold the log's lock
+    '''
+    def load_checkpoint(self):
+        if not os.path.exists(self.filename) or os.stat(self.filename).st_size == 0:
+            return({})
+
+        with open(self.filename) as checkpoint:
+            return(json.load(checkpoint) )
+
+    '''
+    Starts a background checkpoint unless one is already running for this file
+    '''
+    def start_checkpoint(self):
+        with self.checkpoints_guard:
+            if self.filename in self.checkpoints_running:
+                return
+
+            self.checkpoints_running.add(self.filename)
+
+        threading.Thread(
+            target = self.checkpoint,
+            daemon = True ).start()
+
+    '''
+    Folds the log into the checkpoint under the group commit's lock, so that no batch is appended to the
+    log meanwhile. The new checkpoint replaces the old one (see group_commit.replace) before the log is
+    truncated.
+    '''
+    def checkpoint(self):
+        try:
+            with self.committer.locked(), open(self.log_filename, 'a+') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+
+                data = self.replay(handle)
+
+                self.committer.replace(self.filename, data)
+
+                handle.truncate(0)
+                handle.flush()
+
+                os.fsync(handle.fileno() )
+
+        finally:
+            with self.checkpoints_guard:
+                self.checkpoints_running.discard(self.filename)
@@ -0,0 +1,325 @@
+import copy, random, threading, time
+from .scope_storage import scope_storage, version_conflict
+
+'''
+Unit of work for scope records. While a unit of work is active on the current thread each scope record
+is read from it's storage backend at most once, every getter is served from memory and changes are
+kept in memory until commit, where each dirty record is written once. Actions that must only happen
+once the records are written (ex: journal entries, bitmap updates) are registered with on_commit, actions
+that must happen once the unit of work ends whether or not it commits (ex: releasing scope locks) are
+registered with on_exit.
+
+Records are written compare-and-swap against the version they were read at (see scope_storage), a commit
+raises version_conflict, before writing anything, if another process wrote one of them since. A unit of
+work is atomic per storage backend, see commit. Use retry to run the unit of work
+again on fresh records, ex: to claim the next free candidate instead of one another worker just claimed.
+
+Units of work do not nest, entering a unit of work while one is active joins the active one.
+
+Callables added with add_listener are run once by every commit that wrote records (ex: to increment the
+storage generation of scope snapshots.)
+
+Simple usage:
+
+from svc.unit_of_work import unit_of_work
+
+with unit_of_work():
+    candidate.claim(id)
+
+candidate = unit_of_work.retry(lambda: parent.get_unassigned_scope().claim(id) )
+
+'''
+class unit_of_work():
+    local = threading.local()
+
+    '''
+    Callables run after every commit that wrote records, see add_listener
+    '''
+    listeners = []
+
+    '''
+    Adds a callable to run after every commit that wrote records, unless it was already added
+    '''
+    @staticmethod
+    def add_listener(listener):
+        if listener not in unit_of_work.listeners:
+            unit_of_work.listeners.append(listener)
+
+    '''
+    Gets the unit of work active on the current thread, or None
+    '''
+    @staticmethod
+    def get_current():
+        return(getattr(unit_of_work.local, 'current', None) )
+
+    '''
+    Runs an action when the active unit of work commits, or immediately when there is none
+    '''
+    @staticmethod
+    def on_commit(action):
+        current = unit_of_work.get_current()
+
+        if current == None:
+            action()
+
+        else:
+            current.actions.append(action)
+
+    '''
+    Runs an action when the active unit of work ends, after it commits or fails, or immediately when there
+    is none
+    '''
+    @staticmethod
+    def on_exit(action):
+        current = unit_of_work.get_current()
+
+        if current == None:
+            action()
+
+        else:
+            current.exits.append(action)
+
+    '''
+    Runs an action in a new unit of work and returns it's result, the action is run again in another unit
+    of work (at most tries times in total) when the commit raises version_conflict, after a random delay
+    that doubles with every attempt so that workers racing for the same records spread out. Within an
+    active unit of work the action is run once, as part of it.
+    '''
+    @staticmethod
+    def retry(action, tries = 16, delay = 0.001):
+        if unit_of_work.get_current() != None:
+            return(action() )
+
+        for attempt in range(tries):
+            try:
+                with unit_of_work():
+                    result = action()
+
+                return(result)
+
+            except version_conflict:
+                if attempt == tries - 1:
+                    raise
+
+            time.sleep(random.uniform(0, min(delay * 2 ** attempt, 0.05) ) )
+
+    def __init__(self):
+        self.entries = {}
+        self.actions = []
+        self.exits   = []
+        self.joined  = False
+
+    def __enter__(self):
+        if unit_of_work.get_current() != None:
+            self.joined = True
+
+            return(unit_of_work.get_current() )
+
+        unit_of_work.local.current = self
+
+        return(self)
+
+    def __exit__(self, ex_type, ex, tb):
+        if self.joined:
+            return(False)
+
+        unit_of_work.local.current = None
+
+        try:
+            if ex_type == None:
+                self.commit()
+
+        finally:
+            for action in reversed(self.exits):
+                action()
+
+            self.exits = []
+
+        return(False)
+
+    '''
+    Gets the cached entry for the specified scope, loading it's record from storage on first use
+    '''
+    def get_entry(self, s):
+        key = scope_storage.get_key(s)
+
+        if key not in self.entries:
+            record = s.storage.get(s)
+
+            self.entries[ key ] = {
+                'scope':    s,
+                'record':   record,
+                'original': copy.deepcopy(record) or {},
+                'stored':   record != None,
+                'fields':   {},
+                'inserted': False,
+                'deleted':  False }
+
+        return(self.entries[ key ])
+
+    '''
+    Drops the cached entry of a scope unless it has changes, so that it's record is read from storage again
+    (ex: once the scope is locked, see scope.acquire_lock)
+    '''
+    def reload(self, s):
+        key   = scope_storage.get_key(s)
+        entry = self.entries.get(key)
+
+        if ( entry != None
+             and not entry.get('inserted')
+             and not entry.get('deleted')
+             and len(entry.get('fields') ) == 0 ):
+
+            self.entries.pop(key)
+
+        return(self)
+
+    '''
+    '''
+    def get(self, s):
+        return(self.get_entry(s).get('record') )
+
+    '''
+    '''
+    def insert(self, s, record):
+        entry = self.get_entry(s)
+
+        if entry.get('record') != None:
+            raise Exception("scope is already allocated, can't insert record")
+
+        entry.update({
+            'record':   dict(record),
+            'inserted': True } )
+
+    '''
+    '''
+    def update(self, s, fields):
+        entry = self.get_entry(s)
+
+        if entry.get('record') == None:
+            raise Exception("scope is not allocated, can't update record")
+
+        entry.get('record').update(fields)
+
+        if not entry.get('inserted'):
+            entry.get('fields').update(fields)
+
+    '''
+    '''
+    def delete(self, s):
+        entry = self.get_entry(s)
+
+        entry.update({
+            'record':   None,
+            'fields':   {},
+            'inserted': False,
+            'deleted':  entry.get('stored') } )
+
+    '''
+    Gets the updated fields of an entry that differ from the stored record, changes that cancel
+    each other out (ex: a field that is set and then set back) are not written
+    '''
+    @staticmethod
+    def get_changed_fields(entry):
+        return( { key: value for key, value in entry.get('fields').items()
+                  if entry.get('original').get(key) != value } )
+
+    '''
+    Raises version_conflict if the stored record of a dirty entry changed since it was read: a record that
+    was read must still be at the same version, a record that is inserted must still be missing
+    '''
+    @staticmethod
+    def validate(entry):
+        s      = entry.get('scope')
+        stored = s.storage.get(s)
+
+        if entry.get('stored'):
+            scope_storage.check_version(
+                s,
+                stored,
+                scope_storage.get_version(entry.get('original') ) )
+
+        elif stored != None:
+            raise version_conflict(str.format(
+                "scope {} was allocated by another process",
+                s.get_network_object() ) )
+
+    '''
+    Writes every dirty record, then runs the actions registered with on_commit and, if records were
+    written, the listeners. Records are written in two phases: every dirty record is locked (see
+    scope.acquire_lock, in key order) and validated against the version it was read at on every storage
+    backend, and only once all of them are current are they written. Records sharing a storage backend are
+    written within one storage transaction, backends of single address scopes (ex: lease tables) before
+    the backends of their pools.
+
+    A unit of work is only atomic per storage backend: if a backend fails while writing (ex: an I/O error)
+    the backends written before it are not rolled back, the write order makes such a partial commit leave
+    leased addresses that their pool still lists (ex: as reserved) rather than the other way around.
+    '''
+    def commit(self):
+        dirty = [ self.entries.get(key) for key in sorted(self.entries)
+                  if self.entries.get(key).get('inserted')
+                  or self.entries.get(key).get('deleted')
+                  or len(self.get_changed_fields(self.entries.get(key) ) ) > 0 ]
+
+        latched = []
+
+        try:
+            for index in dirty:
+                locks = type(index.get('scope') ).locks
+                key   = scope_storage.get_key(index.get('scope') )
+
+                locks.acquire(key, locks.X)
+
+                latched.append( ( locks, key ) )
+
+            for index in dirty:
+                self.validate(index)
+
+            for storage in { id(index.get('scope').storage): index.get('scope').storage
+                             for index in sorted(
+                                 dirty,
+                                 key = lambda e: - e.get('scope').get_prefix() ) }.values():
+
+                storage.begin()
+
+                try:
+                    for index in filter(
+                            lambda e: e.get('scope').storage is storage,
+                            dirty ):
+
+                        if index.get('deleted'):
+                            storage.delete(
+                                index.get('scope'),
+                                scope_storage.get_version(index.get('original') ) )
+
+                        if index.get('inserted'):
+                            storage.insert(
+                                index.get('scope'),
+                                index.get('record') )
+
+                        elif not index.get('deleted'):
+                            storage.update(
+                                index.get('scope'),
+                                self.get_changed_fields(index),
+                                scope_storage.get_version(index.get('original') ) )
+
+                    storage.commit()
+
+                except Exception:
+                    storage.rollback()
+
+                    raise
+
+        finally:
+            for locks, key in reversed(latched):
+                locks.release(key, locks.X)
+
+        for action in self.actions:
+            action()
+
+        if len(dirty) > 0:
+            [ listener() for listener in unit_of_work.listeners ]
+
+        self.entries = {}
+        self.actions = []
@@ -0,0 +1,104 @@
+import os, sys, tempfile, threading, unittest
+from src.svc.lease_table import lease_table
+
+'''
+Hammers a single lease table from several threads of one process, byte-range locks are held by the
+process so that only the table's guard excludes the threads from each other.
+'''
+class test_lease_table(unittest.TestCase):
+    threads = 8
+
+    rounds  = 200
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.interval  = sys.getswitchinterval()
+
+        sys.setswitchinterval(1e-6)
+
+        self.table = lease_table(
+            os.path.join(self.directory.name, '1681915904.20.leases'),
+            4096 ).create()
+
+    def tearDown(self):
+        sys.setswitchinterval(self.interval)
+
+        self.table.close()
+        self.directory.cleanup()
+
+    '''
+    Runs target(index) in every thread and re-raises the first exception of any of them
+    '''
+    def run_threads(self, target):
+        errors = []
+
+        def run(index):
+            try:
+                target(index)
+
+            except Exception as e:
+                errors.append(e)
+
+        threads = [ threading.Thread(target = run, args = ( index, ) ) for index in range(self.threads) ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        if len(errors) > 0:
+            raise errors[ 0 ]
+
+    '''
+    Every thread allocates and frees it's own slots, spread past the initial size so that the table grows
+    meanwhile, the slots of even rounds are kept
+    '''
+    def test_header_count(self):
+        def hammer(index):
+            for offset in range(index, self.threads * self.rounds, self.threads):
+                self.table.write(offset, str(index), lease_table.allocated | lease_table.owned)
+
+                if ( offset // self.threads ) % 2:
+                    self.table.write(offset, None, 0)
+
+        self.run_threads(hammer)
+
+        kept = self.threads * ( ( self.rounds + 1 ) // 2 )
+
+        self.assertEqual(self.table.get_allocated_count(), kept)
+        self.assertEqual(len(list(self.table.allocated_slots() ) ), kept)
+
+    '''
+    Every thread claims the same slot with expected, only one claim of each round succeeds
+    '''
+    def test_compare_and_swap(self):
+        claims = [ [] for round in range(self.rounds) ]
+        start  = threading.Barrier(self.threads)
+
+        def hammer(index):
+            for round in range(self.rounds):
+                start.wait()
+
+                generation = self.table.write(
+                    0,
+                    str(index),
+                    lease_table.allocated | lease_table.owned,
+                    expected = lambda owner, flags, generation: not flags & lease_table.allocated )
+
+                if generation != None:
+                    claims[ round ].append(index)
+
+                start.wait()
+
+                if index == 0:
+                    self.table.write(0, None, 0)
+
+        self.run_threads(hammer)
+
+        self.assertEqual([ len(index) for index in claims ], [ 1 ] * self.rounds)
+        self.assertEqual(self.table.get_allocated_count(), 0)
+        self.assertEqual(self.table.read(0)[ 2 ], 2 * self.rounds)
+
+if __name__ == '__main__':
+    unittest.main()